@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for canonicalizing uploaded cells
+
+Compares calling datatypes.canonicalize for every cell against the
+per-column functions returned by datatypes.canonicalizer.
+
+Usage:
+    python benchmarks/bench_canonicalize.py [NUM_ROWS]
+"""
+import sys
+import timeit
+from datetime import datetime
+
+from ckanext.recombinant.datatypes import canonicalize, canonicalizer
+
+
+COLUMNS = [
+    # (datastore_type, primary_key, choice_field, sample values)
+    ('text', True, False, ['REF-%d' % i for i in range(10)]),
+    ('text', False, False, ['Some description %d' % i for i in range(10)]),
+    ('text', False, True, ['C%d ' % i for i in range(10)]),
+    ('int', False, False, [i * 7 for i in range(10)]),
+    ('year', False, False, ['20%02d' % i for i in range(10)]),
+    ('money', False, False, ['$1,%03d.50' % i for i in range(10)]),
+    ('date', False, False, [datetime(2020, 1, i + 1) for i in range(10)]),
+    ('_text', False, True, ['A,B', 'C', None] * 3 + ['D']),
+    ('numeric', False, False, [None, 1.5, '2.25'] * 3 + [4]),
+]
+
+
+def main(num_rows):
+    rows = [
+        [col[3][i % len(col[3])] for col in COLUMNS]
+        for i in range(num_rows)]
+    canons = [canonicalizer(t, pk, cf) for t, pk, cf, _v in COLUMNS]
+
+    def per_cell():
+        return [
+            [canonicalize(v, t, pk, cf)
+             for (t, pk, cf, _v), v in zip(COLUMNS, row)]
+            for row in rows]
+
+    def per_column():
+        return [
+            [canon(v) for canon, v in zip(canons, row)]
+            for row in rows]
+
+    assert per_cell() == per_column()
+    cells = num_rows * len(COLUMNS)
+    number = 5
+    t_old = min(timeit.repeat(per_cell, number=number, repeat=3)) / number
+    t_new = min(timeit.repeat(per_column, number=number, repeat=3)) / number
+    print('%d rows, %d cells' % (num_rows, cells))
+    print('canonicalize  %7.3fs  %6.2fus/cell' % (t_old, t_old / cells * 1e6))
+    print('canonicalizer %7.3fs  %6.2fus/cell  %5.1fx' % (
+        t_new, t_new / cells * 1e6, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,107 @@
+"""
+Benchmark excel_template generation: the in-memory openpyxl engine against
+the write-only streaming engine, with and without compact templates. Each
+run happens in a fresh process so peak RSS can be measured separately.
+
+Usage:
+    python benchmarks/bench_excel_template.py [NUM_FIELDS] [NUM_ROWS]
+"""
+import multiprocessing
+import resource
+import sys
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+from flask import Flask
+
+from ckanext.recombinant import tables
+from ckanext.recombinant.plugins import RecombinantPlugin
+
+
+FIELD_TYPES = ['text', 'int', 'date', 'money', 'year', 'numeric']
+
+
+def make_geno(num_fields, num_rows):
+    fields = [{
+        'datastore_id': 'ref_number',
+        'datastore_type': 'text',
+        'label': 'Reference Number',
+        'excel_required': True,
+    }]
+    for i in range(1, num_fields):
+        field = {
+            'datastore_id': 'field_%d' % i,
+            'datastore_type': FIELD_TYPES[i % len(FIELD_TYPES)],
+            'label': {'en': 'Field %d' % i, 'fr': 'Champ %d' % i},
+            'excel_required': i % 3 == 0,
+        }
+        if i % 5 == 0:
+            field['datastore_type'] = 'text'
+            field['choices'] = dict(
+                ('C%d' % c, {'en': 'Choice %d' % c, 'fr': 'Choix %d' % c})
+                for c in range(20))
+        fields.append(field)
+    chromo = {
+        'resource_name': 'bench',
+        'dataset_type': 'bench',
+        'title': 'Benchmark',
+        'datastore_primary_key': ['ref_number'],
+        'excel_data_num_rows': num_rows,
+        'fields': fields,
+        'examples': {'record': {}},
+    }
+    return {
+        'dataset_type': 'bench',
+        'title': 'Benchmark',
+        'template_version': 3,
+        'resources': [chromo],
+    }
+
+
+def run(write_only, compact, num_fields, num_rows, results):
+    from ckanext.recombinant.write_excel import excel_template
+
+    geno = make_geno(num_fields, num_rows)
+    plugin = SimpleNamespace()
+    plugin._genos = {'bench': geno}
+    plugin._chromos = {'bench': geno['resources'][0]}
+    RecombinantPlugin._index_definitions(plugin)
+    tables._get_plugin = lambda: plugin
+
+    org = {'name': 'bench-org', 'title': 'Benchmark Org'}
+    with Flask(__name__).test_request_context():
+        start = time.perf_counter()
+        book = excel_template(
+            'bench', org, write_only=write_only, compact=compact)
+        blob = BytesIO()
+        book.save(blob)
+        elapsed = time.perf_counter() - start
+    results.put((
+        elapsed,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        len(blob.getvalue())))
+
+
+def main(num_fields, num_rows):
+    print('%d fields, %d rows' % (num_fields, num_rows))
+    for name, write_only, compact in (
+            ('openpyxl', False, False),
+            ('write-only', True, False),
+            ('compact', False, True),
+            ('compact write-only', True, True)):
+        results = multiprocessing.Queue()
+        p = multiprocessing.Process(
+            target=run,
+            args=(write_only, compact, num_fields, num_rows, results))
+        p.start()
+        elapsed, max_rss, size = results.get()
+        p.join()
+        print('%-18s %7.2fs  peak RSS %7.1f MB  %8d bytes' % (
+            name, elapsed, max_rss / 1024.0, size))
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 40,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
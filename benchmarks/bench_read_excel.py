@@ -0,0 +1,113 @@
+"""
+Benchmark read_excel on uploads with data rows in sheets formatted for
+many more rows, like filled-in excel templates.
+
+Compares the direct XML reader and the openpyxl reader used by read_excel
+with the previous row scanner, which read every formatted row as cells.
+
+Usage:
+    python benchmarks/bench_read_excel.py [DATA_ROWS] [FORMATTED_ROWS] [SHEETS]
+"""
+import datetime
+import sys
+import time
+from io import BytesIO
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Protection
+
+from ckanext.recombinant.read_excel import (
+    read_excel, unescape, _is_bumf, HEADER_ROWS_V3)
+
+
+NUM_COLUMNS = 30
+
+
+def sheet_names(sheets):
+    return ['bench-%d' % i for i in range(sheets)]
+
+
+def make_upload(data_rows, formatted_rows, sheets):
+    book = Workbook()
+    book.remove(book.active)
+    unlocked = Protection(locked=False)
+    for name in sheet_names(sheets):
+        sheet = book.create_sheet(name)
+        sheet.cell(row=3, column=1).value = 'v3'
+        sheet.cell(row=3, column=2).value = 'bench-org'
+        for col in range(3, NUM_COLUMNS + 3):
+            sheet.cell(row=3, column=col).value = 'field_%d' % col
+        sheet.cell(row=5, column=1).value = 'e.g.'
+        for row in range(6, formatted_rows + 6):
+            sheet.cell(row=row, column=1).value = '=IF(e1!A%d>0,"!","")' % row
+            for col in range(3, NUM_COLUMNS + 3):
+                c = sheet.cell(row=row, column=col)
+                c.protection = unlocked
+                if row >= data_rows + 6:
+                    continue
+                if col % 3 == 0:
+                    c.value = 'value %d %d' % (row, col)
+                elif col % 3 == 1:
+                    c.value = row * col
+                else:
+                    c.value = datetime.datetime(2020, 1, 1 + col % 28)
+    blob = BytesIO()
+    book.save(blob)
+    return blob.getvalue()
+
+
+def old_read_excel(f):
+    wb = load_workbook(f, read_only=True)
+    for sheetname in wb.sheetnames:
+        sheet = wb[sheetname]
+        rowiter = sheet.rows
+        next(rowiter)
+        next(rowiter)
+        names_row = next(rowiter)
+        next(rowiter)
+        next(rowiter)
+        yield (
+            sheetname,
+            names_row[1].value,
+            [c.value for c in names_row[2:]],
+            old_filter_bumf((row[2:] for row in rowiter), HEADER_ROWS_V3))
+
+
+def old_filter_bumf(rowiter, header_rows):
+    i = header_rows
+    for row in rowiter:
+        i += 1
+        values = [
+            unescape(c.value) if isinstance(c.value, str) else c.value
+            for c in row]
+        if not all(_is_bumf(v) for v in values):
+            yield i, values
+
+
+def consume(reader, data):
+    start = time.perf_counter()
+    found = []
+    for sheet, _org, _names, rows in reader(BytesIO(data)):
+        found.extend((sheet, n, values[:NUM_COLUMNS]) for n, values in rows)
+    return time.perf_counter() - start, found
+
+
+def main(data_rows, formatted_rows, sheets):
+    data = make_upload(data_rows, formatted_rows, sheets)
+    names = sheet_names(sheets)
+    print('%d sheets of %d data rows in %d formatted rows, %d bytes' % (
+        sheets, data_rows, formatted_rows, len(data)))
+    t_old, old_rows = consume(old_read_excel, data)
+    print('previous scanner %7.3fs' % t_old)
+    for reader in ('openpyxl', 'xlsx'):
+        t_new, new_rows = consume(
+            lambda f: read_excel(f, names, reader=reader), data)
+        assert old_rows == new_rows, reader
+        print('%-16s %7.3fs  %5.1fx' % (reader, t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 1)
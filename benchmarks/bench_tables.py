@@ -0,0 +1,95 @@
+"""
+Micro-benchmark for resource name lookups in ckanext.recombinant.tables
+
+Compares the indexed lookups built by RecombinantPlugin against the
+previous linear scans for a few hundred generated definitions.
+
+Usage:
+    python benchmarks/bench_tables.py [NUM_DEFINITIONS]
+"""
+import sys
+import timeit
+from types import SimpleNamespace
+
+from ckanext.recombinant import tables
+from ckanext.recombinant.plugins import RecombinantPlugin
+
+
+def make_definitions(n):
+    chromos = {}
+    genos = {}
+    for i in range(n):
+        dataset_type = 'type-%03d' % i
+        resources = []
+        for j in range(2):
+            chromo = {
+                'resource_name': 'resource-%03d-%d' % (i, j),
+                'dataset_type': dataset_type,
+                'datastore_primary_key': ['id'],
+                'fields': [
+                    {'datastore_id': 'id', 'datastore_type': 'text'},
+                    {'datastore_id': 'value', 'datastore_type': 'int'},
+                ],
+            }
+            resources.append(chromo)
+            chromos[chromo['resource_name']] = chromo
+        genos[dataset_type] = {
+            'dataset_type': dataset_type,
+            'resources': resources,
+        }
+    return chromos, genos
+
+
+def old_get_chromo(plugin, resource_name):
+    chromos = plugin._chromos
+    try:
+        return chromos[resource_name]
+    except KeyError:
+        for rname in chromos:
+            if rname.replace('-', '') == resource_name:
+                return chromos[rname]
+        raise KeyError(resource_name)
+
+
+def old_get_dataset_type_for_resource_name(plugin, resource_name):
+    for t in sorted(plugin._genos):
+        for resource in plugin._genos[t]['resources']:
+            if resource['resource_name'] == resource_name:
+                return t
+
+
+def main(n):
+    plugin = SimpleNamespace()
+    plugin._chromos, plugin._genos = make_definitions(n)
+    RecombinantPlugin._index_definitions(plugin)
+    tables._get_plugin = lambda: plugin
+
+    last = list(plugin._chromos)[-1]
+    stripped = last.replace('-', '')
+    number = 2000
+
+    cases = [
+        ('get_chromo (dash-stripped)',
+         lambda: old_get_chromo(plugin, stripped),
+         lambda: tables.get_chromo(stripped)),
+        ('get_dataset_type_for_resource_name',
+         lambda: old_get_dataset_type_for_resource_name(plugin, last),
+         lambda: tables.get_dataset_type_for_resource_name(last)),
+        ('get_dataset_types',
+         lambda: sorted(plugin._genos),
+         tables.get_dataset_types),
+    ]
+    print('%d definitions, %d calls each' % (n, number))
+    for name, old, new in cases:
+        assert old() == new()
+        t_old = timeit.timeit(old, number=number)
+        t_new = timeit.timeit(new, number=number)
+        print('%-36s old %8.2fus  new %6.2fus  %6.1fx' % (
+            name,
+            t_old / number * 1e6,
+            t_new / number * 1e6,
+            t_old / t_new))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
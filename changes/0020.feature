@@ -0,0 +1 @@
+Added `--fast` option to the `load-csv` subcommand. Each batch is streamed into a temporary table with `COPY FROM STDIN` and merged into the resource table in a single statement. Batches with errors are loaded record by record to report the errors.
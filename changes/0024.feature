@@ -0,0 +1 @@
+Added a `--jobs N` option to the `combine` subcommand. It exports resource names in parallel worker processes, each with its own database connections. Output files are written to a temporary file and renamed into place. Row and byte totals are reported as each resource finishes.
@@ -0,0 +1 @@
+Added a `--jobs N` option to the `load-csv` subcommand. It loads organization batches in parallel worker processes, each with its own write connection. Batches for the same organization are still loaded in order. Errors are reported in file order, and the exit codes are unchanged.
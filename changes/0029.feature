@@ -0,0 +1 @@
+Excel templates can now be cached on disk as `.xlsx` bytes by setting `recombinant.template_cache_dir`. Entries are keyed by dataset type, language, definition hash, organization and choice lists. The least recently used templates are evicted past `recombinant.template_cache_size`. The new `ckan recombinant warm-templates` command fills the cache for every dataset type and language.
@@ -0,0 +1 @@
+`excel_template` accepts `write_only=True`, which streams the data entry rows and the hidden calculation sheets row by row into an openpyxl write-only workbook. The resulting workbooks read back identically, and generation uses much less memory. Template downloads and the `template` subcommand use it. `benchmarks/bench_excel_template.py` compares both engines.
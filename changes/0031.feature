@@ -0,0 +1 @@
+Compact excel templates style each data entry column once and check each column with one conditional formatting rule instead of the hidden error and required calculation sheets, so no per-row cells are written. Enable them with `recombinant.compact_templates = true` or `excel_template(..., compact=True)`.
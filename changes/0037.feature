@@ -0,0 +1 @@
+Uploads are read with a new direct XML reader that parses sheet and shared string XML straight from the `.xlsx` file. Set `recombinant.upload_reader = openpyxl` to use openpyxl instead.
@@ -0,0 +1 @@
+Uploaded records are now checked against the table definition before they are loaded. The checks cover required values, choices, `max_chars`, number and date values, and primary keys repeated within the file, and errors for every bad row are reported together. `ckan recombinant load-csv --pre-validate` runs the same checks.
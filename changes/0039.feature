@@ -0,0 +1 @@
+Large Excel uploads can be loaded by a background job. Set `recombinant.async_upload_min_bytes` to enable this. The upload page polls the new `/recombinant/upload-status/<job_id>` endpoint and shows rows read, rows loaded and errors.
@@ -0,0 +1 @@
+New sysadmin-only `recombinant_show_many` action returns the `recombinant_show` status of many dataset types and organizations at once, reading datasets, resources and datastore tables with a few set-based queries. The `ckan recombinant show`, `update`, `remove-empty` and `delete` commands now use it instead of calling `recombinant_show` for every organization.
@@ -0,0 +1 @@
+New `recombinant.row_count` setting selects how `recombinant_show` counts table rows: `exact` (default), `estimate` from `pg_class.reltuples`, `cached` exact counts cleared after upserts and deletes, or `none` to skip counts. `recombinant_show` and `recombinant_show_many` accept a `row_count` parameter to override it, and pages that only check the table schema no longer count rows.
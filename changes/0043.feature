@@ -0,0 +1 @@
+`recombinant_update` and `ckan recombinant update` compare each datastore table with its definition and only update tables with differences, so a forced update no longer recreates indexes and triggers on every table. `ckan recombinant update --plan` (or `plan=True`) lists the changes for each table without updating anything.
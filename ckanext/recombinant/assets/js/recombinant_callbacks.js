@@ -32,6 +32,44 @@ window.addEventListener('load', function(){
     // NOTE: wet-boew tabs repaints contents of tab bodies, have to wait a bit...
     setTimeout(_bind_recombinant_validity, 750);
 
+    let uploadStatus = $('.recombinant-upload-status');
+    if( uploadStatus.length > 0 ){
+      function _poll_upload_status(){
+        $.getJSON($(uploadStatus).attr('data-status-url'), function(status){
+          if( status.status == 'complete' ){
+            $(uploadStatus).removeClass('alert-info').addClass('alert-success');
+            $(uploadStatus).text($(uploadStatus).attr(
+              status.dry_run ? 'data-dry-run-text' : 'data-complete-text'));
+            return;
+          }
+          if( status.status == 'error' ){
+            $(uploadStatus).removeClass('alert-info').addClass('alert-danger');
+            if( status.outdated && status.outdated_html ){
+              // same message and refresh form as uploads processed immediately
+              $(uploadStatus).html(status.outdated_html);
+              return;
+            }
+            $(uploadStatus).empty();
+            $(status.errors).each(function(_index, _error){
+              $(_error.split('\n')).each(function(_lineIndex, _line){
+                $('<p>').text(_line).appendTo(uploadStatus);
+              });
+            });
+            return;
+          }
+          if( status.status == 'running' ){
+            $(uploadStatus).text($(uploadStatus).attr('data-progress-text')
+              .replace('{0}', status.rows_parsed)
+              .replace('{1}', status.rows_written));
+          }
+          setTimeout(_poll_upload_status, 2000);
+        }).fail(function(){
+          setTimeout(_poll_upload_status, 5000);
+        });
+      }
+      _poll_upload_status();
+    }
+
     let orgSelect = $('.recombinant-org-field');
     if( orgSelect.length > 0 ){
       $(orgSelect).on('change', function(_event){
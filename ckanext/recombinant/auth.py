@@ -68,3 +68,14 @@ def datastore_delete(up_func: AuthFunction,
                 'msg': _("Cannot delete Datastore for type: %s. "
                          "Use datastore_records_delete instead.") % pkg.type}
     return up_func(context, data_dict)
+
+
+def recombinant_show_many(context: Context,
+                          data_dict: Optional[DataDict]) -> AuthResult:
+    """
+    Only sysadmins may read the status of many Recombinant
+    datasets at once.
+    """
+    return {'success': False,
+            'msg': _('User %s not authorized to show Recombinant '
+                     'datasets for all organizations') % str(context['user'])}
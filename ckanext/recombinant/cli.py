@@ -5,37 +5,61 @@ import sys
 import json
 import re
 import logging
+import multiprocessing
+import tempfile
+from collections import deque
 from contextlib import contextmanager
+from io import StringIO
 from pathlib import Path
 from openpyxl.formula import Tokenizer
 import sqlalchemy as sa
+import psycopg2
 
-from typing import Dict, List, Any, Optional, TextIO
+from typing import (
+    Callable, Deque, Dict, Iterator, List, Any, Optional, TextIO, Tuple, Union)
 from ckan.types import ErrorDict
+from ckan import model
 
 from ckan.logic import ValidationError
+from ckan.plugins.toolkit import aslist, check_access, config, request
+from flask_babel import force_locale
 from ckanapi import LocalCKAN, NotFound
 from ckanext.datastore.helpers import is_valid_field_name
 from ckanext.datastore.backend import DatastoreBackend
-from ckanext.datastore.backend.postgres import DatastorePostgresqlBackend
+from ckanext.datastore.backend.postgres import (
+    _dispose_engines as _dispose_datastore_engines,
+    DatastorePostgresqlBackend,
+    identifier
+)
 
 from ckanext.recombinant.tables import (
     get_dataset_type_for_resource_name,
     get_dataset_types,
     get_chromo,
+    get_field_index,
     get_geno,
     get_target_datasets,
     get_resource_names,
     get_reference_tables_sql,
 )
 from ckanext.recombinant.read_csv import csv_data_batch
+from ckanext.recombinant.validation import record_validator
+from ckanext.recombinant.row_counts import clear_row_counts
 from ckanext.recombinant.write_excel import excel_template
-from ckanext.recombinant.logic import _update_triggers
+from ckanext.recombinant.template_cache import (
+    excel_template_bytes,
+    template_cache_dir
+)
+from ckanext.recombinant.logic import _update_triggers, find_dataset_ids
 from ckanext.recombinant.errors import RecombinantFieldError
 
 
 BOM = "\N{bom}"
-DATASTORE_PAGINATE = 10000  # max records for single datastore query
+STREAM_ROWS = 10000  # rows fetched at a time from server-side cursors
+# temporary table datastore_upsert creates for datastore_app_context_flags,
+# one row with a boolean column per flag. --fast loads create the same
+# table, test_cli checks that both layouts match
+APP_CONTEXT_TABLE = 'datastore_app_context'
 
 
 @contextmanager
@@ -239,18 +263,28 @@ def show(dataset_type: Optional[str] = None,
     is_flag=True,
     help="All dataset types/resource names",
 )
+@click.option(
+    "-f",
+    "--force",
+    is_flag=True,
+    help="Replace trigger functions even if their definitions are unchanged",
+)
 @click.option('-v', '--verbose', is_flag=True,
               type=click.BOOL, help='Increase verbosity.')
 def create_triggers(dataset_type: Optional[List[str]] = None,
                     all_types: bool = False,
+                    force: bool = False,
                     verbose: bool = False):
     """
     Create and update triggers
 
+    Trigger functions are only replaced when their definitions have
+    changed, unless --force is used.
+
     Full Usage:\n
-        recombinant create-triggers (-a | DATASET_TYPE ...)
+        recombinant create-triggers (-a | DATASET_TYPE ...) [-f]
     """
-    _create_triggers(dataset_type, all_types, verbose=verbose)
+    _create_triggers(dataset_type, all_types, force=force, verbose=verbose)
 
 
 @recombinant.command(
@@ -316,6 +350,17 @@ def remove_empty(dataset_type: Optional[List[str]] = None,
     "--dataset",
     help="A dataset ID to update all resource tables for."
 )
+@click.option(
+    "--alter-types",
+    is_flag=True,
+    help="Change the types of existing fields that differ from the Schema",
+)
+@click.option(
+    "-p",
+    "--plan",
+    is_flag=True,
+    help="Show the changes required for each table without updating",
+)
 @click.option('-v', '--verbose', is_flag=True,
               type=click.BOOL, help='Increase verbosity.')
 @click.option('-L', '--no-log-suppression', is_flag=True,
@@ -325,17 +370,26 @@ def update(dataset_type: Optional[List[str]] = None,
            force_update: bool = False,
            delete_fields: bool = False,
            dataset: Optional[str] = None,
+           alter_types: bool = False,
+           plan: bool = False,
            verbose: bool = False,
            no_log_suppression: bool = False):
     """
     Triggers recombinant update for recombinant resources
 
+    Only tables that differ from their definition are updated: missing
+    tables and columns, or with --force-update any difference in columns,
+    primary keys, indexes, foreign keys or triggers. Column types are
+    only changed with --alter-types.
+
     Full Usage:\n
-        recombinant update (-a | DATASET_TYPE ...) [-f]
+        recombinant update (-a | DATASET_TYPE ...) [-f] [-d] [--alter-types]
+                           [-p]
     """
     if no_log_suppression:
         _update(dataset_type, all_types, force_update, delete_fields,
-                dataset_id=dataset, verbose=verbose)
+                dataset_id=dataset, alter_types=alter_types, plan=plan,
+                verbose=verbose)
         return
 
     with (
@@ -345,7 +399,8 @@ def update(dataset_type: Optional[List[str]] = None,
         suppress_logging('ckanext.datastore.backend.postgres')
     ):
         _update(dataset_type, all_types, force_update, delete_fields,
-                dataset_id=dataset, verbose=verbose)
+                dataset_id=dataset, alter_types=alter_types, plan=plan,
+                verbose=verbose)
 
 
 @recombinant.command(short_help="Delete recombinant datasets and all their data.")
@@ -397,6 +452,16 @@ def delete(dataset_type: Optional[List[str]] = None,
               help='Skip all pSQL validation.')
 @click.option('-E', '--error-file', type=click.File('w'),
               help='Output CSV or JSONL file for errors instead of stderr')
+@click.option('-F', '--fast', is_flag=True,
+              help='COPY each batch into a temporary table and merge it into '
+                   'the resource table in a single statement. Batches that '
+                   'fail are loaded again record by record to report errors.')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of organizations to load in parallel')
+@click.option('-P', '--pre-validate', is_flag=True,
+              help='Check records against the resource definition before '
+                   'loading them. Records with errors are reported and '
+                   'not sent to the database.')
 @click.option('-v', '--verbose', is_flag=True,
               type=click.BOOL, help='Increase verbosity.')
 @click.option('-L', '--no-log-suppression', is_flag=True,
@@ -407,6 +472,9 @@ def load_csv(csv_file: List[TextIO],
              flag: Optional[List[str]] = None,
              skip_validation: Optional[bool] = False,
              error_file: Optional[TextIO] = None,
+             fast: bool = False,
+             jobs: int = 1,
+             pre_validate: bool = False,
              verbose: bool = False,
              no_log_suppression: bool = False):
     """
@@ -439,11 +507,15 @@ def load_csv(csv_file: List[TextIO],
         if not is_valid_field_name(_f) or ' ' in _f:
             raise click.ClickException('Invalid flag name "%s" for pSQL column' % _f)
     if skip_validation:
+        if pre_validate:
+            raise click.ClickException(
+                'Cannot use --pre-validate with --skip-validation')
         flags.append('skip_validation')
 
     if no_log_suppression:
         _load_csv_files(csv_file, resource_name, organization, flags,
-                        error_file, output_file_format, verbose)
+                        error_file, output_file_format, verbose, fast=fast,
+                        jobs=jobs, pre_validate=pre_validate)
         return
 
     with (
@@ -453,7 +525,8 @@ def load_csv(csv_file: List[TextIO],
         suppress_logging('ckanext.datastore.backend.postgres')
     ):
         _load_csv_files(csv_file, resource_name, organization, flags,
-                        error_file, output_file_format, verbose)
+                        error_file, output_file_format, verbose, fast=fast,
+                        jobs=jobs, pre_validate=pre_validate)
 
 
 @recombinant.command(
@@ -472,19 +545,28 @@ def load_csv(csv_file: List[TextIO],
     required=True,
     help="Save CSV files to DIR/RESOURCE_NAME.csv instead of streaming to STDOUT",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of resource names to export in parallel",
+)
 @click.option('-v', '--verbose', is_flag=True,
               type=click.BOOL, help='Increase verbosity.')
 def combine(resource_name: Optional[List[str]],
             all_types: bool = False,
             output_dir: Optional[str] = None,
+            jobs: int = 1,
             verbose: bool = False):
     """
     Output all datastore data to CSV for given resource names
 
     Full Usage:\n
-        recombinant combine (-a | RESOURCE_NAME ...) [-d DIR ]
+        recombinant combine (-a | RESOURCE_NAME ...) -d DIR [-j N]
     """
-    _combine_csv(output_dir, resource_name, all_types, verbose=verbose)
+    _combine_csv(output_dir, resource_name, all_types, verbose=verbose,
+                 jobs=jobs)
 
 
 @recombinant.command(short_help="Output configured target datasets.")
@@ -585,25 +667,51 @@ def template(dataset_type: str,
     _template(dataset_type, org_name, output_file, verbose=verbose)
 
 
+@recombinant.command(
+        short_help="Generate cached excel templates for every organization.")
+@click.argument("dataset_type", required=False, nargs=-1)
+@click.option('-v', '--verbose', is_flag=True,
+              type=click.BOOL, help='Increase verbosity.')
+@click.pass_context
+def warm_templates(ctx: click.Context,
+                   dataset_type: Optional[List[str]],
+                   verbose: bool = False):
+    """
+    Generate excel templates in recombinant.template_cache_dir for
+    all organizations with datasets of each type, in every offered
+    language
+
+    Full Usage:\n
+        recombinant warm-templates [DATASET_TYPE ...]
+    """
+    if not template_cache_dir():
+        raise click.ClickException(
+            'recombinant.template_cache_dir is not configured')
+    with ctx.meta['flask_app'].test_request_context():
+        _warm_templates(dataset_type, verbose=verbose)
+
+
 def _get_orgs() -> List[str]:
     lc = LocalCKAN()
     return lc.action.organization_list()
 
 
-def _get_packages(dataset_type: str,
-                  orgs: List[str],
-                  ignore_errors: bool = False) -> List[Dict[str, Any]]:
+def _get_packages(dataset_types: List[str],
+                  orgs: Optional[List[str]] = None,
+                  row_count: Optional[str] = None) -> Dict[
+                      str, List[Dict[str, Any]]]:
+    """
+    return {dataset_type: [recombinant_show status, ...]} for orgs
+    (default: all orgs) from a single recombinant_show_many call,
+    row_count overrides the recombinant.row_count strategy
+    """
+    packages: Dict[str, List[Dict[str, Any]]] = {t: [] for t in dataset_types}
+    if not dataset_types:
+        return packages
     lc = LocalCKAN()
-    packages = []
-    for o in orgs:
-        try:
-            result = lc.action.recombinant_show(
-                dataset_type=dataset_type,
-                owner_org=o,
-                ignore_errors=ignore_errors)
-            packages.append(result)
-        except NotFound:
-            continue
+    for p in lc.action.recombinant_show_many(
+            dataset_types=dataset_types, owner_orgs=orgs, row_count=row_count):
+        packages[p['dataset_type']].append(p)
     return packages
 
 
@@ -615,12 +723,13 @@ def _show(dataset_type: Optional[str],
     """
     orgs = [org_name] if org_name else _get_orgs()
     types = [dataset_type] if dataset_type else get_dataset_types()
+    packages_by_type = _get_packages(types, [org_name] if org_name else None)
 
     for dtype in types:
         click.echo('{geno[title]} ({dtype})'.format(
             geno=get_geno(dtype), dtype=dtype).encode('utf-8'))
 
-        packages = _get_packages(dtype, orgs)
+        packages = packages_by_type[dtype]
         if dataset_type:
             for p in packages:
                 click.echo(p['owner_org'])
@@ -633,7 +742,8 @@ def _show(dataset_type: Optional[str],
                     if 'error' in r:
                         click.echo('    *** {r[error]}'.format(r=r))
                     else:
-                        click.echo('rows:{r[datastore_rows]}'.format(r=r))
+                        click.echo('rows:{0}'.format(
+                            r.get('datastore_rows', '-')))
                         if not r['datastore_correct']:
                             click.echo('   ! datastore needs to be updated')
                         if not r['metadata_correct']:
@@ -651,38 +761,67 @@ def _update(dataset_types: Optional[List[str]],
             force_update: bool = False,
             delete_fields: bool = False,
             dataset_id: Optional[str] = None,
+            alter_types: bool = False,
+            plan: bool = False,
             verbose: bool = False):
     """
     Triggers recombinant update for recombinant resources
     """
-    orgs = _get_orgs()
-    lc = LocalCKAN()
+    # check and deploy each trigger function once for the whole run
+    lc = LocalCKAN(context={'recombinant_trigger_hashes': {}})
     if dataset_id:
         dataset_dict = lc.action.package_show(id=dataset_id)
-        click.echo('%s %s updating single dataset %s' % (
+        click.echo('%s %s %s single dataset %s' % (
             dataset_dict['type'],
             dataset_dict['organization']['name'],
+            'planning' if plan else 'updating',
             dataset_id))
-        lc.action.recombinant_update(
+        _echo_table_plans(lc.action.recombinant_update(
             owner_org=dataset_dict['organization']['name'],
             dataset_type=dataset_dict['type'],
             dataset_id=dataset_id,
             force_update=force_update,
-            delete_fields=delete_fields)
+            delete_fields=delete_fields,
+            alter_types=alter_types,
+            plan=plan), plan or verbose)
         return
-    for dtype in _expand_dataset_types(dataset_types, all_types):
-        packages = _get_packages(dtype, orgs)
-        existing = dict((p['owner_org'], p) for p in packages)
-        for o in orgs:
-            if o in existing:
-                if existing[o]['all_correct']:
-                    if not force_update:
-                        continue
-                click.echo('%s %s updating' % (dtype, o))
-                lc.action.recombinant_update(
-                    owner_org=o, dataset_type=dtype,
-                    force_update=force_update,
-                    delete_fields=delete_fields)
+    types = _expand_dataset_types(dataset_types, all_types)
+    packages_by_type = _get_packages(types, row_count='none')
+    for dtype in types:
+        for p in packages_by_type[dtype]:
+            if p['all_correct'] and not force_update:
+                continue
+            if not plan:
+                click.echo('%s %s updating' % (dtype, p['owner_org']))
+            table_plans = lc.action.recombinant_update(
+                owner_org=p['owner_org'], dataset_type=dtype,
+                dataset_id=p['id'],
+                force_update=force_update,
+                delete_fields=delete_fields,
+                alter_types=alter_types,
+                plan=plan)
+            if plan and table_plans:
+                click.echo('%s %s plan' % (dtype, p['owner_org']))
+            _echo_table_plans(table_plans, plan or verbose)
+
+
+def _echo_table_plans(table_plans: List[Dict[str, Any]], verbose: bool):
+    """
+    Display the changes from recombinant_update for each table, and
+    any tables that could not be updated
+    """
+    for table_plan in table_plans:
+        if not verbose and 'error' not in table_plan:
+            continue
+        click.echo('  %s %s' % (
+            table_plan['resource_name'],
+            table_plan['resource_id'] or '(new resource)'))
+        if 'error' in table_plan:
+            click.echo('    error: %s' % table_plan['error'], err=True)
+        if not verbose:
+            continue
+        for change, value in sorted(table_plan['changes'].items()):
+            click.echo('    %s: %s' % (change, json.dumps(value)))
 
 
 def _expand_dataset_types(dataset_types: Optional[List[str]],
@@ -709,14 +848,16 @@ def _expand_resource_names(resource_names: Optional[List[str]],
 
 def _create_triggers(dataset_types: Optional[List[str]],
                      all_types: bool = False,
+                     force: bool = False,
                      verbose: bool = False):
     """
     Create and update triggers
     """
     lc = LocalCKAN()
+    deployed: Dict[str, str] = {}
     for dtype in _expand_dataset_types(dataset_types, all_types):
         for chromo in get_geno(dtype)['resources']:
-            _update_triggers(lc, chromo)
+            _update_triggers(lc, chromo, force=force, deployed=deployed)
             if verbose:
                 click.echo('Updated triggers for %s' % chromo['resource_name'])
 
@@ -727,11 +868,11 @@ def _remove_empty(dataset_types: Optional[List[str]],
     """
     Delete datastore tables and packages for empty recombinant resources
     """
-    orgs = _get_orgs()
     lc = LocalCKAN()
-    for dtype in _expand_dataset_types(dataset_types, all_types):
-        packages = _get_packages(dtype, orgs)
-        for p in packages:
+    types = _expand_dataset_types(dataset_types, all_types)
+    packages_by_type = _get_packages(types, row_count='exact')
+    for dtype in types:
+        for p in packages_by_type[dtype]:
             if not any(r['datastore_rows'] for r in p['resources']):
                 click.echo('deleting %s %s' % (dtype, p['owner_org']))
                 for r in p['resources']:
@@ -750,11 +891,11 @@ def _delete(dataset_types: Optional[List[str]],
     """
     Delete recombinant datasets and all their data
     """
-    orgs = _get_orgs()
     lc = LocalCKAN()
-    for dtype in _expand_dataset_types(dataset_types, all_types):
-        packages = _get_packages(dtype, orgs, ignore_errors=True)
-        for p in packages:
+    types = _expand_dataset_types(dataset_types, all_types)
+    packages_by_type = _get_packages(types, row_count='none')
+    for dtype in types:
+        for p in packages_by_type[dtype]:
             click.echo('deleting %s %s' % (dtype, p['owner_org']))
             for r in p['resources']:
                 try:
@@ -776,7 +917,10 @@ def _load_csv_files(csv_file_names: List[TextIO],
                     flags: Optional[List[str]] = None,
                     error_file: Optional[TextIO] = None,
                     output_file_format: Optional[str] = None,
-                    verbose: bool = False) -> int:
+                    verbose: bool = False,
+                    fast: bool = False,
+                    jobs: int = 1,
+                    pre_validate: bool = False) -> int:
     """
     Load CSV file(s) rows into recombinant resources datastore
     """
@@ -785,7 +929,8 @@ def _load_csv_files(csv_file_names: List[TextIO],
         # pass click.File prop
         errs |= _load_one_csv_file(n.name, resource_name,
                                    organization, flags, error_file,
-                                   output_file_format, verbose)
+                                   output_file_format, verbose, fast=fast,
+                                   jobs=jobs, pre_validate=pre_validate)
     return errs  # exit code return
 
 
@@ -794,9 +939,19 @@ def _load_one_csv_file(name: str, resource_name: str = '',
                        flags: Optional[List[str]] = None,
                        error_file: Optional[TextIO] = None,
                        output_file_format: Optional[str] = 'jsonl',
-                       verbose: bool = False) -> int:
+                       verbose: bool = False,
+                       fast: bool = False,
+                       jobs: int = 1,
+                       pre_validate: bool = False) -> int:
     """
     Load CSV file rows into recombinant resources datastore
+
+    fast - COPY each batch into the table, falling back to
+        datastore_upsert for batches that contain errors
+    jobs - number of worker processes loading organizations in parallel,
+        batches for the same organization are still loaded in order
+    pre_validate - check records with record_validator before loading,
+        reporting bad records without sending them to the database
     """
     if verbose:
         if error_file:
@@ -817,118 +972,103 @@ def _load_one_csv_file(name: str, resource_name: str = '',
         click.echo('Organization name: %s' % organization)
     chromo = get_chromo(resource_name)
 
-    dataset_type = chromo['dataset_type']
-    method = 'upsert' if chromo.get('datastore_primary_key') else 'insert'
-    lc = LocalCKAN(context={'datastore_app_context_flags': flags} if flags else {})
     error_count = 0
     bad_record_count = 0
     skipped_orgs = 0
 
-    # dynamic fields
-    dynamic_fields = [
-        'owner_org',
-        'owner_org_title',
-        'record_created',
-        'record_modified',
-        'user_modified'
-    ]
-    if 'csv_org_extras' in chromo:
-        dynamic_fields += chromo['csv_org_extras']
-    dynamic_fields += [f['datastore_id'] for f in chromo['fields'] if
-                       f.get('published_resource_computed_field', False)]
-
     with error_outputter(error_file, output_file_format) as write_error:
-        for org_name, records in csv_data_batch(name, chromo,
-                                                ignore_fields=dynamic_fields):
-            if not org_name and not organization:
-                click.echo('could not find any org!')
-                return 1
-            if not org_name and organization:
-                org_name = organization
-            elif organization and org_name != organization:
-                skipped_orgs += 1
-                continue
-            results = lc.action.package_search(
-                q='type:%s AND organization:%s' % (dataset_type, org_name),
-                include_private=True,
-                rows=2)['results']
-
-            if not results:
-                lc.action.recombinant_create(dataset_type=dataset_type,
-                                             owner_org=org_name)
-                results = lc.action.package_search(
-                    q='type:%s AND organization:%s' % (dataset_type, org_name),
-                    include_private=True,
-                    rows=2)['results']
-
-            if len(results) > 1:
-                click.echo('type:%s organization:%s multiple found!' % (
-                    dataset_type, org_name))
-                return 1
-
-            for res in results[0]['resources']:
-                if res['name'] == resource_name:
-                    break
-            else:
-                click.echo('type:%s organization:%s missing resource:%s' % (
-                    dataset_type, org_name, resource_name))
-                return 1
-
-            # convert list values to lists
-            list_fields = [f['datastore_id'] for f in chromo['fields'] if
-                           f['datastore_type'] == '_text' and
-                           not f.get('published_resource_computed_field')]
-            if list_fields:
-                for r in records:
-                    for k in list_fields:
-                        if not r[k]:
-                            r[k] = []
-                        else:
-                            r[k] = r[k].split(',')
 
-            click.echo('- %s %s' % (org_name, len(records)))
+        def _write_bad_record(org_name: str,
+                              error: Dict[str, Any],
+                              record: Dict[str, Any]):
+            nonlocal error_count, bad_record_count
+            bad_record_count += 1
+            error_count += sum(len(v) for v in error.values())
+            # write errors to output
+            # type_ignore_reason: incomplete typing
+            write_error(org_name, error, record)  # type: ignore
+
+        if jobs > 1:
+            # child processes must not share the parent's db connections
+            _dispose_engines()
+            pool = multiprocessing.get_context('fork').Pool(
+                jobs, initializer=_dispose_engines)
+        else:
+            pool = None
+            lc = LocalCKAN(
+                context={'datastore_app_context_flags': flags} if flags else {})
+        pending: Deque[Tuple[str, Any]] = deque()
+        # one validator per org to find duplicate keys across batches
+        validators: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+        def _finish_one() -> int:
+            """
+            Report the results of the oldest batch sent to the pool
+            """
+            org_name, result = pending.popleft()
+            rval, messages, bad_records = result.get()
+            for m in messages:
+                click.echo(m)
+            for error, record in bad_records:
+                _write_bad_record(org_name, error, record)
+            return rval
+
+        try:
+            for org_name, records in csv_data_batch(
+                    name, chromo, ignore_fields=_dynamic_fields(chromo)):
+                if not org_name and not organization:
+                    click.echo('could not find any org!')
+                    return 1
+                if not org_name and organization:
+                    org_name = organization
+                elif organization and org_name != organization:
+                    skipped_orgs += 1
+                    continue
 
-            # remove any dynamic fields
-            for r in records:
-                for e in dynamic_fields:
-                    if e not in r:
+                if pre_validate:
+                    if org_name not in validators:
+                        validators[org_name] = record_validator(chromo)
+                    validate = validators[org_name]
+                    good_records = []
+                    for r in records:
+                        record_errors = validate(r)
+                        if record_errors:
+                            _write_bad_record(org_name, record_errors, r)
+                        else:
+                            good_records.append(r)
+                    records = good_records
+                    if not records:
                         continue
-                    del r[e]
 
-            offset = 0
-            while offset < len(records):
-                try:
-                    lc.action.datastore_upsert(
-                        method=method,
-                        resource_id=res['id'],
-                        records=records[offset:])
-                except ValidationError as err:
-                    if 'records_row' not in err.error_dict:
-                        raise
-                    # type_ignore_reason: incomplete typing
-                    bad = int(err.error_dict['records_row'])  # type: ignore
-                    bad_record_count += 1
-                    # type_ignore_reason: incomplete typing
-                    error_count += sum(
-                        len(v) for v in
-                        err.error_dict['records'][0].values())  # type: ignore
-
-                    # write errors to output
-                    # type_ignore_reason: incomplete typing
-                    write_error(org_name,  # type: ignore
-                                err.error_dict['records'][0],  # type: ignore
-                                records[offset + bad])
-
-                    # retry records that passed validation
-                    good = records[offset: offset+bad]
-                    if good:
-                        lc.action.datastore_upsert(
-                            method=method,
-                            resource_id=res['id'],
-                            records=good)
-                    offset += bad + 1  # skip and continue
-                else:
-                    break
+                if not pool:
+                    if _load_org_records(
+                            lc, chromo, org_name, records, flags, fast,
+                            verbose, click.echo,
+                            lambda e, r: _write_bad_record(org_name, e, r)):
+                        return 1
+                    continue
+
+                # wait for earlier batches of this org to keep them in
+                # order, and limit the number of batches held in memory
+                while pending and (
+                        len(pending) >= jobs * 2 or
+                        any(o == org_name for o, _r in pending)):
+                    if _finish_one():
+                        return 1
+                pending.append((org_name, pool.apply_async(
+                    _load_org_records_worker,
+                    (resource_name, org_name, records, flags, fast, verbose))))
+
+            while pending:
+                if _finish_one():
+                    return 1
+        finally:
+            if pool and pending:
+                pool.terminate()
+            elif pool:
+                pool.close()
+            if pool:
+                pool.join()
 
     if verbose and organization and skipped_orgs:
         click.echo('Skipped %s organizations that did not match %s...' % (
@@ -944,10 +1084,282 @@ def _load_one_csv_file(name: str, resource_name: str = '',
     return 2 if error_count else 0  # exit code return
 
 
+def _dynamic_fields(chromo: Dict[str, Any]) -> List[str]:
+    """
+    Fields in CSV files that are generated by ckan or the datastore
+    and are not loaded from the file
+    """
+    dynamic_fields = [
+        'owner_org',
+        'owner_org_title',
+        'record_created',
+        'record_modified',
+        'user_modified'
+    ]
+    if 'csv_org_extras' in chromo:
+        dynamic_fields += chromo['csv_org_extras']
+    dynamic_fields += get_field_index(chromo).computed_ids
+    return dynamic_fields
+
+
+def _load_org_records_worker(
+        resource_name: str,
+        org_name: str,
+        records: List[Dict[str, Any]],
+        flags: Optional[List[str]],
+        fast: bool,
+        verbose: bool) -> Tuple[int, List[str], List[Tuple[Any, Any]]]:
+    """
+    Run _load_org_records in a worker process, collecting messages and
+    bad records to be reported by the parent in batch order
+    """
+    messages: List[str] = []
+    bad_records: List[Tuple[Any, Any]] = []
+    lc = LocalCKAN(context={'datastore_app_context_flags': flags} if flags else {})
+    rval = _load_org_records(
+        lc, get_chromo(resource_name), org_name, records, flags, fast,
+        verbose, messages.append, lambda e, r: bad_records.append((e, r)))
+    return rval, messages, bad_records
+
+
+def _load_org_records(lc: LocalCKAN,
+                      chromo: Dict[str, Any],
+                      org_name: str,
+                      records: List[Dict[str, Any]],
+                      flags: Optional[List[str]],
+                      fast: bool,
+                      verbose: bool,
+                      echo: Callable[[str], None],
+                      on_error: Callable[[Dict[str, Any], Dict[str, Any]], None]
+                      ) -> int:
+    """
+    Load one batch of CSV records into the org's resource table, creating
+    the dataset if required. Calls on_error(error, record) for each
+    record rejected by the datastore.
+
+    Records are sent with datastore_upsert calls on one write connection,
+    each call is committed separately so the records loaded before an
+    error are kept, as when each call used its own connection.
+
+    returns 1 if the dataset could not be found, otherwise 0
+    """
+    dataset_type = chromo['dataset_type']
+    resource_name = chromo['resource_name']
+    method = 'upsert' if chromo.get('datastore_primary_key') else 'insert'
+
+    dataset_ids = find_dataset_ids(dataset_type, org_name)
+    if not dataset_ids:
+        lc.action.recombinant_create(dataset_type=dataset_type,
+                                     owner_org=org_name)
+        dataset_ids = find_dataset_ids(dataset_type, org_name)
+
+    if len(dataset_ids) > 1:
+        echo('type:%s organization:%s multiple found!' % (
+            dataset_type, org_name))
+        return 1
+
+    dataset = lc.action.package_show(id=dataset_ids[0])
+    for res in dataset['resources']:
+        if res['name'] == resource_name:
+            break
+    else:
+        echo('type:%s organization:%s missing resource:%s' % (
+            dataset_type, org_name, resource_name))
+        return 1
+
+    # convert list values to lists
+    list_fields = get_field_index(chromo).list_ids
+    if list_fields:
+        for r in records:
+            for k in list_fields:
+                if not r[k]:
+                    r[k] = []
+                else:
+                    r[k] = r[k].split(',')
+
+    echo('- %s %s' % (org_name, len(records)))
+
+    # remove any dynamic fields
+    dynamic_fields = _dynamic_fields(chromo)
+    for r in records:
+        for e in dynamic_fields:
+            if e not in r:
+                continue
+            del r[e]
+
+    if fast:
+        # COPY skips datastore_upsert, records it would reject make the
+        # COPY or merge fail and are loaded below to report the errors
+        check_access('datastore_upsert', {'user': lc.username},
+                     {'resource_id': res['id']})
+        try:
+            _copy_upsert_records(res['id'], records, method,
+                                 aslist(chromo.get('datastore_primary_key',
+                                                   [])),
+                                 flags or [])
+            return 0
+        except (sa.exc.DBAPIError, psycopg2.Error) as e:
+            if verbose:
+                echo('  COPY failed, loading %s record by record: %s' % (
+                    org_name, str(getattr(e, 'orig', e)).split('\n')[0]))
+
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_write_engine().connect() as connection:
+        upsert_context = dict(lc.context, connection=connection)
+
+        def _upsert(chunk: List[Dict[str, Any]]):
+            # commit each call on its own like datastore_upsert without
+            # a shared connection, a rejected chunk rolls back only its
+            # records and the datastore_app_context table for the call
+            with connection.begin():
+                lc.call_action('datastore_upsert', dict(
+                    method=method,
+                    resource_id=res['id'],
+                    records=chunk), context=upsert_context)
+
+        _upsert_isolating_errors(_upsert, records, on_error)
+    return 0
+
+
+def _upsert_isolating_errors(upsert: Callable[[List[Dict[str, Any]]], None],
+                             records: List[Dict[str, Any]],
+                             on_error: Callable[[Dict[str, Any], Dict[str, Any]], None],
+                             lo: int = 0,
+                             hi: Optional[int] = None):
+    """
+    Upsert records[lo:hi] with upsert(), calling on_error(error, record)
+    in record order for each record rejected by the datastore.
+
+    After a bad record the rest of the range is split in two halves
+    instead of being sent again as a whole, so each bad record costs
+    O(log n) upsert calls instead of resending the remaining records.
+    """
+    if hi is None:
+        hi = len(records)
+    while lo < hi:
+        try:
+            upsert(records[lo:hi])
+            return
+        except ValidationError as err:
+            if 'records_row' not in err.error_dict:
+                raise
+            # type_ignore_reason: incomplete typing
+            bad = lo + int(err.error_dict['records_row'])  # type: ignore
+            # type_ignore_reason: incomplete typing
+            on_error(err.error_dict['records'][0],  # type: ignore
+                     records[bad])
+
+            # retry records that passed validation
+            if bad > lo:
+                upsert(records[lo:bad])
+            lo = bad + 1  # skip and continue
+
+            mid = lo + (hi - lo) // 2
+            if mid > lo:
+                _upsert_isolating_errors(upsert, records, on_error, lo, mid)
+                lo = mid
+
+
+def _copy_upsert_records(resource_id: str,
+                         records: List[Dict[str, Any]],
+                         method: str,
+                         primary_key: List[str],
+                         flags: List[str]):
+    """
+    Load records into the datastore table with COPY FROM STDIN into a
+    temporary table, then merge it into the resource table with a single
+    INSERT .. ON CONFLICT statement so that the table triggers still run.
+
+    The whole batch runs in one transaction, any database error
+    rolls it back and is raised to the caller.
+    """
+    if not records:
+        return
+    column_ids = list(records[0])
+    columns = ', '.join(identifier(c) for c in column_ids)
+    table = identifier(resource_id)
+    tmp_table = identifier('recombinant_load')
+
+    buf = StringIO()
+    for r in records:
+        buf.write(','.join(_copy_value(r.get(c)) for c in column_ids))
+        buf.write('\n')
+    buf.seek(0)
+
+    merge_sql = 'INSERT INTO {table} ({columns}) SELECT {columns} FROM {tmp}'
+    if method == 'upsert' and primary_key:
+        update_columns = [c for c in column_ids if c not in primary_key]
+        if update_columns:
+            merge_sql += ' ON CONFLICT ({pk}) DO UPDATE SET ' + ', '.join(
+                '{0} = EXCLUDED.{0}'.format(identifier(c))
+                for c in update_columns)
+        else:
+            merge_sql += ' ON CONFLICT ({pk}) DO NOTHING'
+
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_write_engine().begin() as connection:
+        _set_app_context_flags(connection, flags)
+        connection.execute(sa.text(
+            'CREATE TEMP TABLE {tmp} ON COMMIT DROP AS '
+            'SELECT {columns} FROM {table} WITH NO DATA'.format(
+                tmp=tmp_table, columns=columns, table=table)))
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                'COPY {tmp} ({columns}) FROM STDIN WITH (FORMAT csv)'.format(
+                    tmp=tmp_table, columns=columns), buf)
+        finally:
+            cursor.close()
+        connection.execute(sa.text(merge_sql.format(
+            table=table,
+            columns=columns,
+            tmp=tmp_table,
+            pk=', '.join(identifier(c) for c in primary_key))))
+        clear_row_counts([resource_id], connection)
+
+
+def _set_app_context_flags(connection: Any, flags: List[str]):
+    """
+    Expose the load flags to the table triggers the same way the
+    datastore does for datastore_upsert: a single row temporary
+    APP_CONTEXT_TABLE with one boolean column per flag.
+    """
+    if not flags:
+        return
+    table = identifier(APP_CONTEXT_TABLE)
+    connection.execute(sa.text(
+        'CREATE TEMP TABLE {table} ({columns}) ON COMMIT DROP'.format(
+            table=table,
+            columns=', '.join(identifier(f) + ' boolean' for f in flags))))
+    connection.execute(sa.text(
+        'INSERT INTO {table} VALUES ({values})'.format(
+            table=table,
+            values=', '.join('TRUE' for _f in flags))))
+
+
+def _copy_value(value: Any) -> str:
+    """
+    Format a record value for COPY .. WITH (FORMAT csv). Only NULL is
+    written unquoted so empty strings are kept as empty strings.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = '{' + ','.join(
+            '"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for v in value) + '}'
+    return '"' + str(value).replace('"', '""') + '"'
+
+
 def _combine_csv(target_dir: Optional[str],
                  resource_names: Optional[List[str]],
                  all_types: bool = False,
-                 verbose: bool = False):
+                 verbose: bool = False,
+                 jobs: int = 1):
     """
     Output all datastore data to CSV for given resource names
     """
@@ -958,109 +1370,274 @@ def _combine_csv(target_dir: Optional[str],
         click.echo('"{0}" is not a directory'.format(target_dir))
         return 1
 
-    orgs = _get_orgs()
-    lc = LocalCKAN()
-    for resource_name in _expand_resource_names(resource_names, all_types):
-        if verbose:
-            click.echo("Combining {resource_name} resources "
-                       "into csv file: {file}".format(
-                           resource_name=resource_name,
-                           file=os.path.join(target_dir, resource_name + '.csv')))
-        if target_dir:
-            outf = open(os.path.join(target_dir,
-                                     resource_name + '.csv'), 'w', encoding='utf-8')
-        else:
-            outf = sys.stdout
-        outf.write(BOM)
-        dataset_type = get_dataset_type_for_resource_name(resource_name)
-        if not dataset_type:
-            if verbose:
-                click.echo("Failed to get dataset type!!!")
-            continue
-        if verbose:
-            click.echo("Writing packages of type {dataset_type} "
-                       "into csv file: {file}".format(
-                           dataset_type=dataset_type,
-                           file=os.path.join(target_dir, resource_name + '.csv')))
-        _write_one_csv(
-            lc,
-            _get_packages(dataset_type, orgs),
-            get_chromo(resource_name),
-            outf)
-
-        if target_dir:
-            outf.close()
+    resource_names = list(_expand_resource_names(resource_names, all_types))
+    if jobs > 1:
+        # child processes must not share the parent's db connections
+        _dispose_engines()
+        pool = multiprocessing.get_context('fork').Pool(
+            jobs, initializer=_dispose_engines)
+        results = pool.imap_unordered(
+            _combine_one_csv_worker,
+            [(target_dir, r, verbose) for r in resource_names])
+    else:
+        pool = None
+        results = (
+            _combine_one_csv(target_dir, r, verbose) for r in resource_names)
+
+    completed = False
+    try:
+        for i, (resource_name, rows, size) in enumerate(results, 1):
+            click.echo('[{0}/{1}] {2}: {3} rows, {4} bytes'.format(
+                i, len(resource_names), resource_name, rows, size))
+        completed = True
+    finally:
+        if pool and completed:
+            pool.close()
+        elif pool:
+            pool.terminate()
+        if pool:
+            pool.join()
+
+
+def _combine_one_csv_worker(args: Tuple[str, str, bool]) -> Tuple[str, int, int]:
+    return _combine_one_csv(*args)
 
 
-def _write_one_csv(lc: LocalCKAN,
-                   pkgs: List[Dict[str, Any]],
+def _combine_one_csv(target_dir: str,
+                     resource_name: str,
+                     verbose: bool = False) -> Tuple[str, int, int]:
+    """
+    Write DIR/RESOURCE_NAME.csv through a temporary file renamed into
+    place when complete, so readers never see a partial file.
+
+    returns (resource_name, rows written, file size in bytes)
+    """
+    path = os.path.join(target_dir, resource_name + '.csv')
+    if verbose:
+        click.echo("Combining {resource_name} resources "
+                   "into csv file: {file}".format(
+                       resource_name=resource_name,
+                       file=path))
+    rows = 0
+    outf = tempfile.NamedTemporaryFile(
+        'w', encoding='utf-8', dir=target_dir, suffix='.csv.tmp',
+        prefix='.' + resource_name, delete=False)
+    try:
+        with outf:
+            outf.write(BOM)
+            dataset_type = get_dataset_type_for_resource_name(resource_name)
+            if not dataset_type:
+                if verbose:
+                    click.echo("Failed to get dataset type!!!")
+            else:
+                if verbose:
+                    click.echo("Writing packages of type {dataset_type} "
+                               "into csv file: {file}".format(
+                                   dataset_type=dataset_type,
+                                   file=path))
+                rows = _write_one_csv(
+                    dataset_type, get_chromo(resource_name), outf)
+        os.chmod(outf.name, 0o666 & ~_umask())
+        os.replace(outf.name, path)
+    except BaseException:
+        os.unlink(outf.name)
+        raise
+    return resource_name, rows, os.path.getsize(path)
+
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _dispose_engines():
+    """
+    Close pooled ckan and datastore db connections so that forked
+    worker processes open their own
+    """
+    model.Session.remove()
+    model.meta.engine.dispose()
+    _dispose_datastore_engines()
+
+
+def _write_one_csv(dataset_type: str,
                    chromo: Dict[str, Any],
-                   outfile: TextIO):
+                   outfile: TextIO) -> int:
+    """
+    Write all rows for chromo to outfile, returns the number of rows
+    """
     out = csv.writer(outfile)
-    column_ids = [
-        f['datastore_id'] for f in chromo['fields'] if
-        not f.get('published_resource_computed_field')] + \
-        chromo.get('csv_org_extras', []) + \
+    table_column_ids = list(get_field_index(chromo).table_column_ids)
+    extra_column_ids = chromo.get('csv_org_extras', []) + \
         ['owner_org', 'owner_org_title']
-    out.writerow(column_ids)
+    out.writerow(table_column_ids + extra_column_ids)
 
-    for pkg in pkgs:
-        for res in pkg['resources']:
-            if res['name'] == chromo['resource_name']:
-                break
-        else:
-            click.echo('resource {0} not found for {1}'.format(
-                chromo['resource_name'], pkg['owner_org']))
-            continue
+    tables = _get_resource_tables(dataset_type, chromo['resource_name'])
+    org_extras = _get_org_extras(
+        [org_name for _res_id, org_name, _org_title in tables],
+        chromo.get('csv_org_extras', []))
 
-        # default org extras
-        org_extras = {
-            'owner_org': pkg['owner_org'],
-            'owner_org_title': pkg['org_title'],
-        }
-        if chromo.get('csv_org_extras'):
-            org = lc.action.organization_show(id=pkg['owner_org'])
-            for ename in chromo.get('csv_org_extras', []):
-                org_extras[ename] = ''
-                if ename in org:
-                    org_extras[ename] = org[ename]
-                elif 'extras' in org:
-                    for e in org['extras']:
-                        if e['key'] == ename:
-                            org_extras[ename] = e['value']
-                            break
-
-        offs = 0
-        while True:
+    rows = 0
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_read_engine().connect() as connection:
+        for res_id, org_name, org_title in tables:
+            if not res_id:
+                click.echo('resource {0} not found for {1}'.format(
+                    chromo['resource_name'], org_name))
+                continue
+
+            extras = dict(
+                org_extras[org_name],
+                owner_org=org_name,
+                owner_org_title=org_title)
+            extra_values = [extras[col] for col in extra_column_ids]
             try:
-                result = lc.action.datastore_search(
-                    offset=offs,
-                    limit=DATASTORE_PAGINATE,
-                    sort='_id',
-                    resource_id=res['id'],
-                )
-                records = result['records']
+                for row in _stream_table_rows(
+                        connection, res_id, table_column_ids):
+                    out.writerow([
+                        '\r\n'.join(_csv_value(v).splitlines())
+                        for v in row + extra_values])
+                    rows += 1
             except NotFound:
                 click.echo('resource {0} table missing for {1}'.format(
-                    chromo['resource_name'], pkg['owner_org']))
-                break
+                    chromo['resource_name'], org_name))
+            except KeyError:
+                click.echo('resource {0} table missing keys for {1}'.format(
+                    chromo['resource_name'], org_name))
+    return rows
+
+
+def _get_resource_tables(dataset_type: str,
+                         resource_name: str) -> List[Tuple[
+                             Optional[str], str, str]]:
+    """
+    Return (resource_id, org_name, org_title) for every active dataset
+    of dataset_type in a single query, ordered like organization_list.
+    resource_id is None for datasets missing the resource_name resource.
+    """
+    return [tuple(r) for r in model.Session.query(
+        model.Resource.id, model.Group.name, model.Group.title
+    ).select_from(model.Package).join(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).outerjoin(
+        model.Resource, sa.and_(
+            model.Resource.package_id == model.Package.id,
+            model.Resource.name == resource_name,
+            model.Resource.state == 'active')
+    ).filter(
+        model.Package.type == dataset_type,
+        model.Package.state == 'active',
+        model.Group.state == 'active',
+    ).order_by(model.Group.title, model.Group.name).all()]
+
+
+def _get_org_extras(org_names: List[str],
+                    extra_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Return {org_name: {extra_name: value}} for csv_org_extras, read
+    from the organization columns or their extras in a single query.
+    Missing values are returned as ''.
+    """
+    org_extras = dict(
+        (o, dict((e, '') for e in extra_names)) for o in org_names)
+    if not org_names or not extra_names:
+        return org_extras
+
+    group_columns = [e for e in extra_names if hasattr(model.Group, e)]
+    for row in model.Session.query(
+            model.Group.name,
+            *[getattr(model.Group, e) for e in group_columns]).filter(
+                model.Group.name.in_(org_names)):
+        for e, value in zip(group_columns, row[1:]):
+            org_extras[row[0]][e] = '' if value is None else value
+
+    extra_columns = [e for e in extra_names if e not in group_columns]
+    if extra_columns:
+        extras = model.Session.query(
+            model.Group.name, model.GroupExtra.key, model.GroupExtra.value
+        ).join(
+            model.GroupExtra, model.GroupExtra.group_id == model.Group.id
+        ).filter(
+            model.Group.name.in_(org_names),
+            model.GroupExtra.key.in_(extra_columns),
+            model.GroupExtra.state == 'active')
+        for org_name, key, value in extras:
+            org_extras[org_name][key] = value
+    return org_extras
+
+
+def _csv_value(value: Any) -> str:
+    """
+    Format a table value for the combined CSV files
+    """
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ','.join(value)
+    return str(value)
 
-            for record in records:
-                record.update(org_extras)
-                try:
-                    row = [str('' if record[col] is None else
-                               ','.join(record[col]) if
-                               isinstance(record[col], list) else
-                               record[col]) for col in column_ids]
-                    out.writerow(['\r\n'.join(col.splitlines()) for col in row])
-                except KeyError:
-                    click.echo('resource {0} table missing keys for {1}'.format(
-                        chromo['resource_name'], pkg['owner_org']))
-                    break
 
-            if len(records) < DATASTORE_PAGINATE:
-                break
-            offs += DATASTORE_PAGINATE
+def _stream_table_rows(connection: Any,
+                       resource_id: str,
+                       column_ids: List[str]) -> Iterator[List[Any]]:
+    """
+    Stream rows of column_ids from a datastore table in _id order
+    through a server-side cursor, so memory use does not grow with
+    the table size.
+
+    Values are formatted the same way as datastore_search records:
+    numbers as they would be parsed from JSON and timestamps
+    without fractional seconds.
+
+    raises NotFound if the table does not exist and KeyError if
+    any of column_ids is missing from the table.
+    """
+    column_types = dict(connection.execute(sa.text(
+        'SELECT attname, format_type(atttypid, atttypmod) '
+        'FROM pg_attribute WHERE attrelid = to_regclass(:table) '
+        'AND attnum > 0 AND NOT attisdropped'),
+        {'table': identifier(resource_id)}).fetchall())
+    if not column_types:
+        raise NotFound()
+    select = []
+    numeric_cols = []
+    for i, col in enumerate(column_ids):
+        col_type = column_types[col]
+        if col_type.startswith('timestamp'):
+            select.append("to_char({0}, 'YYYY-MM-DD\"T\"HH24:MI:SS')".format(
+                identifier(col)))
+        elif col_type.startswith('numeric'):
+            select.append('{0}::text'.format(identifier(col)))
+            numeric_cols.append(i)
+        else:
+            select.append(identifier(col))
+
+    result = connection.execution_options(stream_results=True).execute(
+        sa.text('SELECT {select} FROM {table} ORDER BY _id'.format(
+            select=', '.join(select),
+            table=identifier(resource_id))))
+    while True:
+        rows = result.fetchmany(STREAM_ROWS)
+        if not rows:
+            break
+        for row in rows:
+            row = list(row)
+            for i in numeric_cols:
+                if row[i] is not None:
+                    row[i] = _json_number(row[i])
+            yield row
+
+
+def _json_number(value: str) -> Union[int, float]:
+    """
+    Parse a postgres numeric value the way json.loads would
+    """
+    if '.' in value or 'e' in value or 'E' in value:
+        return float(value)
+    return int(value)
 
 
 def _remove_broken(target_datasets: List[str],
@@ -1137,12 +1714,42 @@ def _template(dataset_type: str,
     """
     lc = LocalCKAN()
     org = lc.action.organization_show(id=org_name)
-    tmpl = excel_template(dataset_type, org)
+    tmpl = excel_template(dataset_type, org, write_only=True)
     with open(output_file, 'w') as out:
         # type_ignore_reason: incomplete typing
         tmpl.save(out)  # type: ignore
 
 
+def _warm_templates(dataset_types: Optional[List[str]],
+                    verbose: bool = False):
+    """
+    Generate excel templates in the template cache
+    """
+    locales = config.get('ckan.locales_offered', ['en'])
+    if not isinstance(locales, list):
+        locales = locales.split()
+    for dtype in _expand_dataset_types(
+            dataset_types, all_types=not dataset_types):
+        orgs = model.Session.query(
+            model.Group.name, model.Group.title
+        ).join(
+            model.Package, model.Package.owner_org == model.Group.id
+        ).filter(
+            model.Package.type == dtype,
+            model.Package.state == 'active',
+            model.Group.state == 'active',
+        ).distinct().order_by(model.Group.name).all()
+        for lang in locales:
+            request.environ['CKAN_LANG'] = lang
+            with force_locale(lang):
+                for org_name, org_title in orgs:
+                    if verbose:
+                        click.echo('{0} {1} {2}'.format(dtype, lang, org_name))
+                    excel_template_bytes(
+                        dtype, {'name': org_name, 'title': org_title})
+        click.echo('{0}: {1} templates'.format(dtype, len(orgs) * len(locales)))
+
+
 @recombinant.command(short_help="Run all the sql scripts "
                                 "from recombinant.reference_definitions")
 def create_ref_tables():
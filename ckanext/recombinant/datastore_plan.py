@@ -0,0 +1,299 @@
+"""
+Plans for bringing datastore tables in line with their definitions.
+
+plan_tables compares the datastore_create arguments recombinant_update
+would use for each table with the columns, unique key, indexes, foreign
+keys and triggers found in the database catalog, so that only tables
+that differ from their definition need to be updated.
+"""
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+import sqlalchemy as sa
+
+from ckanext.datastore.backend import DatastoreBackend
+from ckanext.datastore.backend.postgres import (
+    DatastorePostgresqlBackend,
+    identifier
+)
+
+# columns maintained by the datastore itself
+DATASTORE_COLUMNS = ('_id', '_full_text')
+# names datastore_create gives the triggers it manages: t000, t001, ...
+DATASTORE_TRIGGER_NAMES = 't___'
+
+TablePlan = Dict[str, Any]
+
+
+def plan_tables(specs: List[Dict[str, Any]],
+                delete_fields: bool = False) -> List[TablePlan]:
+    """
+    return a plan for each spec in specs, where each spec has the
+    resource_id, fields, primary_key, indexes, foreign_keys and triggers
+    that would be passed to datastore_create.
+
+    Plans are {"resource_id": ..., "changes": {...}} with an empty
+    changes dict for tables that match their spec. Changes include:
+
+    create_table: True for missing tables
+    add_fields: [field id, ...] missing columns
+    delete_fields: [field id, ...] columns not in the spec, only
+        when delete_fields is True
+    change_types: {field id: [current type, new type]}
+    primary_key: [current key, new key]
+    add_indexes, remove_indexes: [[field id, ...], ...]
+    foreign_keys: [current foreign keys, new foreign keys]
+    triggers: [current trigger functions, new trigger functions]
+    """
+    if not specs:
+        return []
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_read_engine().connect() as connection:
+        states = _table_states(
+            connection, [s['resource_id'] for s in specs])
+        type_names = _canonical_types(connection, list(set(
+            f['type'] for s in specs for f in s['fields'])))
+
+    return [
+        {
+            'resource_id': s['resource_id'],
+            'changes': _table_changes(
+                s, states.get(s['resource_id']), type_names, delete_fields),
+        }
+        for s in specs]
+
+
+def alter_field_types(connection: Any,
+                      resource_id: str,
+                      change_types: Dict[str, List[str]]):
+    """
+    Apply the change_types from a table plan on connection, converting
+    existing values with a cast to the new type. Raises
+    sqlalchemy.exc.DBAPIError when existing values can't be converted.
+    """
+    connection.execute(sa.text(
+        'ALTER TABLE {table} '.format(table=identifier(resource_id)) +
+        ', '.join(
+            'ALTER COLUMN {column} TYPE {new} USING {column}::{new}'
+            .format(column=identifier(field_id), new=new)
+            for field_id, (_current, new) in change_types.items())))
+
+
+def _table_changes(spec: Dict[str, Any],
+                   state: Optional[Dict[str, Any]],
+                   type_names: Dict[str, Optional[str]],
+                   delete_fields: bool) -> Dict[str, Any]:
+    if state is None:
+        return {'create_table': True}
+
+    changes: Dict[str, Any] = {}
+    columns = state['columns']
+    spec_ids = set(f['id'] for f in spec['fields'])
+    add_fields = [f['id'] for f in spec['fields'] if f['id'] not in columns]
+    if add_fields:
+        changes['add_fields'] = add_fields
+    if delete_fields:
+        extra = [c for c in columns if c not in spec_ids]
+        if extra:
+            changes['delete_fields'] = extra
+
+    change_types = {}
+    for f in spec['fields']:
+        new = type_names.get(f['type'])
+        current = columns.get(f['id'])
+        if new and current and new != current:
+            change_types[f['id']] = [current, new]
+    if change_types:
+        changes['change_types'] = change_types
+
+    primary_key = _field_list(spec['primary_key'])
+    unique = state['unique']
+    if primary_key:
+        if frozenset(primary_key) not in [frozenset(u) for u in unique]:
+            changes['primary_key'] = [unique[0] if unique else [],
+                                      primary_key]
+    elif unique:
+        changes['primary_key'] = [unique[0], []]
+
+    indexes = _index_set(spec['indexes'])
+    add_indexes = indexes - state['indexes']
+    remove_indexes = state['indexes'] - indexes
+    if add_indexes:
+        changes['add_indexes'] = sorted(list(i) for i in add_indexes)
+    if remove_indexes:
+        changes['remove_indexes'] = sorted(list(i) for i in remove_indexes)
+
+    foreign_keys = _foreign_key_set(spec['foreign_keys'])
+    if foreign_keys != state['foreign_keys']:
+        changes['foreign_keys'] = [
+            _foreign_key_dict(state['foreign_keys']),
+            _foreign_key_dict(foreign_keys)]
+
+    triggers = [t.split('.')[-1] for t in spec['triggers']]
+    if triggers != state['triggers']:
+        changes['triggers'] = [state['triggers'], triggers]
+    return changes
+
+
+def _table_states(connection: Any,
+                  resource_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    return {resource_id: state} for existing tables, where state has
+    columns {column: type}, unique [[column, ...], ...], indexes
+    {(column, ...), ...}, foreign_keys and triggers [function, ...]
+    read from the database catalog
+    """
+    params = {'ids': resource_ids}
+    states: Dict[str, Dict[str, Any]] = {}
+    for table, column, column_type in connection.execute(sa.text('''
+            SELECT c.relname, a.attname, format_type(a.atttypid, NULL)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = c.oid
+            WHERE n.nspname = 'public'
+                AND c.relname = ANY(:ids)
+                AND c.relkind IN ('r', 'p')
+                AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY c.relname, a.attnum
+            '''), params):
+        state = states.setdefault(table, {
+            'columns': {},
+            'unique': [],
+            'indexes': set(),
+            'foreign_keys': frozenset(),
+            'triggers': [],
+        })
+        if column not in DATASTORE_COLUMNS:
+            state['columns'][column] = column_type
+
+    for table, is_unique, columns in connection.execute(sa.text('''
+            SELECT c.relname, i.indisunique, ARRAY(
+                SELECT a.attname
+                FROM generate_series(0, i.indnatts - 1) AS k(n)
+                JOIN pg_attribute a
+                    ON a.attrelid = i.indrelid AND a.attnum = i.indkey[k.n]
+                ORDER BY k.n)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public'
+                AND c.relname = ANY(:ids)
+                AND NOT i.indisprimary
+                AND i.indexprs IS NULL
+            ORDER BY c.relname, i.indexrelid
+            '''), params):
+        if table not in states or any(c in DATASTORE_COLUMNS for c in columns):
+            continue
+        if is_unique:
+            states[table]['unique'].append(list(columns))
+        else:
+            states[table]['indexes'].add(tuple(columns))
+
+    foreign_keys: Dict[str, Dict[str, Set[Tuple[str, str]]]] = {}
+    for table, parent, child_columns, parent_columns in connection.execute(
+            sa.text('''
+            SELECT c.relname, p.relname, ARRAY(
+                SELECT a.attname
+                FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, n)
+                JOIN pg_attribute a
+                    ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                ORDER BY k.n
+            ), ARRAY(
+                SELECT a.attname
+                FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, n)
+                JOIN pg_attribute a
+                    ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+                ORDER BY k.n)
+            FROM pg_constraint con
+            JOIN pg_class c ON c.oid = con.conrelid
+            JOIN pg_class p ON p.oid = con.confrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public'
+                AND c.relname = ANY(:ids)
+                AND con.contype = 'f'
+            '''), params):
+        foreign_keys.setdefault(table, {}).setdefault(parent, set()).update(
+            zip(child_columns, parent_columns))
+    for table, parents in foreign_keys.items():
+        if table in states:
+            states[table]['foreign_keys'] = frozenset(
+                (parent, frozenset(pairs)) for parent, pairs in parents.items())
+
+    for table, function in connection.execute(sa.text('''
+            SELECT c.relname, p.proname
+            FROM pg_trigger t
+            JOIN pg_class c ON c.oid = t.tgrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_proc p ON p.oid = t.tgfoid
+            WHERE n.nspname = 'public'
+                AND c.relname = ANY(:ids)
+                AND NOT t.tgisinternal
+                AND t.tgname LIKE :trigger_names
+            ORDER BY c.relname, t.tgname
+            '''), dict(params, trigger_names=DATASTORE_TRIGGER_NAMES)):
+        if table in states:
+            states[table]['triggers'].append(function)
+    return states
+
+
+def _canonical_types(connection: Any,
+                     types: List[str]) -> Dict[str, Optional[str]]:
+    """
+    return {type: name as shown by format_type} for datastore field
+    types, e.g. "int" -> "integer", "_text" -> "text[]"
+    """
+    if not types:
+        return {}
+    return dict(connection.execute(sa.text('''
+        SELECT t, format_type(to_regtype(t), NULL)
+        FROM unnest(CAST(:types AS text[])) AS t
+        '''), {'types': types}).fetchall())
+
+
+def _field_list(value: Any) -> List[str]:
+    """
+    field ids from a datastore primary key or index: a list or a
+    comma-separated string
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value if v.strip()]
+
+
+def _index_set(indexes: Any) -> Set[Tuple[str, ...]]:
+    """
+    datastore indexes as a set of column tuples, a string of indexes is
+    a comma-separated list of single column indexes, as in datastore_create
+    """
+    if not indexes:
+        return set()
+    if isinstance(indexes, str):
+        indexes = indexes.split(',')
+    return set(
+        tuple(_field_list(index)) for index in indexes if _field_list(index))
+
+
+def _foreign_key_set(foreign_keys: Dict[str, Any]) -> FrozenSet[Any]:
+    """
+    foreign_keys {parent table: field map} as a frozenset of
+    (parent table, frozenset((child column, parent column), ...)), where
+    the field map is {child column: parent column} or a list of columns
+    with the same name in both tables
+    """
+    normalized = []
+    for parent, field_map in (foreign_keys or {}).items():
+        if isinstance(field_map, dict):
+            pairs = frozenset(field_map.items())
+        else:
+            pairs = frozenset((c, c) for c in _field_list(field_map))
+        normalized.append((parent, pairs))
+    return frozenset(normalized)
+
+
+def _foreign_key_dict(foreign_keys: FrozenSet[Any]) -> Dict[str, Dict[str, str]]:
+    return {
+        parent: dict(sorted(pairs))
+        for parent, pairs in sorted(foreign_keys)}
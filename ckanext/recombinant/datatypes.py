@@ -3,7 +3,7 @@ import re
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 
-from typing import Union, Any
+from typing import Union, Any, Callable
 
 from ckanext.recombinant.errors import BadExcelData
 
@@ -36,6 +36,11 @@ datastore_type = {
 }
 
 
+NUMBER_JUNK_REGEX = re.compile(r'[$,\s]')
+CONTROL_CHARS_REGEX = re.compile('[\x00-\x1f]')
+CENTS = Decimal(10) ** -2  # same as Decimal('0.01')
+
+
 def canonicalize(dirty: Any,
                  dstore_tag: str,
                  primary_key: bool,
@@ -127,3 +132,98 @@ def canonicalize(dirty: Any,
     if dstore_tag != 'text' and not primary_key and not dirty:
         return None
     return dirty
+
+
+def canonicalizer(dstore_tag: str,
+                  primary_key: bool,
+                  choice_field: Union[str, bool] = False) -> Callable[[Any], Any]:
+    """
+    Return a function equivalent to
+    canonicalize(dirty, dstore_tag, primary_key, choice_field)
+    with the type, primary key and choice field checks done once
+    for a whole column instead of for every cell.
+    """
+    whole_number = datastore_type[dstore_tag].whole_number
+    money = dstore_tag == 'money'
+    date = dstore_tag == 'date'
+    blank = '' if dstore_tag == 'text' or primary_key else None
+
+    if dstore_tag == '_text':
+        def canonicalize_text_array(dirty: Any) -> Any:
+            if dirty is None:
+                return []
+            if isinstance(dirty, str):
+                dirty = _excel_str(dirty)
+            else:
+                dirty = str(dirty)
+            if not dirty.strip():
+                return []
+            return [s.strip() for s in dirty.split(',')]
+        return canonicalize_text_array
+
+    if dstore_tag == 'text' and not primary_key and not choice_field:
+        def canonicalize_text(dirty: Any) -> Any:
+            if isinstance(dirty, str):
+                return _excel_str(dirty)
+            if dirty is None:
+                return ''
+            return str(dirty)
+        return canonicalize_text
+
+    def canonicalize_column(dirty: Any) -> Any:
+        if dirty is None:
+            return blank
+        if isinstance(dirty, str):
+            dirty = _excel_str(dirty)
+            if whole_number and dirty.isdigit() and dirty.isascii() and (
+                    dirty[0] != '0' or len(dirty) == 1):
+                return dirty
+        elif whole_number and type(dirty) is int:
+            return str(dirty)
+
+        if whole_number:
+            try:
+                d = Decimal(NUMBER_JUNK_REGEX.sub('', str(dirty)))
+                if not d % 1:  # truncate trailing .00's
+                    return str(d // 1)
+            except InvalidOperation:
+                pass
+
+        if money:
+            try:
+                return str(Decimal(
+                    NUMBER_JUNK_REGEX.sub('', str(dirty))).quantize(CENTS))
+            except InvalidOperation:
+                pass
+
+        if date and isinstance(dirty, datetime):
+            return '%04d-%02d-%02d' % (dirty.year, dirty.month, dirty.day)
+
+        dirty = str(dirty)
+        if choice_field == 'full':
+            dirty = dirty.split(':')[0].strip()
+        elif choice_field:
+            dirty = dirty.strip()
+        if primary_key:
+            dirty = CONTROL_CHARS_REGEX.sub('', dirty.strip())
+        if not dirty:
+            return blank
+        return dirty
+
+    return canonicalize_column
+
+
+def _excel_str(dirty: str) -> str:
+    """
+    blank whitespace-only values and refuse formulas as canonicalize does
+    """
+    if not dirty.strip():
+        return ''
+    # excel, you keep being you
+    if dirty == '=FALSE()':
+        return 'FALSE'
+    elif dirty == '=TRUE()':
+        return 'TRUE'
+    if dirty.startswith('='):
+        raise BadExcelData('Formulas are not supported')
+    return dirty
@@ -1,12 +1,15 @@
 import json
 import os.path
+import threading
+import time
+from collections import OrderedDict
 from markupsafe import Markup
 import sqlalchemy as sa
 from datetime import datetime
 
-from typing import Dict, Any, Optional, List, Union
+from typing import Dict, Any, Optional, List, Union, Callable, Tuple, Hashable
 
-from ckan.plugins.toolkit import c, config
+from ckan.plugins.toolkit import c, config, asint
 from ckan.plugins.toolkit import _ as gettext
 import ckanapi
 from ckan.lib.helpers import lang
@@ -170,7 +173,14 @@ def recombinant_choice_fields(
     if not chromo:
         return {}
 
-    def build_choices(f: Dict[str, Any], choices: Dict[str, Any]):
+    cache_lang = 'all' if all_languages else prefer_lang
+    if cache_lang is None:
+        try:
+            cache_lang = lang()
+        except Exception:
+            pass  # lang() call will fail when no user language available
+
+    def build_choices(f: Dict[str, Any], choices: Dict[str, Any]) -> List[Any]:
         order_expr = f.get('choice_order_expression')
         if order_expr:
             code = compile(order_expr, resource_name, 'eval')
@@ -185,14 +195,14 @@ def recombinant_choice_fields(
             key_fn = None  # type: ignore
 
         exclude_choices = f.get('exclude_choices', [])
-        out[f['datastore_id']] = [
+        return [
             (v, choices[v] if all_languages
                 else recombinant_language_text(choices[v], prefer_lang))
             for v in sorted(choices, key=key_fn)
             if v not in exclude_choices
         ]
 
-    def build_choices_psql(f: Dict[str, Any]):
+    def build_choices_psql(f: Dict[str, Any]) -> List[Any]:
         # type_ignore_reason: incomplete typing
         backend: DatastorePostgresqlBackend = DatastoreBackend.\
             get_active_backend()  # type: ignore
@@ -210,7 +220,7 @@ def recombinant_choice_fields(
                 filter_clause=filter_clause,
                 ds_id=identifier(f['datastore_id'])
             ).replace(':', r'\:'))).mappings().fetchall()  # avoid bind params
-        out[f['datastore_id']] = [
+        return [
             (r[f['datastore_id']],
              dict(en=r['label_en'],
                   fr=r['label_fr'],
@@ -218,13 +228,24 @@ def recombinant_choice_fields(
              if all_languages else
              r['label_%s' % (prefer_lang or lang())]) for r in results]
 
+    ref_ttl = asint(config.get('recombinant.choices_reference_table_ttl', 300))
     for f in chromo['fields']:
+        key = (chromo['resource_name'], f['datastore_id'], cache_lang)
         if 'choices' in f:
-            build_choices(f, f['choices'])
+            out[f['datastore_id']] = list(_cached_choices(
+                key + (None,), None,
+                lambda: build_choices(f, f['choices'])))
         elif 'choices_file' in f and '_path' in chromo:
-            build_choices(f, _read_choices_file(chromo, f))
+            out[f['datastore_id']] = list(_cached_choices(
+                key + (None,), _choices_file_mtime(chromo, f),
+                lambda: build_choices(f, _read_choices_file(chromo, f))))
         elif 'choices_reference_table' in f:
-            build_choices_psql(f)
+            if ref_ttl <= 0:
+                out[f['datastore_id']] = build_choices_psql(f)
+                continue
+            out[f['datastore_id']] = list(_cached_choices(
+                key + (org_name,), int(time.monotonic() // ref_ttl),
+                lambda: build_choices_psql(f)))
         elif 'choices_fiscal_year' in f:
             out[f['datastore_id']] = [
                 (v, v) for v in get_choices_fiscal_year(**f['choices_fiscal_year'])]
@@ -233,8 +254,60 @@ def recombinant_choice_fields(
 
 
 def _read_choices_file(chromo: Dict[str, Any], f: Dict[str, Any]) -> Dict[str, Any]:
-    with open(os.path.join(chromo['_path'], f['choices_file'])) as cf:
-        return load.load(cf)
+    """
+    Return the parsed choices_file for field f, cached until the
+    file is modified. The value returned must not be modified.
+    """
+    path = os.path.join(chromo['_path'], f['choices_file'])
+
+    def read() -> Dict[str, Any]:
+        with open(path) as cf:
+            return load.load(cf)
+
+    return _cached_choices(('choices_file', path), os.stat(path).st_mtime_ns, read)
+
+
+def _choices_file_mtime(chromo: Dict[str, Any], f: Dict[str, Any]) -> int:
+    return os.stat(
+        os.path.join(chromo['_path'], f['choices_file'])).st_mtime_ns
+
+
+_choices_cache: 'OrderedDict[Hashable, Tuple[Any, Any]]' = OrderedDict()
+_choices_cache_lock = threading.Lock()
+
+
+def _cached_choices(key: Hashable, token: Any, build: Callable[[], Any]) -> Any:
+    """
+    Return the value cached for key if it was stored with the same token,
+    otherwise call build() and cache the result. The least recently used
+    entries are evicted past recombinant.choices_cache_size entries.
+    """
+    with _choices_cache_lock:
+        try:
+            cached_token, value = _choices_cache[key]
+        except KeyError:
+            pass
+        else:
+            if cached_token == token:
+                _choices_cache.move_to_end(key)
+                return value
+
+    value = build()
+    size = asint(config.get('recombinant.choices_cache_size', 1000))
+    with _choices_cache_lock:
+        _choices_cache[key] = (token, value)
+        _choices_cache.move_to_end(key)
+        while len(_choices_cache) > size:
+            _choices_cache.popitem(last=False)
+    return value
+
+
+def clear_choices_cache():
+    """
+    Remove all cached choices, e.g. after reference tables are updated
+    """
+    with _choices_cache_lock:
+        _choices_cache.clear()
 
 
 def recombinant_show_package(pkg: Dict[str, Any]) -> Dict[str, Any]:
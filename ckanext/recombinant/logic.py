@@ -1,28 +1,59 @@
+import hashlib
 from six import string_types
 from uuid import UUID
-from ckan.plugins.toolkit import _, chained_action, h, side_effect_free
+from ckan.plugins.toolkit import (
+    _, aslist, chained_action, check_access, h, side_effect_free)
 
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Optional
 from ckan.types import Context, DataDict, Action, ChainedAction
 
-from sqlalchemy import and_
+import sqlalchemy as sa
+from sqlalchemy import and_, or_
 
 from ckanapi import LocalCKAN, NotFound, ValidationError, NotAuthorized
 from ckan.logic import get_or_bust
 from ckan.model.resource import Resource
 from ckan.model.group import Group
+from ckan.model.package import Package
+from ckan.model.meta import Session
 from ckan.common import asbool
 
-from ckanext.recombinant.tables import get_geno, get_chromo
+from ckanext.recombinant.tables import (
+    get_geno,
+    get_chromo,
+    get_field_index,
+    get_dataset_types,
+    get_definition_hash
+)
 from ckanext.recombinant.errors import (
     RecombinantException,
     RecombinantConfigurationError,
     format_trigger_error
 )
 from ckanext.recombinant.datatypes import datastore_type
-from ckanext.recombinant.helpers import _read_choices_file
+from ckanext.recombinant.helpers import _read_choices_file, _choices_file_mtime
+
+from ckanext.recombinant.datastore_plan import plan_tables, alter_field_types
+from ckanext.recombinant.row_counts import (
+    ROW_COUNT_STRATEGIES,
+    row_count_strategy,
+    datastore_row_counts,
+    create_row_count_table,
+    clear_row_counts
+)
+
+from ckanext.datastore.backend import DatastoreBackend
+from ckanext.datastore.backend.postgres import (
+    DatastorePostgresqlBackend,
+    identifier,
+    literal_string
+)
 
-from ckanext.datastore.backend.postgres import literal_string
+# stored in trigger function comments before the definition hash
+TRIGGER_HASH_PREFIX = 'recombinant definition sha256:'
+
+# {resource_name: (token, [(name, definition, hash), ...])}
+_trigger_definitions_cache: Dict[str, Tuple[Any, List[Tuple[str, str, str]]]] = {}
 
 
 def recombinant_create(context: Context, data_dict: DataDict):
@@ -52,10 +83,11 @@ def recombinant_create(context: Context, data_dict: DataDict):
         **_dataset_fields(geno))
 
     dataset = _update_dataset(lc, geno, dataset)
-    return _update_datastore(lc, geno, dataset)
+    _update_datastore(lc, geno, dataset)
 
 
-def recombinant_update(context: Context, data_dict: DataDict):
+def recombinant_update(context: Context,
+                       data_dict: DataDict) -> List[Dict[str, Any]]:
     '''
     Update a dataset's datastore table(s) for an organization and
     recombinant dataset type.
@@ -67,16 +99,33 @@ def recombinant_update(context: Context, data_dict: DataDict):
     :param force_update: True to force updating of datastore tables
     :param delete_fields: True to delete old fields not in schema,
                           requires force_update=True
+    :param alter_types: True to change the types of existing fields that
+                        differ from the schema, converting their values
+    :param plan: True to return the table changes required without
+                 updating anything
+
+    :returns: the changes planned for each datastore table updated, or
+              to be updated with plan=True, with an "error" for tables
+              whose existing values could not be converted by alter_types
+
+    A {function name: definition hash} dict passed in the context as
+    recombinant_trigger_hashes is shared across calls so that each
+    trigger function is checked and deployed once, see _update_triggers
     '''
     lc, geno, dataset = _action_get_dataset(context, data_dict)
+    plan_only = asbool(data_dict.get('plan', False))
 
-    dataset = _update_dataset(
-        lc, geno, dataset,
-        delete_resources=asbool(data_dict.get('delete_resources', False)))
-    _update_datastore(
+    if not plan_only:
+        dataset = _update_dataset(
+            lc, geno, dataset,
+            delete_resources=asbool(data_dict.get('delete_resources', False)))
+    return _update_datastore(
         lc, geno, dataset,
         force_update=asbool(data_dict.get('force_update', False)),
-        delete_fields=asbool(data_dict.get('delete_fields', False)))
+        delete_fields=asbool(data_dict.get('delete_fields', False)),
+        alter_types=asbool(data_dict.get('alter_types', False)),
+        plan_only=plan_only,
+        trigger_hashes=context.get('recombinant_trigger_hashes'))
 
 
 def recombinant_show(context: Context, data_dict: DataDict) -> Dict[str, Any]:
@@ -86,9 +135,163 @@ def recombinant_show(context: Context, data_dict: DataDict) -> Dict[str, Any]:
 
     :param dataset_type: recombinant dataset type
     :param owner_org: organization name or id
+    :param row_count: "exact", "estimate", "cached" or "none" to
+        override the recombinant.row_count setting for datastore_rows
     '''
+    strategy = _row_count_strategy(data_dict)
     lc, geno, dataset = _action_get_dataset(context, data_dict)
 
+    tables = {}
+    for resource in dataset['resources']:
+        try:
+            ds = lc.action.datastore_search(
+                resource_id=resource['id'],
+                limit=0,
+                include_total=False)
+        except NotFound:
+            continue
+        tables[resource['id']] = ds['fields']
+
+    return _dataset_status(
+        geno, dataset, tables, datastore_row_counts(list(tables), strategy))
+
+
+@side_effect_free
+def recombinant_show_many(context: Context,
+                          data_dict: DataDict) -> List[Dict[str, Any]]:
+    '''
+    Return the status of many recombinant datasets at once, the same as
+    recombinant_show for each dataset found. Datasets, resources and
+    datastore tables are read with a few queries instead of searches
+    for each dataset.
+
+    Sysadmin only.
+
+    :param dataset_types: recombinant dataset types (default: all)
+    :param owner_orgs: organization names or ids (default: all)
+    :param row_count: "exact", "estimate", "cached" or "none" to
+        override the recombinant.row_count setting for datastore_rows
+
+    :returns: status of each dataset ordered by dataset type, as passed,
+        then organization title and name
+    '''
+    check_access('recombinant_show_many', context, data_dict)
+    strategy = _row_count_strategy(data_dict)
+    model = context['model']
+    dataset_types = aslist(data_dict.get('dataset_types')) or \
+        get_dataset_types()
+    owner_orgs = aslist(data_dict.get('owner_orgs'))
+    genos = {}
+    for dataset_type in dataset_types:
+        try:
+            genos[dataset_type] = get_geno(dataset_type)
+        except RecombinantException:
+            raise ValidationError(
+                {'dataset_types': _("Recombinant dataset type not found")})
+
+    query = model.Session.query(
+        model.Package.id,
+        model.Package.type,
+        model.Package.title,
+        model.Package.notes,
+        model.Group.name,
+        model.Group.title,
+    ).join(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).filter(
+        model.Package.type.in_(dataset_types),
+        model.Package.state == 'active',
+        model.Group.state == 'active',
+    )
+    if owner_orgs:
+        query = query.filter(or_(
+            model.Group.name.in_(owner_orgs),
+            model.Group.id.in_(owner_orgs)))
+    type_order = {t: i for i, t in enumerate(dataset_types)}
+    datasets = {}
+    for package_id, package_type, title, notes, org_name, org_title in sorted(
+            query, key=lambda p: (type_order[p[1]], p[5] or '', p[4])):
+        datasets[package_id] = {
+            'id': package_id,
+            'type': package_type,
+            'title': title,
+            'notes': notes,
+            'organization': {'name': org_name, 'title': org_title},
+            'resources': [],
+        }
+
+    if datasets:
+        for resource in model.Session.query(
+                model.Resource.id,
+                model.Resource.package_id,
+                model.Resource.name,
+                model.Resource.description,
+                model.Resource.url_type,
+        ).filter(
+            model.Resource.package_id.in_(list(datasets)),
+            model.Resource.state == 'active',
+        ).order_by(model.Resource.position):
+            datasets[resource.package_id]['resources'].append({
+                'id': resource.id,
+                'name': resource.name,
+                'description': resource.description,
+                'url_type': resource.url_type,
+            })
+
+    tables = _datastore_fields([
+        r['id'] for d in datasets.values() for r in d['resources']])
+    counts = datastore_row_counts(list(tables), strategy)
+    return [
+        _dataset_status(genos[d['type']], d, tables, counts)
+        for d in datasets.values()]
+
+
+def _row_count_strategy(data_dict: DataDict) -> str:
+    strategy = data_dict.get('row_count') or row_count_strategy()
+    if strategy not in ROW_COUNT_STRATEGIES:
+        raise ValidationError({'row_count': [
+            _('Must be one of: {0}').format(', '.join(ROW_COUNT_STRATEGIES))]})
+    return strategy
+
+
+def _datastore_fields(resource_ids: List[str]) -> Dict[
+        str, List[Dict[str, Any]]]:
+    '''
+    return {resource_id: fields} for the resource_ids with datastore
+    tables, with fields like the ones from datastore_search
+    '''
+    columns: Dict[str, List[Dict[str, Any]]] = {}
+    if not resource_ids:
+        return columns
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_read_engine().connect() as connection:
+        for table_name, column_name in connection.execute(sa.text('''
+                SELECT c.relname, a.attname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_attribute a ON a.attrelid = c.oid
+                WHERE n.nspname = 'public'
+                    AND c.relname = ANY(:ids)
+                    AND c.relkind IN ('r', 'v', 'm', 'f', 'p')
+                    AND a.attnum > 0 AND NOT a.attisdropped
+                ORDER BY c.relname, a.attnum
+                '''), {'ids': resource_ids}):
+            if column_name != '_full_text':
+                columns.setdefault(table_name, []).append({'id': column_name})
+    return columns
+
+
+def _dataset_status(geno: Dict[str, Any],
+                    dataset: Dict[str, Any],
+                    tables: Dict[str, List[Dict[str, Any]]],
+                    counts: Dict[str, int]) -> Dict[str, Any]:
+    '''
+    return the recombinant_show status of dataset, where tables is
+    {resource_id: datastore fields} and counts is {resource_id: rows}
+    for the existing datastore tables
+    '''
     chromos = dict((chromo['resource_name'], chromo) for chromo in geno['resources'])
 
     resources = []
@@ -120,18 +323,17 @@ def recombinant_show(context: Context, data_dict: DataDict) -> Dict[str, Any]:
 
         out['shortname'] = r.get('shortname', resource['description'])
 
-        try:
-            ds = lc.action.datastore_search(
-                resource_id=resource['id'],
-                limit=0)
-            datastore_correct = _datastore_match(r['fields'], ds['fields'])
+        fields = tables.get(resource['id'])
+        if fields is not None:
+            datastore_correct = _datastore_match(r['fields'], fields)
             out['datastore_correct'] = datastore_correct
-            schema_correct = _schema_match(r['fields'], ds['fields'])
+            schema_correct = _schema_match(r['fields'], fields)
             out['schema_correct'] = schema_correct
             resources_correct = resources_correct and datastore_correct
-            out['datastore_rows'] = ds.get('total', 0)
+            if resource['id'] in counts:
+                out['datastore_rows'] = counts[resource['id']]
             out['datastore_active'] = True
-        except NotFound:
+        else:
             out['error'] = 'datastore table missing'
             resources_correct = False
 
@@ -195,13 +397,36 @@ def _action_find_dataset(context: Context, data_dict: DataDict) -> Tuple[
         fresh_context['ignore_auth'] = context['ignore_auth']
 
     lc = LocalCKAN(username=context['user'], context=fresh_context)
-    result = lc.action.package_search(
-        q="type:%s AND organization:%s %s" % (
-            dataset_type, owner_org.name,
-            'AND id:{0}'.format(dataset_id) if dataset_id else ''),
-        include_private=True,
-        rows=2)
-    return lc, geno, result['results']
+    results = []
+    for package_id in find_dataset_ids(
+            dataset_type, owner_org.id, dataset_id)[:2]:
+        try:
+            results.append(lc.action.package_show(id=package_id))
+        except NotAuthorized:
+            continue  # private datasets are hidden, as from package_search
+    return lc, geno, results
+
+
+def find_dataset_ids(dataset_type: str,
+                     owner_org: str,
+                     dataset_id: Optional[str] = None) -> List[str]:
+    '''
+    return the ids of active datasets of dataset_type for owner_org
+    (organization name or id), oldest first. Read from the CKAN database
+    so the search index is not needed and new datasets are found
+    immediately.
+    '''
+    query = Session.query(Package.id).join(
+        Group, Group.id == Package.owner_org
+    ).filter(
+        Package.type == dataset_type,
+        Package.state == 'active',
+        or_(Group.id == owner_org, Group.name == owner_org),
+    )
+    if dataset_id:
+        query = query.filter(Package.id == dataset_id)
+    return [package_id for (package_id,) in query.order_by(
+        Package.metadata_created)]
 
 
 def _action_get_dataset(context: Context, data_dict: DataDict) -> Tuple[
@@ -280,50 +505,39 @@ def _update_datastore(lc: LocalCKAN,
                       geno: Dict[str, Any],
                       dataset: Dict[str, Any],
                       force_update: bool = False,
-                      delete_fields: bool = False):
+                      delete_fields: bool = False,
+                      alter_types: bool = False,
+                      plan_only: bool = False,
+                      trigger_hashes: Optional[Dict[str, str]] = None
+                      ) -> List[Dict[str, Any]]:
     """
     call lc.action.datastore_create to create tables or add
     columns to existing datastore tables based on dataset definition
     geno for existing dataset.
+
+    Tables are compared with their definitions first and only tables
+    with changes are updated: missing tables or columns, or with
+    force_update any difference in columns, keys, indexes or triggers.
+    Column types are only changed with alter_types.
+
+    returns the plan for each table updated, or that would be updated
+    when plan_only is True
     """
     resource_ids = dict((r['name'], r['id']) for r in dataset['resources'])
     datastore_text_types = geno.get('datastore_text_types', False)
 
+    specs = []
+    out = []
     for chromo in geno['resources']:
-        assert chromo['resource_name'] in resource_ids, (
-            "dataset missing resource for resource name",
-            chromo['resource_name'], dataset['id'])
-        resource_id = resource_ids[chromo['resource_name']]
-        fields = datastore_fields(chromo['fields'], datastore_text_types)
-        do_delete_fields = False
-        try:
-            ds = lc.action.datastore_search(resource_id=resource_id, limit=0)
-        except NotFound:
-            pass
-        else:
-            if not force_update and _datastore_match(chromo['fields'], ds['fields']):
-                continue
-            # extra work here to maintain existing fields+ordering
-            # datastore_create rejects our list otherwise
-            fields = ds['fields'][1:]  # trim _id field
-            seen = set(f['id'] for f in fields)
-            for f in datastore_fields(chromo['fields'], datastore_text_types):
-                if f['id'] not in seen:
-                    fields.append(f)
-            if delete_fields:
-                # remove any fields from DS not in Schema
-                new_fields = []
-                schema_field_ids = set(
-                    f['id'] for f in datastore_fields(chromo['fields'],
-                                                      datastore_text_types))
-                for f in fields:
-                    if f['id'] not in schema_field_ids:
-                        do_delete_fields = True
-                        continue
-                    new_fields.append(f)
-                fields = new_fields
-
-        trigger_names = _update_triggers(lc, chromo)
+        if chromo['resource_name'] not in resource_ids:
+            assert plan_only, (
+                "dataset missing resource for resource name",
+                chromo['resource_name'], dataset['id'])
+            out.append({
+                'resource_name': chromo['resource_name'],
+                'resource_id': None,
+                'changes': {'create_table': True}})
+            continue
 
         chromo_foreign_keys = chromo.get('datastore_foreign_keys', None)
         foreign_keys = {}
@@ -338,21 +552,195 @@ def _update_datastore(lc: LocalCKAN,
                 else:
                     foreign_keys[f_table] = field_map
 
-        lc.action.datastore_create(
-            resource_id=resource_id,
-            fields=fields,
-            delete_fields=do_delete_fields,
-            primary_key=chromo.get('datastore_primary_key', []),
-            foreign_keys=foreign_keys,
-            indexes=chromo.get('datastore_indexes', []),
-            triggers=[{'function': str(f)} for f in trigger_names],
-            force=True)
+        specs.append((chromo, {
+            'resource_id': resource_ids[chromo['resource_name']],
+            'fields': datastore_fields(chromo['fields'], datastore_text_types),
+            'primary_key': chromo.get('datastore_primary_key', []),
+            'foreign_keys': foreign_keys,
+            'indexes': chromo.get('datastore_indexes', []),
+            'triggers': _trigger_names(chromo),
+        }))
+
+    if not plan_only and row_count_strategy() == 'cached':
+        create_row_count_table()
+
+    plans = plan_tables(
+        [spec for _chromo, spec in specs],
+        delete_fields=delete_fields and force_update)
+    for (chromo, spec), plan in zip(specs, plans):
+        changes = plan['changes']
+        apply = bool(changes) and (
+            force_update or 'create_table' in changes
+            or 'add_fields' in changes
+            or (alter_types and 'change_types' in changes))
+        if not apply:
+            table_plan = None
+        else:
+            table_plan = dict(plan, resource_name=chromo['resource_name'])
+            out.append(table_plan)
+        if plan_only:
+            continue
+        if apply or force_update:
+            # trigger function definitions may change without
+            # changing the table
+            _update_triggers(lc, chromo, deployed=trigger_hashes)
+        if table_plan is not None:
+            error = _apply_table_plan(lc, spec, changes, alter_types)
+            if error:
+                table_plan['error'] = error
+    return out
+
+
+def _apply_table_plan(lc: LocalCKAN,
+                      spec: Dict[str, Any],
+                      changes: Dict[str, Any],
+                      alter_types: bool) -> Optional[str]:
+    """
+    call lc.action.datastore_create for a table with changes from
+    plan_tables, leaving out indexes and triggers when they match.
 
+    With alter_types the column types are changed in the same
+    transaction as the datastore_create call. Returns the database
+    error when existing values can't be converted, leaving the table
+    unchanged.
+    """
+    resource_id = spec['resource_id']
+    fields = spec['fields']
+    change_types = changes.get('change_types') if alter_types else None
+    if 'create_table' not in changes:
+        # extra work here to maintain existing fields+ordering
+        # datastore_create rejects our list otherwise
+        ds = lc.action.datastore_search(resource_id=resource_id, limit=0)
+        fields = ds['fields'][1:]  # trim _id field
+        seen = set(f['id'] for f in fields)
+        if change_types:
+            spec_fields = dict((f['id'], f) for f in spec['fields'])
+            fields = [
+                spec_fields[f['id']] if f['id'] in change_types else f
+                for f in fields]
+        for f in spec['fields']:
+            if f['id'] not in seen:
+                fields.append(f)
+        if 'delete_fields' in changes:
+            # remove any fields from DS not in Schema
+            delete_ids = set(changes['delete_fields'])
+            fields = [f for f in fields if f['id'] not in delete_ids]
+
+    create = {
+        'resource_id': resource_id,
+        'fields': fields,
+        'delete_fields': 'delete_fields' in changes,
+        'primary_key': spec['primary_key'],
+        'foreign_keys': spec['foreign_keys'],
+        'force': True,
+    }
+    if {'create_table', 'add_indexes', 'remove_indexes'} & set(changes):
+        create['indexes'] = spec['indexes']
+    if {'create_table', 'triggers'} & set(changes):
+        create['triggers'] = [{'function': str(f)} for f in spec['triggers']]
+
+    if not change_types:
+        lc.action.datastore_create(**create)
+        return None
+
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    try:
+        with backend._get_write_engine().connect() as connection:
+            with connection.begin():
+                alter_field_types(connection, resource_id, change_types)
+                lc.call_action(
+                    'datastore_create',
+                    data_dict=create,
+                    context={'connection': connection})
+    except sa.exc.DBAPIError as e:
+        return str(e.orig).strip()
+    return None
+
+
+def _trigger_names(chromo: Dict[str, Any]) -> List[str]:
+    """
+    return the trigger function names for chromo, in order
+    """
+    names = []
+    for tr in chromo.get('triggers', []):
+        if isinstance(tr, dict):
+            if len(tr) != 1:
+                raise RecombinantConfigurationError(
+                    "inline trigger may have only one key: " + repr(tr.keys()))
+            ((trname, _trcode),) = tr.items()
+            names.append(trname)
+        else:
+            names.append(tr)
+    return names
 
-def _update_triggers(lc: LocalCKAN, chromo: Dict[str, Any]) -> List[str]:
-    definitions = dict(chromo.get('trigger_strings', {}))
-    trigger_names = []
 
+def _update_triggers(lc: LocalCKAN,
+                     chromo: Dict[str, Any],
+                     force: bool = False,
+                     deployed: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    create or replace the inline trigger functions for chromo and
+    return the names of all its trigger functions
+
+    The hash of each rendered definition is stored in the function's
+    COMMENT and functions are only replaced when the hash changes, or
+    always with force=True, so functions shared by many datasets are
+    deployed once when their definition changes, not once per dataset.
+
+    deployed - {function name: definition hash} of functions already
+        checked or deployed, updated in place. Pass the same dict for
+        every dataset in a run to skip reading the COMMENTs again.
+    """
+    trigger_names = _trigger_names(chromo)
+    definitions = _trigger_definitions(chromo)
+    if not definitions:
+        return trigger_names
+
+    if deployed is None:
+        deployed = {}
+    unchecked = [
+        trname for trname, _d, digest in definitions
+        if deployed.get(trname) != digest]
+    if unchecked and not force:
+        deployed.update(_trigger_function_hashes(unchecked))
+    for trname, definition, digest in definitions:
+        if deployed.get(trname) == digest:
+            continue
+        try:
+            lc.action.datastore_function_create(
+                name=trname,
+                or_replace=True,
+                rettype='trigger',
+                definition=definition)
+        except NotAuthorized:
+            continue  # normal users won't be able to reset triggers
+        _set_trigger_function_hash(trname, digest)
+        deployed[trname] = digest
+    return trigger_names
+
+
+def _trigger_definitions(chromo: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """
+    return [(name, rendered definition, definition hash), ...] for the
+    inline triggers in chromo, cached until the dataset definition or
+    its choices files change
+    """
+    token: Optional[Tuple[Any, ...]] = None
+    try:
+        token = (
+            get_definition_hash(chromo['dataset_type']),
+            tuple(_choices_file_mtime(chromo, f) for f in chromo['fields']
+                  if 'choices' not in f and 'choices_file' in f
+                  and '_path' in chromo))
+    except (KeyError, RecombinantException):
+        pass  # not a loaded definition, don't cache
+    cached = _trigger_definitions_cache.get(chromo['resource_name'])
+    if token is not None and cached and cached[0] == token:
+        return cached[1]
+
+    definitions = dict(chromo.get('trigger_strings', {}))
     for f in chromo['fields']:
         if 'choices' in f:
             if f['datastore_id'] in definitions:
@@ -369,26 +757,57 @@ def _update_triggers(lc: LocalCKAN, chromo: Dict[str, Any]) -> List[str]:
                         name=f['datastore_id']))
             definitions[f['datastore_id']] = sorted(_read_choices_file(chromo, f))
 
+    rendered: Optional[Dict[str, str]] = None
+    out = []
     for tr in chromo.get('triggers', []):
-        if isinstance(tr, dict):
-            if len(tr) != 1:
-                raise RecombinantConfigurationError(
-                    "inline trigger may have only one key: " + repr(tr.keys()))
-            ((trname, trcode),) = tr.items()
-            trigger_names.append(trname)
-            try:
-                lc.action.datastore_function_create(
-                    name=str(trname),
-                    or_replace=True,
-                    rettype='trigger',
-                    definition=str(trcode).format(**dict(
-                        (dkey, _pg_value(dvalue))
-                        for dkey, dvalue in definitions.items())))
-            except NotAuthorized:
-                pass  # normal users won't be able to reset triggers
-        else:
-            trigger_names.append(tr)
-    return trigger_names
+        if not isinstance(tr, dict):
+            continue
+        ((trname, trcode),) = tr.items()
+        if rendered is None:
+            rendered = dict(
+                (dkey, _pg_value(dvalue))
+                for dkey, dvalue in definitions.items())
+        definition = str(trcode).format(**rendered)
+        out.append((str(trname), definition, hashlib.sha256(
+            definition.encode('utf-8')).hexdigest()))
+
+    if token is not None:
+        _trigger_definitions_cache[chromo['resource_name']] = (token, out)
+    return out
+
+
+def _trigger_function_hashes(names: List[str]) -> Dict[str, str]:
+    """
+    return {function name: definition hash} from the COMMENT of existing
+    trigger functions
+    """
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_read_engine().connect() as connection:
+        comments = connection.execute(sa.text('''
+            SELECT p.proname, obj_description(p.oid, 'pg_proc')
+            FROM pg_proc p
+            JOIN pg_namespace n ON n.oid = p.pronamespace
+            WHERE n.nspname = 'public'
+                AND p.proname = ANY(:names)
+                AND p.pronargs = 0
+            '''), {'names': names}).fetchall()
+    return {
+        name: comment[len(TRIGGER_HASH_PREFIX):]
+        for name, comment in comments
+        if comment and comment.startswith(TRIGGER_HASH_PREFIX)}
+
+
+def _set_trigger_function_hash(name: str, digest: str):
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    with backend._get_write_engine().begin() as connection:
+        connection.execute(sa.text(
+            'COMMENT ON FUNCTION {name}() IS {comment}'.format(
+                name=identifier(name),
+                comment=literal_string(TRIGGER_HASH_PREFIX + digest))))
 
 
 def _pg_value(value: Any) -> str:
@@ -521,9 +940,7 @@ def recombinant_datastore_info(up_func: Action,
 
         chromo = get_chromo(recombinant_resource_name)
 
-    keyed_chromo = {}
-    for field in chromo['fields']:
-        keyed_chromo[field['datastore_id']] = field
+    keyed_chromo = get_field_index(chromo).fields_by_id
 
     for field in info.get('fields', []):
         if field['id'] in keyed_chromo:
@@ -550,9 +967,12 @@ def recombinant_datastore_upsert(up_func: Action,
                                  data_dict: DataDict) -> ChainedAction:
     """
     Wraps datastore_upsert action to split Validation Errors with format_trigger_error.
+
+    Clears the cached row count for recombinant tables, in the same
+    transaction when a shared connection is passed in the context.
     """
     try:
-        return up_func(context, data_dict)
+        result = up_func(context, data_dict)
     except ValidationError as e:
         _error_dict = dict(e.error_dict)
         if 'records' not in _error_dict:
@@ -565,6 +985,52 @@ def recombinant_datastore_upsert(up_func: Action,
             for field, field_errs in record_errs.items():
                 record_errs[field] = list(format_trigger_error(field_errs))
         raise ValidationError(_error_dict)
+    if not asbool(data_dict.get('dry_run')):
+        _clear_row_count(context, data_dict['resource_id'])
+    return result
+
+
+@chained_action
+def recombinant_datastore_delete(up_func: Action,
+                                 context: Context,
+                                 data_dict: DataDict) -> ChainedAction:
+    """
+    Wraps datastore_delete action to clear the cached row count for
+    recombinant tables.
+    """
+    result = up_func(context, data_dict)
+    _clear_row_count(context, data_dict['resource_id'])
+    return result
+
+
+@chained_action
+def recombinant_datastore_records_delete(up_func: Action,
+                                         context: Context,
+                                         data_dict: DataDict) -> ChainedAction:
+    """
+    Wraps datastore_records_delete action to clear the cached row count
+    for recombinant tables.
+    """
+    result = up_func(context, data_dict)
+    _clear_row_count(context, data_dict['resource_id'])
+    return result
+
+
+def _clear_row_count(context: Context, resource_id: str):
+    """
+    Clear the cached row count for resource_id on the connection passed
+    in context, if any. Skipped without a query unless the "cached"
+    strategy is configured, and for resources that aren't recombinant
+    tables.
+    """
+    if row_count_strategy() != 'cached':
+        return
+    package_type = Session.query(Package.type).join(
+        Resource, Resource.package_id == Package.id).filter(
+        Resource.id == resource_id).scalar()
+    if package_type not in get_dataset_types():
+        return
+    clear_row_counts([resource_id], context.get('connection'))
 
 
 @chained_action
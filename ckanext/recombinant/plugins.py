@@ -1,4 +1,6 @@
+import hashlib
 import importlib
+import json
 import os
 import uuid
 from urllib.request import urlopen
@@ -67,11 +69,35 @@ class RecombinantPlugin(p.SingletonPlugin, DefaultDatasetForm, DefaultTranslatio
                                        "recombinant.definitions")
         self._chromos, self._genos = (
             _load_table_definitions(self._tables_urls))
+        self._index_definitions()
+
+    def _index_definitions(self):
+        """
+        Build lookup tables used by ckanext.recombinant.tables
+        """
+        helpers.clear_choices_cache()
         self._published_resource_ids = {}
         for chname, ch in self._chromos.items():
             pubid = ch.get('published_resource_id')
             if pubid:
                 self._published_resource_ids[pubid] = chname
+        self._field_indexes = {
+            chname: tables.build_field_index(ch)
+            for chname, ch in self._chromos.items()}
+        self._chromo_aliases = {}
+        for chname in self._chromos:
+            self._chromo_aliases.setdefault(chname.replace('-', ''), chname)
+        self._dataset_types = sorted(self._genos)
+        self._resource_names = [
+            ch['resource_name']
+            for t in self._dataset_types
+            for ch in self._genos[t]['resources']]
+        self._resource_dataset_types = {
+            chname: ch['dataset_type'] for chname, ch in self._chromos.items()}
+        self._definition_hashes = {
+            t: hashlib.sha256(json.dumps(
+                geno, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            for t, geno in self._genos.items()}
 
     def package_types(self) -> List[str]:
         return tables.get_dataset_types()
@@ -131,8 +157,12 @@ class RecombinantPlugin(p.SingletonPlugin, DefaultDatasetForm, DefaultTranslatio
             'recombinant_create': logic.recombinant_create,
             'recombinant_update': logic.recombinant_update,
             'recombinant_show': logic.recombinant_show,
+            'recombinant_show_many': logic.recombinant_show_many,
             'datastore_info': logic.recombinant_datastore_info,
             'datastore_upsert': logic.recombinant_datastore_upsert,
+            'datastore_delete': logic.recombinant_datastore_delete,
+            'datastore_records_delete':
+                logic.recombinant_datastore_records_delete,
             'datastore_search': logic.recombinant_datastore_search,
             'resource_show': logic.recombinant_resource_show,
             'package_show': logic.recombinant_package_show,
@@ -145,6 +175,7 @@ class RecombinantPlugin(p.SingletonPlugin, DefaultDatasetForm, DefaultTranslatio
             'package_update': auth.package_update,
             'package_create': auth.package_create,
             'datastore_delete': auth.datastore_delete,
+            'recombinant_show_many': auth.recombinant_show_many,
         }
 
     # IClick
@@ -3,6 +3,8 @@ import codecs
 
 from typing import Any, Dict, Generator, Tuple, List, Optional
 
+from ckanext.recombinant.tables import get_field_index
+
 
 BATCH_SIZE = 15000
 
@@ -27,6 +29,7 @@ def csv_data_batch(csv_path: str,
     """
     records = []
     current_owner_org = None
+    field_index = get_field_index(chromo)
 
     with open(csv_path, 'rb') as f:
         first3bytes = f.read(3)
@@ -45,17 +48,13 @@ def csv_data_batch(csv_path: str,
                     if f not in ignore_fields]
 
         if strict:
-            expected = [f['datastore_id'] for f in chromo['fields'] if not f.get(
-                'published_resource_computed_field')]
+            expected = list(field_index.table_column_ids)
             if ignore_fields:
-                expected = [f['datastore_id'] for f in chromo['fields'] if
-                            f['datastore_id'] not in ignore_fields]
+                expected = [f_id for f_id in field_index.column_ids if
+                            f_id not in ignore_fields]
             assert cols == expected, 'column mismatch:\n{0}\n{1}'.format(
                 cols, expected)
 
-        none_fields = [f['datastore_id'] for f in chromo['fields']
-                       if f['datastore_type'] != 'text']
-
         for row_dict in csv_in:
             owner_org = row_dict.pop('owner_org', None)
             if owner_org != current_owner_org:
@@ -64,13 +63,12 @@ def csv_data_batch(csv_path: str,
                 records = []
                 current_owner_org = owner_org
 
-            for f_id in none_fields:
+            for f_id in field_index.non_text_ids:
                 if not row_dict.get(f_id, ''):
                     row_dict[f_id] = None
 
-            for f in chromo['fields']:
-                if f.get('published_resource_computed_field'):
-                    row_dict.pop(f['datastore_id'], None)
+            for f_id in field_index.computed_ids:
+                row_dict.pop(f_id, None)
 
             # normalize newlines to \n
             row_dict = dict((k, v.replace('\r\n', '\n').replace('\r', '\n')
@@ -1,31 +1,37 @@
 import re
 
 from openpyxl import load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from openpyxl.worksheet._reader import WorkSheetParser
 
 from typing import Any, List, Dict, Iterator, Union, Optional, Tuple
 
 from werkzeug.datastructures import FileStorage as FlaskFileStorage
 from cgi import FieldStorage
 
-from ckan.plugins.toolkit import _
+from ckan.plugins.toolkit import _, config
 
-from ckanext.recombinant.datatypes import canonicalize
+from ckanext.recombinant.datatypes import canonicalizer
 from ckanext.recombinant.errors import BadExcelData
+from ckanext.recombinant.read_xlsx import xlsx_sheets
 
 
 HEADER_ROWS_V2 = 3
 HEADER_ROWS_V3 = 5
 
+ESCAPED_REGEX = re.compile("_x([0-9A-Fa-f]{4})_")
+
 
 def read_excel(f: Union[str, FlaskFileStorage, FieldStorage],
                expected_sheet_names: List[str] = [],  # type: ignore[reportCallInDefaultInitializer] # noqa: E501
                bad_sheet_names: List[str] = [],  # type: ignore[reportCallInDefaultInitializer] # noqa: E501
-               file_contents: Optional[str] = None) -> Iterator[Any]:
+               file_contents: Optional[str] = None,
+               reader: Optional[str] = None) -> Iterator[Any]:
     """
     Return a generator that opens the excel file f (name or file object)
     and then produces ((sheet-name, org-name), row1, row2, ...)
     :param: f: file name or xlsx file object
+    :param: reader: 'xlsx' or 'openpyxl', default from upload_reader()
 
     :return: Generator that opens the excel file f
     and then produces:
@@ -33,9 +39,11 @@ def read_excel(f: Union[str, FlaskFileStorage, FieldStorage],
         ...
     :rtype: generator
     """
-    # type_ignore_reason: incomplete typing
-    wb = load_workbook(f, read_only=True)  # type: ignore
-    for sheetname in wb.sheetnames:
+    if (reader or upload_reader()) == 'openpyxl':
+        sheets = _openpyxl_sheets(f)
+    else:
+        sheets = xlsx_sheets(f)
+    for sheetname, rowiter in sheets:
 
         # NOTE: we lowercase uploaded worksheet names in the scenario
         #       that users or Excel rename the worksheet
@@ -56,22 +64,19 @@ def read_excel(f: Union[str, FlaskFileStorage, FieldStorage],
             #       We want to skip these as those sheets will not have what we need.
             continue
         # type_ignore_reason: incomplete typing
-        sheet: Worksheet = wb[sheetname]
-        rowiter = sheet.rows
-        # type_ignore_reason: incomplete typing
         organization_row = next(rowiter)
 
         # type_ignore_reason: incomplete typing
         next(rowiter)
         names_row = next(rowiter)
 
-        org_name = organization_row[0].value
-        if org_name and names_row[0].value != 'v3':
+        org_name = _row_value(organization_row, 0)
+        if org_name and _row_value(names_row, 0) != 'v3':
             # v2 template
             yield (
                 _sheetname,
                 org_name,
-                [c.value for c in names_row],
+                list(names_row),
                 # type_ignore_reason: incomplete typing
                 _filter_bumf(rowiter, HEADER_ROWS_V2))
             continue
@@ -79,24 +84,94 @@ def read_excel(f: Union[str, FlaskFileStorage, FieldStorage],
         # type_ignore_reason: incomplete typing
         next(rowiter)
         example_row = next(rowiter)
-        if example_row[0].value != 'e.g.' and example_row[0].value != 'ex.':
+        example = _row_value(example_row, 0)
+        if example != 'e.g.' and example != 'ex.':
             raise BadExcelData('Example record on row 5 is missing')
 
         yield (
             _sheetname,
-            names_row[1].value,
-            [c.value for c in names_row[2:]],
+            _row_value(names_row, 1),
+            list(names_row[2:]),
             _filter_bumf((row[2:] for row in rowiter), HEADER_ROWS_V3))
 
 
+def upload_reader() -> str:
+    """
+    'xlsx' (default) to read uploads with the direct XML reader in
+    read_xlsx or 'openpyxl' to use openpyxl.load_workbook
+    """
+    return config.get('recombinant.upload_reader', 'xlsx')
+
+
+def _openpyxl_sheets(
+        f: Any) -> Iterator[Tuple[str, Iterator[Tuple[Any, ...]]]]:
+    """
+    Generate (sheet-name, rows) for each sheet in the excel file f
+    """
+    # type_ignore_reason: incomplete typing
+    wb = load_workbook(f, read_only=True)  # type: ignore
+    for sheetname in wb.sheetnames:
+        # type_ignore_reason: incomplete typing
+        sheet: ReadOnlyWorksheet = wb[sheetname]
+        yield sheetname, _sheet_rows(sheet)
+
+
+class _ValueRowParser(WorkSheetParser):
+    """
+    Worksheet parser that skips cells without a value or formula,
+    e.g. the formatted blank cells in templates
+    """
+    def parse_row(self, row: Any) -> Tuple[int, List[Dict[str, Any]]]:
+        row[:] = [el for el in row if len(el) or el.get('r') is None]
+        return super(_ValueRowParser, self).parse_row(row)
+
+
+def _sheet_rows(sheet: ReadOnlyWorksheet) -> Iterator[Tuple[Any, ...]]:
+    """
+    Generate a tuple of values for each row of sheet as far as the last
+    row in the sheet, ignoring the stored sheet dimensions. Rows are only
+    as wide as their last cell with a value.
+    """
+    src = sheet._get_source()
+    parser = _ValueRowParser(
+        src,
+        sheet._shared_strings,
+        data_only=sheet.parent.data_only,
+        epoch=sheet.parent.epoch,
+        date_formats=sheet.parent._date_formats)
+    try:
+        expected = 1
+        for idx, cells in parser.parse():
+            # some rows are missing
+            for _missing in range(expected, idx):
+                yield ()
+            expected = idx + 1
+            values = [None] * max((c['column'] for c in cells), default=0)
+            for c in cells:
+                values[c['column'] - 1] = c['value']
+            yield tuple(values)
+    finally:
+        src.close()
+
+
+def _row_value(row: Tuple[Any, ...], index: int) -> Any:
+    """
+    value at index in a row of values that may be short or empty
+    """
+    return row[index] if index < len(row) else None
+
+
 def _filter_bumf(rowiter: Iterator[Any],
                  header_rows: int) -> Iterator[Any]:
     i = header_rows
     for row in rowiter:
         i += 1
+        if row.count(None) == len(row):
+            # skip rows with no values quickly
+            continue
         values = [
-            unescape(c.value) if isinstance(c.value, str) else c.value
-            for c in row]
+            unescape(v) if isinstance(v, str) else v
+            for v in row]
         # return next non-empty row
         if not all(_is_bumf(v) for v in values):
             yield i, values
@@ -137,7 +212,25 @@ def get_records(rows: Iterator[Any],
     :return: canonicalized records of specified upload data
     :rtype: tuple of dicts
     """
-    records = []
+    return list(iter_records(
+        rows, fields, primary_key_fields, choice_fields))
+
+
+def iter_records(rows: Iterator[Any],
+                 fields: List[Any],
+                 primary_key_fields: List[str],
+                 choice_fields: Dict[str, Any]) -> Iterator[Tuple[Any, Any]]:
+    """
+    Generator version of get_records producing (row_number, record)
+    one row at a time
+    """
+    columns = [(
+        f['datastore_id'],
+        canonicalizer(
+            f['datastore_type'],
+            f['datastore_id'] in primary_key_fields,
+            choice_fields.get(f['datastore_id'], False)))
+        for f in fields]
     for n, row in rows:
         # trailing cells might be empty: trim row to fit
         while (row and
@@ -148,35 +241,26 @@ def get_records(rows: Iterator[Any],
             row.append(None)  # placeholder: canonicalize once only, below
 
         try:
-            records.append(
-                (n, dict((
-                    f['datastore_id'],
-                    canonicalize(
-                        v,
-                        f['datastore_type'],
-                        f['datastore_id'] in primary_key_fields,
-                        choice_fields.get(f['datastore_id'], False)))
-                    for f, v in zip(fields, row))))
+            yield (n, {
+                datastore_id: canon(v)
+                for (datastore_id, canon), v in zip(columns, row)})
         except BadExcelData as e:
             raise BadExcelData('Row {0}:'.format(n) + ' ' + e.message)
 
-    return records
-
 
 # XXX remove this function once we upgrade to openpyxl 2.4
 def unescape(value: str) -> str:
     """
     copy of unescape from openpyxl.utils.escape, openpyxl version 2.4.x
     """
-    ESCAPED_REGEX = re.compile("_x([0-9A-Fa-f]{4})_")
-
-    def _sub(match: Any):
-        """
-        Callback to unescape chars
-        """
-        return chr(int(match.group(1), 16))
-
     if "_x" in value:
-        value = ESCAPED_REGEX.sub(_sub, value)
+        value = ESCAPED_REGEX.sub(_unescape_char, value)
 
     return value
+
+
+def _unescape_char(match: Any) -> str:
+    """
+    Callback to unescape chars
+    """
+    return chr(int(match.group(1), 16))
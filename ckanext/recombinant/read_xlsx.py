@@ -0,0 +1,261 @@
+"""
+Minimal .xlsx reader for uploads.
+
+Sheet and shared string XML is parsed directly from the zip file, producing
+only the cell values read_excel needs. Values match those produced by
+openpyxl.load_workbook(read_only=True): numbers in date formatted cells are
+converted to datetimes and formulas are returned as "=..." strings.
+"""
+import posixpath
+from zipfile import ZipFile
+
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import builtin_format_code, is_date_format
+from openpyxl.utils.cell import column_index_from_string
+from openpyxl.utils.datetime import (
+    from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904)
+from openpyxl.xml.functions import iterparse, fromstring
+
+
+SHEET_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+PACKAGE_RELS_NS = \
+    'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_RELS_NS = \
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+ROW_TAG = '{%s}row' % SHEET_MAIN_NS
+VALUE_TAG = '{%s}v' % SHEET_MAIN_NS
+FORMULA_TAG = '{%s}f' % SHEET_MAIN_NS
+INLINE_STRING_TAG = '{%s}is' % SHEET_MAIN_NS
+STRING_ITEM_TAG = '{%s}si' % SHEET_MAIN_NS
+TEXT_TAG = '{%s}t' % SHEET_MAIN_NS
+RICH_TEXT_TAG = '{%s}r' % SHEET_MAIN_NS
+NUM_FMT_TAG = '{%s}numFmts/{%s}numFmt' % (SHEET_MAIN_NS, SHEET_MAIN_NS)
+CELL_XF_TAG = '{%s}cellXfs/{%s}xf' % (SHEET_MAIN_NS, SHEET_MAIN_NS)
+SHEET_TAG = '{%s}sheets/{%s}sheet' % (SHEET_MAIN_NS, SHEET_MAIN_NS)
+WORKBOOK_PR_TAG = '{%s}workbookPr' % SHEET_MAIN_NS
+RELATIONSHIP_TAG = '{%s}Relationship' % PACKAGE_RELS_NS
+RELATIONSHIP_ID = '{%s}id' % OFFICE_RELS_NS
+
+OFFICE_DOCUMENT_REL = OFFICE_RELS_NS + '/officeDocument'
+WORKSHEET_REL = OFFICE_RELS_NS + '/worksheet'
+SHARED_STRINGS_REL = OFFICE_RELS_NS + '/sharedStrings'
+STYLES_REL = OFFICE_RELS_NS + '/styles'
+
+
+def xlsx_sheets(f: Any) -> Iterator[Tuple[str, Iterator[Tuple[Any, ...]]]]:
+    """
+    Generate (sheet-name, rows) for each worksheet in the xlsx file f
+    (name or file object), where rows generates a tuple of values for each
+    row as far as the last row in the sheet. Rows are only as wide as
+    their last cell with a value. Sheet XML is only parsed as rows are
+    consumed.
+    """
+    archive = ZipFile(f)
+    try:
+        workbook_path = _rels_targets(archive, '')[OFFICE_DOCUMENT_REL][0]
+        workbook_rels = _rels_targets(archive, workbook_path)
+        workbook = fromstring(archive.read(workbook_path))
+
+        epoch = CALENDAR_WINDOWS_1900
+        workbook_pr = workbook.find(WORKBOOK_PR_TAG)
+        if workbook_pr is not None and workbook_pr.get('date1904') in (
+                '1', 'true'):
+            epoch = CALENDAR_MAC_1904
+
+        strings: List[str] = []
+        for path in workbook_rels.get(SHARED_STRINGS_REL, []):
+            strings = _read_shared_strings(archive, path)
+        date_styles: Set[int] = set()
+        for path in workbook_rels.get(STYLES_REL, []):
+            date_styles = _read_date_styles(archive, path)
+
+        # converted date values, shared by all sheets
+        dates: Dict[str, Any] = {}
+        sheet_paths = _rels_by_id(archive, workbook_path)
+        for sheet in workbook.iterfind(SHEET_TAG):
+            path = sheet_paths.get(sheet.get(RELATIONSHIP_ID))
+            if path not in workbook_rels.get(WORKSHEET_REL, []):
+                continue  # e.g. chartsheets
+            yield sheet.get('name'), _sheet_rows(
+                archive, path, strings, date_styles, epoch, dates)
+    finally:
+        archive.close()
+
+
+def _sheet_rows(archive: ZipFile,
+                path: str,
+                strings: List[str],
+                date_styles: Set[int],
+                epoch: float,
+                dates: Dict[str, Any]) -> Iterator[Tuple[Any, ...]]:
+    """
+    Generate a tuple of values for each row in the sheet at path
+    """
+    shared_formulas: Dict[str, Translator] = {}
+    expected = 1
+    with archive.open(path) as src:
+        for _event, row in iterparse(src):
+            if row.tag != ROW_TAG:
+                continue
+            idx = int(row.get('r', expected))
+            # some rows are missing
+            for _missing in range(expected, idx):
+                yield ()
+            expected = idx + 1
+
+            values: List[Any] = []
+            for cell in row:
+                if not len(cell):
+                    # formatted blank cell
+                    continue
+                coordinate = cell.get('r')
+                if coordinate:
+                    column = column_index_from_string(
+                        coordinate.rstrip('0123456789'))
+                else:
+                    column = len(values) + 1
+                if len(values) < column:
+                    values.extend([None] * (column - len(values)))
+                values[column - 1] = _cell_value(
+                    cell, strings, date_styles, epoch, dates, shared_formulas)
+            row.clear()
+            yield tuple(values)
+
+
+def _cell_value(cell: Any,
+                strings: List[str],
+                date_styles: Set[int],
+                epoch: float,
+                dates: Dict[str, Any],
+                shared_formulas: Dict[str, Translator]) -> Any:
+    """
+    Value of a <c> element, as produced by openpyxl's WorkSheetParser
+    """
+    data_type = cell.get('t', 'n')
+    formula = cell.find(FORMULA_TAG)
+    if formula is not None:
+        value = '=' + (formula.text or '')
+        if formula.get('t') == 'shared':
+            idx = formula.get('si')
+            if idx in shared_formulas:
+                value = shared_formulas[idx].translate_formula(cell.get('r'))
+            elif value != '=':
+                shared_formulas[idx] = Translator(value, cell.get('r'))
+        return value
+
+    if data_type == 'inlineStr':
+        child = cell.find(INLINE_STRING_TAG)
+        return None if child is None else _string_item_text(child)
+
+    value = cell.findtext(VALUE_TAG) or None
+    if value is None:
+        return None
+    if data_type == 'n':
+        if int(cell.get('s', 0)) in date_styles:
+            if value not in dates:
+                try:
+                    dates[value] = from_excel(_number(value), epoch)
+                except ValueError:
+                    dates[value] = '#VALUE!'
+            return dates[value]
+        return _number(value)
+    if data_type == 's':
+        return strings[int(value)]
+    if data_type == 'b':
+        return bool(int(value))
+    if data_type == 'd':
+        return from_ISO8601(value)
+    return value
+
+
+def _number(value: str) -> Union[int, float]:
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def _string_item_text(item: Any) -> str:
+    """
+    Plain text of a shared or inline string, ignoring formatting and
+    phonetic runs
+    """
+    snippets = []
+    plain = item.findtext(TEXT_TAG)
+    if plain is not None:
+        snippets.append(plain)
+    for run in item.iterfind(RICH_TEXT_TAG):
+        text = run.findtext(TEXT_TAG)
+        if text is not None:
+            snippets.append(text)
+    return ''.join(snippets)
+
+
+def _read_shared_strings(archive: ZipFile, path: str) -> List[str]:
+    strings = []
+    with archive.open(path) as src:
+        for _event, node in iterparse(src):
+            if node.tag == STRING_ITEM_TAG:
+                strings.append(
+                    _string_item_text(node).replace('x005F_', ''))
+                node.clear()
+    return strings
+
+
+def _read_date_styles(archive: ZipFile, path: str) -> Set[int]:
+    """
+    Indexes of the cell styles with date number formats
+    """
+    styles = fromstring(archive.read(path))
+    custom = {
+        int(fmt.get('numFmtId')): fmt.get('formatCode')
+        for fmt in styles.iterfind(NUM_FMT_TAG)}
+    date_styles = set()
+    for idx, xf in enumerate(styles.iterfind(CELL_XF_TAG)):
+        num_fmt_id = int(xf.get('numFmtId', 0))
+        fmt: Optional[str] = custom.get(num_fmt_id)
+        if fmt is None:
+            fmt = builtin_format_code(num_fmt_id)
+        if is_date_format(fmt):
+            date_styles.add(idx)
+    return date_styles
+
+
+def _rels_by_id(archive: ZipFile, part_path: str) -> Dict[str, str]:
+    """
+    {relationship id: target path} for the part at part_path
+    """
+    return {
+        rel_id: target
+        for rel_id, _rel_type, target in _read_rels(archive, part_path)}
+
+
+def _rels_targets(archive: ZipFile, part_path: str) -> Dict[str, List[str]]:
+    """
+    {relationship type: [target path, ...]} for the part at part_path,
+    or the package when part_path is ''
+    """
+    targets: Dict[str, List[str]] = {}
+    for _rel_id, rel_type, target in _read_rels(archive, part_path):
+        targets.setdefault(rel_type, []).append(target)
+    return targets
+
+
+def _read_rels(archive: ZipFile,
+               part_path: str) -> Iterator[Tuple[str, str, str]]:
+    folder, name = posixpath.split(part_path)
+    rels_path = posixpath.join(folder, '_rels', name + '.rels')
+    if rels_path not in archive.NameToInfo:
+        return
+    for rel in fromstring(archive.read(rels_path)).iterfind(
+            RELATIONSHIP_TAG):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        yield rel.get('Id'), rel.get('Type'), target
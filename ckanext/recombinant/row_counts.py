@@ -0,0 +1,241 @@
+"""
+Row counts of datastore tables for recombinant_show.
+
+recombinant.row_count selects how datastore_rows is found:
+
+exact
+    count(*) on each table, the default
+estimate
+    the planner estimate from pg_class.reltuples, updated by VACUUM and
+    ANALYZE, with an exact count for tables not analyzed yet
+cached
+    an exact count stored in the ROW_COUNT_TABLE datastore table and
+    cleared when records are upserted or deleted. Counts are only cached
+    when this strategy is configured, because writers only clear them
+    then. The table is created by recombinant update, counts are exact
+    until then
+none
+    no counts, datastore_rows is not included
+"""
+from typing import Any, Dict, List, Optional
+
+import sqlalchemy as sa
+
+from ckan.plugins.toolkit import config
+
+from ckanext.datastore.backend import DatastoreBackend
+from ckanext.datastore.backend.postgres import (
+    DatastorePostgresqlBackend,
+    identifier,
+    literal_string
+)
+
+from ckanext.recombinant.errors import RecombinantConfigurationError
+
+ROW_COUNT_STRATEGIES = ('exact', 'estimate', 'cached', 'none')
+ROW_COUNT_TABLE = '_recombinant_row_counts'
+# datastore tables counted per statement
+COUNT_BATCH_SIZE = 200
+
+# set once ROW_COUNT_TABLE is found, a missing table is checked again
+# on each call so processes started before it was created will use it
+_row_count_table_found = False
+
+
+def row_count_strategy() -> str:
+    """
+    return the configured recombinant.row_count strategy
+    """
+    strategy = config.get('recombinant.row_count') or 'exact'
+    if strategy not in ROW_COUNT_STRATEGIES:
+        raise RecombinantConfigurationError(
+            'recombinant.row_count must be one of: ' +
+            ', '.join(ROW_COUNT_STRATEGIES))
+    return strategy
+
+
+def datastore_row_counts(table_names: List[str],
+                         strategy: Optional[str] = None) -> Dict[str, int]:
+    """
+    return {table_name: rows} for existing datastore tables in table_names
+    using strategy (default: the configured strategy). Returns {} for
+    the "none" strategy. The "cached" strategy counts exactly unless it
+    is also the configured strategy.
+    """
+    strategy = strategy or row_count_strategy()
+    if not table_names or strategy == 'none':
+        return {}
+
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    if strategy == 'cached' and not _caching_row_counts():
+        strategy = 'exact'
+    with backend._get_read_engine().connect() as connection:
+        if strategy == 'estimate':
+            counts = _estimated_row_counts(connection, table_names)
+            counts.update(_exact_row_counts(
+                connection, [t for t in counts if counts[t] < 0]))
+            return counts
+        if strategy == 'exact':
+            return _exact_row_counts(connection, _existing_tables(
+                connection, table_names))
+
+    with _write_engine().begin() as connection:
+        return _cached_row_counts(connection, table_names)
+
+
+def row_count_table_exists() -> bool:
+    """
+    return True if the ROW_COUNT_TABLE used by the "cached" strategy
+    exists. Once found the table isn't checked again by this process.
+    """
+    global _row_count_table_found
+    if not _row_count_table_found:
+        # type_ignore_reason: incomplete typing
+        backend: DatastorePostgresqlBackend = DatastoreBackend.\
+            get_active_backend()  # type: ignore
+        with backend._get_read_engine().connect() as connection:
+            _row_count_table_found = _has_row_count_table(connection)
+    return _row_count_table_found
+
+
+def create_row_count_table():
+    """
+    Create the ROW_COUNT_TABLE used by the "cached" strategy if it
+    doesn't exist yet. Until it is created row counts are exact.
+    """
+    global _row_count_table_found
+    if row_count_table_exists():
+        return
+    with _write_engine().begin() as connection:
+        connection.execute(sa.text('''
+            CREATE TABLE IF NOT EXISTS {table} (
+                table_name text PRIMARY KEY,
+                row_count bigint)
+            '''.format(table=identifier(ROW_COUNT_TABLE))))
+    _row_count_table_found = True
+
+
+def clear_row_counts(table_names: List[str], connection: Any = None):
+    """
+    Mark the cached row counts for table_names as out of date. Call from
+    the transaction that writes or deletes records, passing its
+    connection, so that readers can't store a count from before the
+    change: the updated rows stay locked until the writer commits.
+    Without a connection the counts are cleared in a new transaction,
+    after the change has been committed.
+
+    Does nothing unless the "cached" strategy is configured and the
+    ROW_COUNT_TABLE exists.
+    """
+    if not table_names or not _caching_row_counts():
+        return
+    if connection is None:
+        with _write_engine().begin() as connection:
+            clear_row_counts(table_names, connection)
+        return
+    connection.execute(sa.text(
+        'INSERT INTO {table} (table_name, row_count) '
+        'SELECT name, NULL FROM unnest(CAST(:names AS text[])) AS name '
+        'ORDER BY name '
+        'ON CONFLICT (table_name) DO UPDATE SET row_count = NULL'.format(
+            table=identifier(ROW_COUNT_TABLE))),
+        {'names': sorted(set(table_names))})
+
+
+def _caching_row_counts() -> bool:
+    return row_count_strategy() == 'cached' and row_count_table_exists()
+
+
+def _write_engine() -> Any:
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    return backend._get_write_engine()
+
+
+def _existing_tables(connection: Any, table_names: List[str]) -> List[str]:
+    return [name for (name,) in connection.execute(sa.text('''
+        SELECT c.relname FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = ANY(:names)
+        '''), {'names': list(table_names)})]
+
+
+def _exact_row_counts(connection: Any,
+                      table_names: List[str]) -> Dict[str, int]:
+    """
+    return {table_name: count(*)} counting COUNT_BATCH_SIZE tables
+    per statement
+    """
+    counts = {}
+    for i in range(0, len(table_names), COUNT_BATCH_SIZE):
+        batch = table_names[i:i + COUNT_BATCH_SIZE]
+        counts.update(connection.execute(sa.text(' UNION ALL '.join(
+            'SELECT {name}, count(*) FROM {table}'.format(
+                name=literal_string(t), table=identifier(t))
+            for t in batch))).fetchall())
+    return counts
+
+
+def _estimated_row_counts(connection: Any,
+                          table_names: List[str]) -> Dict[str, int]:
+    """
+    return {table_name: reltuples}, -1 for tables never analyzed
+    """
+    return dict(connection.execute(sa.text('''
+        SELECT c.relname, CASE
+            WHEN c.reltuples < 0 THEN -1
+            WHEN c.reltuples = 0 AND c.relpages = 0 THEN -1
+            ELSE c.reltuples::bigint END
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = ANY(:names)
+        '''), {'names': list(table_names)}).fetchall())
+
+
+def _cached_row_counts(connection: Any,
+                       table_names: List[str]) -> Dict[str, int]:
+    """
+    return {table_name: rows} from ROW_COUNT_TABLE, counting and storing
+    the tables with no count there.
+
+    Rows are locked with SELECT .. FOR UPDATE so that a writer clearing
+    a count waits for the new count to be stored. Rows already locked by
+    a writer are skipped and counted without storing the result: the
+    writer will clear it when it commits.
+    """
+    row_count_table = identifier(ROW_COUNT_TABLE)
+    existing = sorted(_existing_tables(connection, table_names))
+    if not existing:
+        return {}
+    connection.execute(sa.text(
+        'INSERT INTO {table} (table_name) '
+        'SELECT name FROM unnest(CAST(:names AS text[])) AS name '
+        'ORDER BY name '
+        'ON CONFLICT (table_name) DO NOTHING'.format(table=row_count_table)),
+        {'names': existing})
+    locked = dict(connection.execute(sa.text(
+        'SELECT table_name, row_count FROM {table} '
+        'WHERE table_name = ANY(:names) ORDER BY table_name '
+        'FOR UPDATE SKIP LOCKED'.format(table=row_count_table)),
+        {'names': existing}).fetchall())
+
+    counts = {t: r for t, r in locked.items() if r is not None}
+    new_counts = _exact_row_counts(
+        connection, [t for t in existing if t not in counts])
+    stale = [t for t, r in locked.items() if r is None and t in new_counts]
+    if stale:
+        connection.execute(sa.text(
+            'UPDATE {table} SET row_count = :rows '
+            'WHERE table_name = :name'.format(table=row_count_table)),
+            [{'name': t, 'rows': new_counts[t]} for t in stale])
+    counts.update(new_counts)
+    return counts
+
+
+def _has_row_count_table(connection: Any) -> bool:
+    return connection.execute(sa.text(
+        'SELECT to_regclass(:name) IS NOT NULL'),
+        {'name': 'public.' + identifier(ROW_COUNT_TABLE)}).scalar()
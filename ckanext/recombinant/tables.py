@@ -6,8 +6,10 @@ This module provides access to those definitions.
 """
 import importlib
 import os
+from types import MappingProxyType
 
-from typing import List, Dict, Optional, Any
+from typing import (
+    List, Dict, Optional, Any, FrozenSet, Mapping, NamedTuple, Tuple, Union)
 
 import ckan.plugins as p
 
@@ -19,6 +21,12 @@ class IRecombinant(p.Interface):
     _published_resource_ids = {}
     _genos = {}
     _chromos = {}
+    _field_indexes = {}
+    _chromo_aliases = {}
+    _resource_dataset_types = {}
+    _dataset_types = []
+    _resource_names = []
+    _definition_hashes = {}
 
     pass
 
@@ -37,16 +45,90 @@ def get_chromo(resource_name: str) -> Dict[str, Any]:
     """
     Get the resource definition (chromo) for the given resource name
     """
-    chromos = _get_plugin()._chromos
+    plugin = _get_plugin()
     try:
-        return chromos[resource_name]
+        return plugin._chromos[resource_name]
     except KeyError:
         # workaround for file names having -'s removed when uploaded
         # to some versions of CKAN
-        for rname in chromos:
-            if rname.replace('-', '') == resource_name:
-                return chromos[rname]
-        raise RecombinantException('resource_name "%s" not found' % resource_name)
+        try:
+            return plugin._chromos[plugin._chromo_aliases[resource_name]]
+        except KeyError:
+            raise RecombinantException(
+                'resource_name "%s" not found' % resource_name)
+
+
+class FieldIndex(NamedTuple):
+    """
+    Field metadata derived from a chromo, built once when the
+    definitions are loaded. Use get_field_index to access.
+    """
+    # datastore_id: field for all fields
+    fields_by_id: Mapping[str, Dict[str, Any]]
+    # datastore_ids of all fields in definition order
+    column_ids: Tuple[str, ...]
+    # datastore_ids of fields stored in the table (not computed)
+    table_column_ids: Tuple[str, ...]
+    # fields included in the excel template, in column order
+    template_fields: Tuple[Dict[str, Any], ...]
+    template_column_ids: Tuple[str, ...]
+    primary_key: Tuple[str, ...]
+    primary_key_set: FrozenSet[str]
+    # datastore_ids of non-text fields, stored as NULL when empty
+    non_text_ids: Tuple[str, ...]
+    # datastore_ids of published_resource_computed_field fields
+    computed_ids: Tuple[str, ...]
+    # datastore_ids of stored _text (list) fields
+    list_ids: Tuple[str, ...]
+    # datastore_id: 'full' or True for fields with choices
+    choice_modes: Mapping[str, Union[str, bool]]
+
+
+def build_field_index(chromo: Dict[str, Any]) -> FieldIndex:
+    """
+    Compile the FieldIndex for a resource definition (chromo)
+    """
+    fields = chromo['fields']
+    table_fields = [
+        f for f in fields if not f.get('published_resource_computed_field')]
+    template_fields = tuple(
+        f for f in table_fields if f.get('import_template_include', True))
+    pk = chromo.get('datastore_primary_key', [])
+    if not isinstance(pk, list):
+        pk = [pk]
+    return FieldIndex(
+        fields_by_id=MappingProxyType(
+            {f['datastore_id']: f for f in fields}),
+        column_ids=tuple(f['datastore_id'] for f in fields),
+        table_column_ids=tuple(f['datastore_id'] for f in table_fields),
+        template_fields=template_fields,
+        template_column_ids=tuple(f['datastore_id'] for f in template_fields),
+        primary_key=tuple(pk),
+        primary_key_set=frozenset(pk),
+        non_text_ids=tuple(
+            f['datastore_id'] for f in fields if f['datastore_type'] != 'text'),
+        computed_ids=tuple(
+            f['datastore_id'] for f in fields
+            if f.get('published_resource_computed_field')),
+        list_ids=tuple(
+            f['datastore_id'] for f in table_fields
+            if f['datastore_type'] == '_text'),
+        choice_modes=MappingProxyType({
+            f['datastore_id']:
+                'full' if f.get('excel_full_text_choices') else True
+            for f in fields if 'choices' in f or 'choices_file' in f}),
+    )
+
+
+def get_field_index(chromo: Dict[str, Any]) -> FieldIndex:
+    """
+    Get the FieldIndex for the given resource definition (chromo)
+    """
+    try:
+        return _get_plugin()._field_indexes[chromo['resource_name']]
+    except KeyError:
+        # chromo not loaded from recombinant.definitions
+        return build_field_index(chromo)
 
 
 def get_geno(dataset_type: str) -> Dict[str, Any]:
@@ -60,20 +142,29 @@ def get_geno(dataset_type: str) -> Dict[str, Any]:
         raise RecombinantException('dataset_type "%s" not found' % dataset_type)
 
 
+def get_definition_hash(dataset_type: str) -> str:
+    """
+    Get a hash of the dataset definition (geno) for the given dataset type
+    that changes when any part of the definition changes
+    """
+    try:
+        return _get_plugin()._definition_hashes[dataset_type]
+    except KeyError:
+        raise RecombinantException('dataset_type "%s" not found' % dataset_type)
+
+
 def get_dataset_types() -> List[str]:
     """
     Get a list of recombinant dataset types
     """
-    return sorted(_get_plugin()._genos)
+    return list(_get_plugin()._dataset_types)
 
 
 def get_resource_names() -> List[str]:
     """
     Get a list of recombinant resource names
     """
-    return [chromo['resource_name']
-            for t in get_dataset_types()
-            for chromo in get_geno(t)['resources']]
+    return list(_get_plugin()._resource_names)
 
 
 def get_published_resource_resource_name(res_id: str) -> str:
@@ -88,10 +179,7 @@ def get_dataset_type_for_resource_name(resource_name: str) -> Optional[str]:
     Get the dataset type that contains resource_name,
     or None if not found
     """
-    for t in get_dataset_types():
-        for resource in get_geno(t)['resources']:
-            if resource['resource_name'] == resource_name:
-                return t
+    return _get_plugin()._resource_dataset_types.get(resource_name)
 
 
 def get_target_datasets() -> List[str]:
@@ -0,0 +1,125 @@
+"""
+On-disk cache of generated Excel templates.
+
+Templates are stored as saved .xlsx bytes in recombinant.template_cache_dir
+keyed by a hash of everything excel_template uses to build them: the
+dataset definition, the user language, the organization name and title
+and the choice lists for the organization. The least recently used files
+are removed once there are more than recombinant.template_cache_size.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from io import BytesIO
+
+from typing import Any, Dict, Optional
+
+from openpyxl import Workbook
+
+from ckan.plugins.toolkit import config, h, asint
+
+from ckanext.recombinant.tables import get_geno, get_definition_hash
+from ckanext.recombinant.helpers import recombinant_choice_fields
+from ckanext.recombinant.write_excel import excel_template, compact_templates
+
+# change when excel_template output changes for the same inputs
+TEMPLATE_CACHE_VERSION = 2
+DEFAULT_TEMPLATE_CACHE_SIZE = 500
+
+
+def excel_template_bytes(dataset_type: str, org: Dict[str, Any]) -> bytes:
+    """
+    return the saved .xlsx file contents of excel_template(dataset_type, org)
+    from the template cache, generating and storing it if required
+    """
+    cache_dir = template_cache_dir()
+    if not cache_dir:
+        return workbook_bytes(
+            excel_template(dataset_type, org, write_only=True))
+
+    path = os.path.join(
+        cache_dir, template_cache_key(dataset_type, org) + '.xlsx')
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)  # mark as recently used
+        return data
+    except FileNotFoundError:
+        pass
+
+    data = workbook_bytes(excel_template(dataset_type, org, write_only=True))
+    _store(cache_dir, path, data)
+    return data
+
+
+def template_cache_dir() -> Optional[str]:
+    """
+    return the configured template cache directory, creating it if required,
+    or None when the template cache is disabled
+    """
+    cache_dir = config.get('recombinant.template_cache_dir')
+    if not cache_dir:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def template_cache_key(dataset_type: str, org: Dict[str, Any]) -> str:
+    """
+    return a hash of the inputs used by excel_template for the current
+    language
+    """
+    geno = get_geno(dataset_type)
+    choices = [
+        recombinant_choice_fields(
+            chromo['resource_name'], org_name=org.get('name'))
+        for chromo in geno['resources']]
+    return hashlib.sha256(json.dumps([
+        TEMPLATE_CACHE_VERSION,
+        dataset_type,
+        get_definition_hash(dataset_type),
+        h.lang(),
+        compact_templates(),
+        org.get('name'),
+        org.get('title'),
+        choices,
+    ], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def workbook_bytes(book: Workbook) -> bytes:
+    blob = BytesIO()
+    book.save(blob)
+    return blob.getvalue()
+
+
+def _store(cache_dir: str, path: str, data: bytes):
+    """
+    write data to path atomically then evict the least recently used
+    templates over the configured cache size
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    size = asint(config.get(
+        'recombinant.template_cache_size', DEFAULT_TEMPLATE_CACHE_SIZE))
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith('.xlsx'):
+            continue
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue  # removed by another process
+    entries.sort()
+    for _mtime, old_path in entries[:max(0, len(entries) - size)]:
+        try:
+            os.unlink(old_path)
+        except FileNotFoundError:
+            pass
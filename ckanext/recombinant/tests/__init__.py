@@ -3,6 +3,8 @@ from ckanapi import LocalCKAN
 from ckan.tests.helpers import reset_db
 from ckan.lib.search import clear_all
 
+from ckanext.recombinant import row_counts
+
 
 class RecombinantTestBase(object):
     @classmethod
@@ -12,6 +14,7 @@ class RecombinantTestBase(object):
         """
         reset_db()
         clear_all()
+        row_counts._row_count_table_found = False
 
         lc = LocalCKAN()
 
@@ -3,7 +3,8 @@ import pytest
 
 from datetime import datetime, date
 
-from ckanext.recombinant.datatypes import canonicalize, BadExcelData
+from ckanext.recombinant.datatypes import (
+    canonicalize, canonicalizer, datastore_type, BadExcelData)
 
 
 def test_year():
@@ -250,3 +251,26 @@ def test_choice_field():
     assert canonicalize(' C1: Value', 'text', False, False) == ' C1: Value'
     assert canonicalize(' C1: Value', 'text', False, True) == 'C1: Value'
     assert canonicalize(' C1: Value', 'text', False, 'full') == 'C1'
+
+
+def test_canonicalizer():
+    values = [
+        None, '', ' ', 0, 7, -5, 42.0, 42.25, True, 10 ** 40, '0', '0042',
+        '2019', '42.0', '42.25', '1e3', 'NaN', '$1,000.50', '\u00b2',
+        'AB,CD,E', 'C1 ', ' C1: Value', '\t OGP-324\n', 'OGP-\r\n\r\n324',
+        '=1+1', '=TRUE()', '=FALSE()', date(2020, 11, 15),
+        datetime(2020, 11, 15), '9' * 40]
+    for dt in datastore_type:
+        for primary_key in (False, True):
+            for choice_field in (False, True, 'full'):
+                canon = canonicalizer(dt, primary_key, choice_field)
+                for value in values:
+                    try:
+                        expected = canonicalize(
+                            value, dt, primary_key, choice_field)
+                    except BadExcelData:
+                        with pytest.raises(BadExcelData):
+                            canon(value)
+                        continue
+                    assert canon(value) == expected, (
+                        dt, primary_key, choice_field, value)
@@ -0,0 +1,175 @@
+import mock
+import sqlalchemy as sa
+
+from ckan.tests.factories import Organization
+from ckanext.recombinant.tests import RecombinantTestBase
+
+from ckanapi import LocalCKAN
+from ckan.plugins.toolkit import config
+from ckanext.datastore.backend import DatastoreBackend
+from ckanext.datastore.backend.postgres import identifier
+from ckanext.recombinant.tables import _get_plugin, get_chromo
+from ckanext.recombinant.cli import _load_org_records
+
+
+class TestRecombinantCli(RecombinantTestBase):
+    @classmethod
+    def setup_method(self, method):
+        """Method is called at class level before EACH test methods of the class are called.
+        Setup any state specific to the execution of the given class methods.
+        """
+        super(TestRecombinantCli, self).setup_method(method)
+
+        self.org = Organization()
+        self.lc = LocalCKAN()
+
+    def test_load_org_records_app_context(self):
+        """
+        Each datastore_upsert call on the shared connection should get
+        the datastore_app_context table, including calls after a
+        rejected record.
+        """
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=self.org['name'])
+        resource_id = self.lc.action.recombinant_show(
+            dataset_type='sample',
+            owner_org=self.org['name'])['resources'][0]['id']
+        _require_app_context(resource_id)
+
+        flags = ['recombinant_import']
+        lc = LocalCKAN(context={'datastore_app_context_flags': flags})
+        records = [
+            {'reference_number': 'context_%d' % i,
+             'year': None if i == 1 else 2000 + i}
+            for i in range(4)]
+        bad_records = []
+        with mock.patch.object(
+                lc, 'call_action', wraps=lc.call_action) as call_action:
+            assert _load_org_records(
+                lc, get_chromo('sample'), self.org['name'], records,
+                flags, False, False, lambda m: None,
+                lambda e, r: bad_records.append(r['reference_number'])) == 0
+
+        connections = [
+            c[1]['context']['connection']
+            for c in call_action.call_args_list
+            if c[0][0] == 'datastore_upsert']
+        assert len(connections) > 2
+        assert all(c is connections[0] for c in connections)
+
+        assert bad_records == ['context_1']
+        result = self.lc.action.datastore_search(
+            resource_id=resource_id, sort='reference_number')
+        assert [r['reference_number'] for r in result['records']] == [
+            'context_0', 'context_2', 'context_3']
+
+    def test_fast_load_matches_upsert(self):
+        """
+        --fast loads should report the same errors as datastore_upsert
+        for the same bad records, and give the table triggers the same
+        datastore_app_context table.
+        """
+        _get_plugin().update_config(config)
+        flags = ['recombinant_import', 'test_flag']
+        lc = LocalCKAN(context={'datastore_app_context_flags': flags})
+        chromo = get_chromo('sample')
+
+        errors = []
+        layouts = []
+        for fast in (False, True):
+            org = Organization()
+            lc.action.recombinant_create(dataset_type='sample',
+                                         owner_org=org['name'])
+            resource_id = lc.action.recombinant_show(
+                dataset_type='sample',
+                owner_org=org['name'])['resources'][0]['id']
+            _log_app_context(resource_id)
+
+            bad_records = []
+            for records in (
+                    [{'reference_number': 'good_%d' % i, 'year': 2000 + i}
+                     for i in range(2)],
+                    [{'reference_number': 'mixed_0', 'year': 2000},
+                     {'reference_number': 'mixed_1', 'year': None},
+                     {'reference_number': '', 'year': 2002},
+                     {'reference_number': 'mixed_3', 'year': 2003}]):
+                assert _load_org_records(
+                    lc, chromo, org['name'], records, flags, fast, False,
+                    lambda m: None,
+                    lambda e, r: bad_records.append((e, r))) == 0
+            errors.append(bad_records)
+            layouts.append(_app_context_layouts(resource_id))
+
+        assert errors[0] == errors[1]
+        assert [r['reference_number'] for _e, r in errors[0]] == [
+            'mixed_1', '']
+        assert layouts[0] == layouts[1] == {
+            'recombinant_import boolean,test_flag boolean'}
+
+
+def _require_app_context(resource_id):
+    """
+    Add a trigger to the resource table that fails unless the
+    recombinant_import flag is set in datastore_app_context
+    """
+    backend = DatastoreBackend.get_active_backend()
+    with backend._get_write_engine().begin() as connection:
+        connection.execute(sa.text('''
+            CREATE OR REPLACE FUNCTION test_require_app_context()
+            RETURNS trigger AS $$
+            BEGIN
+                IF NOT (SELECT recombinant_import FROM datastore_app_context)
+                THEN
+                    RAISE EXCEPTION 'recombinant_import flag not set';
+                END IF;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            '''))
+        connection.execute(sa.text(
+            'CREATE TRIGGER test_app_context BEFORE INSERT OR UPDATE '
+            'ON {table} FOR EACH ROW '
+            'EXECUTE PROCEDURE test_require_app_context()'.format(
+                table=identifier(resource_id))))
+
+
+def _log_app_context(resource_id):
+    """
+    Add a trigger to the resource table that logs the columns of the
+    datastore_app_context table seen by each inserted or updated row
+    """
+    backend = DatastoreBackend.get_active_backend()
+    with backend._get_write_engine().begin() as connection:
+        connection.execute(sa.text('''
+            CREATE TABLE IF NOT EXISTS test_app_context_log (
+                table_name text, layout text)
+            '''))
+        connection.execute(sa.text('''
+            CREATE OR REPLACE FUNCTION test_log_app_context()
+            RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO test_app_context_log
+                SELECT TG_TABLE_NAME, string_agg(
+                    a.attname || ' ' || format_type(a.atttypid, NULL), ','
+                    ORDER BY a.attnum)
+                FROM pg_attribute a
+                WHERE a.attrelid = to_regclass('pg_temp.datastore_app_context')
+                    AND a.attnum > 0 AND NOT a.attisdropped;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            '''))
+        connection.execute(sa.text(
+            'CREATE TRIGGER test_app_context BEFORE INSERT OR UPDATE '
+            'ON {table} FOR EACH ROW '
+            'EXECUTE PROCEDURE test_log_app_context()'.format(
+                table=identifier(resource_id))))
+
+
+def _app_context_layouts(resource_id):
+    backend = DatastoreBackend.get_active_backend()
+    with backend._get_read_engine().connect() as connection:
+        return set(layout for (layout,) in connection.execute(sa.text(
+            'SELECT layout FROM test_app_context_log '
+            'WHERE table_name = :table'), {'table': resource_id}))
@@ -2,6 +2,7 @@ import pytest
 import flask
 import mock
 from io import BytesIO
+from openpyxl import load_workbook
 from ckanapi import LocalCKAN
 
 from ckan.tests.factories import Organization, Sysadmin
@@ -15,7 +16,13 @@ from ckanext.recombinant.write_excel import (
     excel_template,
     append_data
 )
-from ckanext.recombinant.views import _process_upload_file
+from ckanext.recombinant.read_excel import read_excel
+from ckanext.recombinant.errors import BadExcelData
+from ckanext.recombinant.upload_jobs import (
+    start_upload_job,
+    upload_job_status
+)
+from ckanext.recombinant.views import _process_upload_file, _fetch_records
 
 
 @pytest.mark.usefixtures('with_request_context')
@@ -92,3 +99,289 @@ class TestRecombinantExcel(RecombinantTestBase):
 
         assert result['total'] == 4
         assert result['records'] == expected_records
+
+    def test_excel_template_write_only(self):
+        """
+        Templates streamed into a write-only workbook should contain the
+        same sheets and cell values as the in-memory openpyxl workbook.
+        """
+        _get_plugin().update_config(config)
+        org = self.lc.action.organization_show(
+            id=self.org['id'],
+            include_datasets=False)
+
+        books = []
+        for write_only in (False, True):
+            blob = BytesIO()
+            excel_template('sample', org, write_only=write_only).save(blob)
+            blob.seek(0)
+            books.append(load_workbook(blob))
+        book, streamed = books
+
+        assert book.sheetnames == streamed.sheetnames
+        for name in book.sheetnames:
+            assert book[name].sheet_state == streamed[name].sheet_state
+            assert [[c.value for c in row] for row in book[name].iter_rows()] == \
+                [[c.value for c in row] for row in streamed[name].iter_rows()]
+            assert [
+                (c.coordinate, c.style)
+                for row in book[name].iter_rows() for c in row] == [
+                (c.coordinate, c.style)
+                for row in streamed[name].iter_rows() for c in row]
+
+    def test_excel_template_compact(self):
+        """
+        Compact templates should have the same headings and reference
+        sheet as full templates without the e/r calculation sheets, with
+        one error and required rule per data entry column and data entry
+        styles applied to appended data.
+        """
+        _get_plugin().update_config(config)
+        org = self.lc.action.organization_show(
+            id=self.org['id'],
+            include_datasets=False)
+        chromo = get_chromo('sample')
+        record = {f['datastore_id']: None for f in chromo['fields']}
+
+        books = []
+        for compact in (False, True):
+            blob = BytesIO()
+            excel_template('sample', org, compact=compact).save(blob)
+            blob.seek(0)
+            books.append(load_workbook(blob))
+        book, compact_book = books
+
+        assert book.sheetnames == ['sample', 'reference', 'e1', 'r1']
+        assert compact_book.sheetnames == ['sample', 'reference']
+        assert [
+            [c.value for c in row] for row in book['reference'].iter_rows()
+        ] == [
+            [c.value for c in row]
+            for row in compact_book['reference'].iter_rows()]
+        for row in (1, 2, 3, 5):
+            assert [c.value for c in book['sample'][row]] == \
+                [c.value for c in compact_book['sample'][row]]
+
+        sheet = book['sample']
+        compact_sheet = compact_book['sample']
+        # no per-row formulas, checks cover every row of the columns
+        assert compact_sheet.max_row == 6
+        rules = {
+            str(cf.sqref): [r.formula for r in cf.rules]
+            for cf in compact_sheet.conditional_formatting}
+        assert rules['C6:C1048576'][0] == [
+            "NOT('sample'!C6=\"\")*(SUMPRODUCT("
+            "--(TRIM('sample'!C$6:C6)=TRIM('sample'!C6)))>1)"]
+        assert rules['C6:C1048576'][1] == [
+            "(SUMPRODUCT(LEN('sample'!$C6:$D6))>0)*('sample'!C6=\"\")"]
+        assert len(rules['D6:D1048576']) == 2
+
+        # cells below the data entry rows get the column protection
+        below = 6 + chromo['excel_data_num_rows']
+        for col_num, col in ((3, 'C'), (4, 'D')):
+            assert not compact_sheet.cell(row=below, column=col_num).has_style
+            assert compact_sheet.column_dimensions[col].protection.locked \
+                is False
+            assert sheet.cell(row=6, column=col_num).protection.locked \
+                is False
+
+        append_data(compact_book, [record], chromo)
+        for col_num in range(3, 3 + len(chromo['fields'])):
+            assert compact_sheet.cell(row=6, column=col_num).style == \
+                sheet.cell(row=6, column=col_num).style
+
+    def test_fetch_records(self):
+        """
+        Records should be matched to whole keys across batches.
+        """
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=self.org['name'])
+        _lc, _geno, dataset = _action_get_dataset({'ignore_auth': True,
+                                                   'user': self.sysadmin['name']},
+                                                  {'dataset_type': 'sample',
+                                                   'owner_org': self.org['name']})
+        resource_id = dataset['resources'][0]['id']
+        self.lc.action.datastore_upsert(
+            resource_id=resource_id,
+            force=True,
+            method='insert',
+            records=[
+                {'reference_number': 'fetch_%d' % i, 'year': 2000 + i}
+                for i in range(5)])
+
+        datastore_search = self.lc.action.datastore_search
+        with mock.patch(
+                'ckanext.recombinant.views.FETCH_RECORDS_BATCH_SIZE', 2), \
+                mock.patch.object(self.lc.action, 'datastore_search',
+                                  wraps=datastore_search) as search:
+            matched = _fetch_records(
+                self.lc, resource_id, ['reference_number', 'year'],
+                [('fetch_3', '2003'), ('fetch_1', 2001), ('fetch_0', '2004'),
+                 ('missing', '2002'), ('fetch_4', '2004')])
+
+        # only the records matching whole keys are read, not combinations
+        # like fetch_0 with 2004
+        assert sorted(
+            _id for call in search.call_args_list
+            for _id in call.kwargs['filters']['_id']) == [2, 4, 5]
+
+        assert sorted(matched) == [
+            ('fetch_1', '2001'), ('fetch_3', '2003'), ('fetch_4', '2004')]
+        assert matched[('fetch_3', '2003')] == [
+            {'_id': 4, 'reference_number': 'fetch_3', 'year': 2003}]
+
+    def test_upload_chunks(self):
+        """
+        Uploads larger than one chunk should load every record.
+        """
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=self.org['name'])
+        _lc, _geno, dataset = _action_get_dataset({'ignore_auth': True,
+                                                   'user': self.sysadmin['name']},
+                                                  {'dataset_type': 'sample',
+                                                   'owner_org': self.org['name']})
+        org = self.lc.action.organization_show(
+            id=self.org['id'],
+            include_datasets=False)
+        records = [
+            {'reference_number': 'chunk_%d' % i, 'year': 2020 + i}
+            for i in range(5)]
+
+        book = excel_template(dataset['type'], org)
+        append_data(book, records, get_chromo(dataset['resources'][0]['name']))
+        blob = BytesIO()
+        book.save(blob)
+
+        current_user = model.User.get(self.sysadmin['name'])
+        with mock.patch('ckan.lib.helpers.current_user', current_user), \
+                mock.patch('ckanext.recombinant.views.UPLOAD_CHUNK_SIZE', 2):
+            flask.g.user = self.sysadmin['name']
+            _process_upload_file(self.lc, dataset, blob, {}, dry_run=False)
+
+        result = self.lc.action.datastore_search(
+            resource_id=dataset['resources'][0]['id'], sort='_id')
+        assert [
+            (r['reference_number'], r['year']) for r in result['records']
+        ] == [(r['reference_number'], r['year']) for r in records]
+
+    def test_upload_prevalidation(self):
+        """
+        Errors in all rows should be reported together without loading
+        any records.
+        """
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=self.org['name'])
+        _lc, _geno, dataset = _action_get_dataset({'ignore_auth': True,
+                                                   'user': self.sysadmin['name']},
+                                                  {'dataset_type': 'sample',
+                                                   'owner_org': self.org['name']})
+        org = self.lc.action.organization_show(
+            id=self.org['id'],
+            include_datasets=False)
+        records = [
+            {'reference_number': 'first', 'year': 2020},
+            {'reference_number': 'first', 'year': 2021},
+            {'reference_number': 'second', 'year': None},
+        ]
+
+        book = excel_template(dataset['type'], org)
+        append_data(book, records, get_chromo(dataset['resources'][0]['name']))
+        blob = BytesIO()
+        book.save(blob)
+
+        current_user = model.User.get(self.sysadmin['name'])
+        with mock.patch('ckan.lib.helpers.current_user', current_user), \
+                mock.patch('ckanext.recombinant.views.UPLOAD_CHUNK_SIZE', 1), \
+                mock.patch.object(self.lc, 'call_action',
+                                  wraps=self.lc.call_action) as call_action:
+            flask.g.user = self.sysadmin['name']
+            with pytest.raises(BadExcelData) as e:
+                _process_upload_file(
+                    self.lc, dataset, blob, {}, dry_run=False)
+
+        # the first row is valid but nothing is sent to the datastore
+        assert 'datastore_upsert' not in [
+            c.args[0] for c in call_action.call_args_list]
+        assert 'Row 6' not in e.value.message
+        assert 'Row 7' in e.value.message
+        assert 'Duplicate primary key' in e.value.message
+        assert 'Row 8' in e.value.message
+        assert 'This field must not be empty' in e.value.message
+        result = self.lc.action.datastore_search(
+            resource_id=dataset['resources'][0]['id'])
+        assert result['total'] == 0
+
+    def test_upload_job(self):
+        """
+        Background uploads should load every record and report progress.
+        """
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=self.org['name'])
+        _lc, _geno, dataset = _action_get_dataset({'ignore_auth': True,
+                                                   'user': self.sysadmin['name']},
+                                                  {'dataset_type': 'sample',
+                                                   'owner_org': self.org['name']})
+        org = self.lc.action.organization_show(
+            id=self.org['id'],
+            include_datasets=False)
+        records = [
+            {'reference_number': 'job_%d' % i, 'year': 2020 + i}
+            for i in range(3)]
+
+        book = excel_template(dataset['type'], org)
+        append_data(book, records, get_chromo(dataset['resources'][0]['name']))
+        blob = BytesIO()
+        book.save(blob)
+
+        # run the job immediately instead of on the job queue
+        with mock.patch('ckanext.recombinant.upload_jobs.enqueue_job',
+                        lambda fn, args, **kwargs: fn(*args)):
+            job_id = start_upload_job(
+                dataset, blob, self.sysadmin['name'], dry_run=False)
+
+        status = upload_job_status(job_id)
+        assert status['status'] == 'complete'
+        assert status['errors'] == []
+        assert status['rows_parsed'] == status['rows_written'] == 3
+        result = self.lc.action.datastore_search(
+            resource_id=dataset['resources'][0]['id'], sort='_id')
+        assert [
+            r['reference_number'] for r in result['records']
+        ] == [r['reference_number'] for r in records]
+
+    def test_read_excel_readers(self):
+        """
+        The direct XML reader should produce the same sheets, columns and
+        rows as the openpyxl reader.
+        """
+        _get_plugin().update_config(config)
+        org = self.lc.action.organization_show(
+            id=self.org['id'],
+            include_datasets=False)
+        chromo = get_chromo('sample')
+        records = [
+            dict({f['datastore_id']: None for f in chromo['fields']},
+                 reference_number='read_%d' % i, year=2020 + i)
+            for i in range(3)]
+
+        for compact in (False, True):
+            book = excel_template('sample', org, compact=compact)
+            append_data(book, records, chromo)
+            blob = BytesIO()
+            book.save(blob)
+
+            results = []
+            for reader in ('openpyxl', 'xlsx'):
+                blob.seek(0)
+                results.append([
+                    (sheet, org_name, column_names, list(rows))
+                    for sheet, org_name, column_names, rows in read_excel(
+                        blob, ['sample'], reader=reader)])
+            assert results[0] == results[1]
+            assert [
+                row[:2] for _n, row in results[1][0][3]
+            ] == [[r['reference_number'], r['year']] for r in records]
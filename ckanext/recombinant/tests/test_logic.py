@@ -1,12 +1,23 @@
 import pytest
+import mock
+import sqlalchemy as sa
 
-from ckan.tests.factories import Organization, Sysadmin
+from ckan.tests.factories import Organization, Sysadmin, User
 from ckanext.recombinant.tests import RecombinantTestBase
 
-from ckanapi import LocalCKAN
+from ckanapi import LocalCKAN, NotAuthorized, ValidationError
 from ckan.plugins.toolkit import config, ObjectNotFound
-from ckanext.recombinant.tables import _get_plugin
-from ckanext.recombinant.logic import _action_get_dataset
+from ckanext.datastore.backend import DatastoreBackend
+from ckanext.datastore.backend.postgres import identifier
+from ckanext.recombinant.tables import _get_plugin, get_chromo
+from ckanext.recombinant import row_counts
+from ckanext.recombinant.row_counts import create_row_count_table
+from ckanext.recombinant.logic import (
+    _action_get_dataset,
+    _update_triggers,
+    _trigger_function_hashes,
+    find_dataset_ids
+)
 
 
 class TestRecombinantLogic(RecombinantTestBase):
@@ -37,3 +48,259 @@ class TestRecombinantLogic(RecombinantTestBase):
         with pytest.raises(ObjectNotFound):
             self.lc.action.recombinant_show(dataset_type='sample',
                                             owner_org=org['name'])
+
+    def test_show_many(self):
+        """
+        recombinant_show_many should match recombinant_show for each
+        dataset, and only be available to sysadmins.
+        """
+        orgs = [Organization(), Organization()]
+        _get_plugin().update_config(config)
+        for org in orgs:
+            self.lc.action.recombinant_create(dataset_type='sample',
+                                              owner_org=org['name'])
+        org_names = [org['name'] for org in orgs]
+        many = self.lc.action.recombinant_show_many(
+            dataset_types=['sample'], owner_orgs=org_names)
+        assert sorted(p['owner_org'] for p in many) == sorted(org_names)
+        for p in many:
+            assert p == self.lc.action.recombinant_show(
+                dataset_type='sample', owner_org=p['owner_org'])
+
+        with pytest.raises(NotAuthorized):
+            LocalCKAN(username=User()['name']).action.recombinant_show_many(
+                dataset_types=['sample'])
+
+    @pytest.mark.ckan_config('recombinant.row_count', 'cached')
+    def test_show_row_count(self):
+        """
+        Row count strategies should report the rows in the table, with
+        cached counts cleared by upserts and deletes.
+        """
+        _drop_row_count_table()
+        org = Organization()
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=org['name'])
+
+        def rows(row_count):
+            dataset = self.lc.action.recombinant_show(
+                dataset_type='sample', owner_org=org['name'],
+                row_count=row_count)
+            return dataset['resources'][0].get('datastore_rows')
+
+        # exact counts until the row count table is created
+        assert rows('cached') == 0
+        create_row_count_table()
+        assert rows('cached') == 0
+        resource_id = self.lc.action.recombinant_show(
+            dataset_type='sample',
+            owner_org=org['name'])['resources'][0]['id']
+        self.lc.action.datastore_upsert(
+            resource_id=resource_id,
+            force=True,
+            method='insert',
+            records=[{'reference_number': 'count_1', 'year': 2026}])
+        assert rows('exact') == 1
+        assert rows('cached') == 1
+        assert rows('none') is None
+        assert rows('estimate') in (0, 1)
+
+        self.lc.action.datastore_records_delete(
+            resource_id=resource_id,
+            force=True,
+            filters={'reference_number': 'count_1'})
+        assert rows('cached') == 0
+
+        with pytest.raises(ValidationError):
+            rows('guess')
+
+    @pytest.mark.ckan_config('recombinant.row_count', 'cached')
+    def test_row_count_table_created_later(self):
+        """
+        A process that found no row count table should use and clear
+        counts once another process creates it.
+        """
+        _drop_row_count_table()
+        org = Organization()
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=org['name'])
+        dataset = self.lc.action.recombinant_show(
+            dataset_type='sample', owner_org=org['name'])
+        resource_id = dataset['resources'][0]['id']
+        assert dataset['resources'][0]['datastore_rows'] == 0
+        assert not row_counts.row_count_table_exists()
+
+        # created by recombinant update in another process
+        backend = DatastoreBackend.get_active_backend()
+        with backend._get_write_engine().begin() as connection:
+            connection.execute(sa.text(
+                'CREATE TABLE {0} (table_name text PRIMARY KEY, '
+                'row_count bigint)'.format(
+                    identifier(row_counts.ROW_COUNT_TABLE))))
+
+        assert self.lc.action.recombinant_show(
+            dataset_type='sample',
+            owner_org=org['name'])['resources'][0]['datastore_rows'] == 0
+        self.lc.action.datastore_upsert(
+            resource_id=resource_id,
+            force=True,
+            method='insert',
+            records=[{'reference_number': 'later_1', 'year': 2026}])
+        assert self.lc.action.recombinant_show(
+            dataset_type='sample',
+            owner_org=org['name'])['resources'][0]['datastore_rows'] == 1
+
+    def test_find_dataset_ids(self):
+        """
+        Datasets should be found by organization name or id without
+        the search index, and not after they are deleted.
+        """
+        org = Organization()
+        _get_plugin().update_config(config)
+        assert find_dataset_ids('sample', org['name']) == []
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=org['name'])
+        dataset_ids = find_dataset_ids('sample', org['name'])
+        assert len(dataset_ids) == 1
+        assert find_dataset_ids('sample', org['id']) == dataset_ids
+        assert find_dataset_ids(
+            'sample', org['name'], dataset_ids[0]) == dataset_ids
+
+        self.lc.action.package_delete(id=dataset_ids[0])
+        assert find_dataset_ids('sample', org['name']) == []
+
+    def test_update_plan(self):
+        """
+        Tables matching their definition should have nothing planned,
+        and plan=True should not change anything.
+        """
+        org = Organization()
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=org['name'])
+        assert self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'],
+            force_update=True, plan=True) == []
+        assert self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'],
+            force_update=True) == []
+
+        resource_id = self.lc.action.recombinant_show(
+            dataset_type='sample',
+            owner_org=org['name'])['resources'][0]['id']
+        self.lc.action.datastore_delete(resource_id=resource_id, force=True)
+        plans = self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'], plan=True)
+        assert [p['changes'] for p in plans] == [{'create_table': True}]
+        with pytest.raises(ObjectNotFound):
+            self.lc.action.datastore_search(resource_id=resource_id)
+
+        self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'])
+        assert self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'],
+            force_update=True, plan=True) == []
+
+    def test_update_alter_types(self):
+        """
+        Field types should only be changed with alter_types, and tables
+        with values that can't be converted should be left unchanged.
+        """
+        org = Organization()
+        _get_plugin().update_config(config)
+        self.lc.action.recombinant_create(dataset_type='sample',
+                                          owner_org=org['name'])
+        resource_id = self.lc.action.recombinant_show(
+            dataset_type='sample',
+            owner_org=org['name'])['resources'][0]['id']
+        backend = DatastoreBackend.get_active_backend()
+        with backend._get_write_engine().begin() as connection:
+            connection.execute(sa.text(
+                'ALTER TABLE {0} ALTER COLUMN year TYPE text'.format(
+                    identifier(resource_id))))
+        self.lc.action.datastore_upsert(
+            resource_id=resource_id,
+            records=[{'reference_number': '1', 'year': '2020'}])
+
+        plans = self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'],
+            force_update=True, plan=True)
+        assert list(plans[0]['changes']) == ['change_types']
+        assert plans[0]['changes']['change_types']['year'][0] == 'text'
+
+        self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'], force_update=True)
+        assert self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'],
+            plan=True, alter_types=True) == plans
+
+        self.lc.action.datastore_upsert(
+            resource_id=resource_id,
+            records=[{'reference_number': '2', 'year': 'never'}])
+        plans = self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'], alter_types=True)
+        assert 'error' in plans[0]
+        assert self.lc.action.datastore_search(
+            resource_id=resource_id)['total'] == 2
+
+        self.lc.action.datastore_records_delete(
+            resource_id=resource_id, filters={'reference_number': '2'},
+            force=True)
+        plans = self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'], alter_types=True)
+        assert 'error' not in plans[0]
+        assert self.lc.action.recombinant_update(
+            dataset_type='sample', owner_org=org['name'],
+            force_update=True, plan=True) == []
+        assert self.lc.action.datastore_search(
+            resource_id=resource_id)['records'][0]['year'] == 2020
+
+    def test_update_triggers_unchanged(self):
+        """
+        Trigger functions should only be replaced when their definitions
+        change, or when forced.
+        """
+        _get_plugin().update_config(config)
+        chromo = get_chromo('sample')
+        _update_triggers(self.lc, chromo, force=True)
+        assert list(_trigger_function_hashes(['test_trigger_1'])) == [
+            'test_trigger_1']
+
+        lc = LocalCKAN()
+        with mock.patch.object(
+                lc.action, 'datastore_function_create') as function_create:
+            assert _update_triggers(lc, chromo) == ['test_trigger_1']
+            assert not function_create.called
+            _update_triggers(lc, chromo, force=True)
+            assert function_create.call_count == 1
+
+    def test_update_triggers_once_per_run(self):
+        """
+        recombinant_update calls sharing recombinant_trigger_hashes in
+        their context should check each trigger function once.
+        """
+        _get_plugin().update_config(config)
+        orgs = [Organization() for _i in range(3)]
+        for org in orgs:
+            self.lc.action.recombinant_create(dataset_type='sample',
+                                              owner_org=org['name'])
+
+        lc = LocalCKAN(context={'recombinant_trigger_hashes': {}})
+        with mock.patch(
+                'ckanext.recombinant.logic._trigger_function_hashes',
+                wraps=_trigger_function_hashes) as function_hashes:
+            for org in orgs:
+                lc.action.recombinant_update(dataset_type='sample',
+                                             owner_org=org['name'],
+                                             force_update=True)
+        assert function_hashes.call_count == 1
+
+
+def _drop_row_count_table():
+    backend = DatastoreBackend.get_active_backend()
+    with backend._get_write_engine().begin() as connection:
+        connection.execute(sa.text('DROP TABLE IF EXISTS {0}'.format(
+            identifier(row_counts.ROW_COUNT_TABLE))))
+    row_counts._row_count_table_found = False
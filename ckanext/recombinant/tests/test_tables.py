@@ -13,6 +13,7 @@ from ckanext.recombinant.tables import (
     get_published_resource_resource_name,
     get_dataset_type_for_resource_name,
     get_target_datasets,
+    get_field_index,
     _get_plugin
 )
 from ckanext.recombinant.errors import RecombinantException
@@ -135,6 +136,23 @@ class TestRecombinantTables(RecombinantTestBase):
         target_dtypes = get_target_datasets()
         assert target_dtypes == ['sample']
 
+    def test_get_field_index(self):
+        """Should return field metadata compiled once from the chromo."""
+        _get_plugin().update_config(config)
+        chromo = get_chromo('sample')
+        field_index = get_field_index(chromo)
+        assert field_index is get_field_index(chromo)
+        assert field_index.column_ids == ('reference_number', 'year')
+        assert field_index.table_column_ids == ('reference_number', 'year')
+        assert field_index.template_column_ids == ('reference_number', 'year')
+        assert field_index.primary_key == ('reference_number',)
+        assert field_index.non_text_ids == ('year',)
+        assert field_index.computed_ids == ()
+        assert field_index.list_ids == ()
+        assert field_index.fields_by_id['year'] is chromo['fields'][1]
+        with pytest.raises(TypeError):
+            field_index.fields_by_id['year'] = {}
+
     @change_config('recombinant.definitions', 'ckanext.recombinant.tests:samples/sample.yaml ckanext.recombinant.tests:samples/sample_dupe_dtype.yaml')
     def test_load_table_definitions_duplicate_dataset_type(self):
         """Should fail if there is a duplicate dataset_type across table definitions."""
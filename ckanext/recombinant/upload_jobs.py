@@ -0,0 +1,231 @@
+"""
+Background processing of large Excel uploads.
+
+Uploads of at least recombinant.async_upload_min_bytes are spooled to
+recombinant.upload_job_dir and loaded by process_upload_job through
+CKAN's background job queue. Progress is stored in a JSON status file
+next to the spooled upload so that any web worker can report it.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+from logging import getLogger
+
+from typing import Any, Dict, Optional
+
+from flask import current_app, request
+from flask_babel import force_locale
+from flask_login import login_user
+from werkzeug.exceptions import HTTPException
+
+from ckan import model
+from ckan.plugins.toolkit import _, g, h, asbool, asint, config, enqueue_job
+
+from ckanapi import LocalCKAN
+
+from ckanext.recombinant.errors import BadExcelData, RecombinantFieldError
+from ckanext.recombinant.tables import get_geno
+
+# remove spooled uploads and status files older than this (seconds)
+UPLOAD_JOB_TTL = 24 * 60 * 60
+JOB_ID_REGEX = re.compile('^[0-9a-f]{32}$')
+
+log = getLogger(__name__)
+
+
+def async_upload_min_bytes() -> int:
+    """
+    Size of uploads processed in the background, 0 when disabled
+    """
+    return asint(config.get('recombinant.async_upload_min_bytes', 0))
+
+
+def upload_job_dir() -> str:
+    """
+    return the directory for spooled uploads and status files,
+    creating it if required
+    """
+    job_dir = config.get('recombinant.upload_job_dir') or os.path.join(
+        tempfile.gettempdir(), 'recombinant-uploads')
+    os.makedirs(job_dir, exist_ok=True)
+    return job_dir
+
+
+def upload_size(upload_file: Any) -> int:
+    stream = _upload_stream(upload_file)
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def start_upload_job(dataset: Dict[str, Any],
+                     upload_file: Any,
+                     user_name: str,
+                     dry_run: bool,
+                     resource_name: str = '') -> str:
+    """
+    Spool upload_file to disk and enqueue process_upload_job for it,
+    resource_name is used to offer a refresh of outdated tables. Errors
+    are reported in the language of the current request.
+
+    returns the job id used for upload_job_status
+    """
+    job_dir = upload_job_dir()
+    _remove_expired(job_dir)
+    job_id = uuid.uuid4().hex
+    with open(_spool_path(job_id), 'wb') as f:
+        stream = _upload_stream(upload_file)
+        stream.seek(0)
+        shutil.copyfileobj(stream, f)
+
+    _write_status(job_id, {
+        'status': 'queued',
+        'user': user_name,
+        'dataset_id': dataset['id'],
+        'owner_org': dataset['owner_org'],
+        'resource_name': resource_name,
+        'lang': h.lang(),
+        'dry_run': dry_run,
+        'rows_parsed': 0,
+        'rows_written': 0,
+        'errors': [],
+    })
+    enqueue_job(
+        process_upload_job,
+        [job_id],
+        title='recombinant upload {0} {1}'.format(dataset['name'], job_id))
+    return job_id
+
+
+def upload_job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    return the status stored for job_id or None if not found
+    """
+    if not JOB_ID_REGEX.match(job_id):
+        return None
+    try:
+        with open(_status_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def process_upload_job(job_id: str):
+    """
+    Background job: load the spooled upload for job_id with
+    _process_upload_file as the user that uploaded it and in their
+    language, recording progress and errors in the job status
+    """
+    # avoid circular import, views enqueues this job
+    from ckanext.recombinant.views import _process_upload_file
+
+    status = upload_job_status(job_id)
+    if status is None:
+        log.warning('recombinant upload job %s not found', job_id)
+        return
+    status['status'] = 'running'
+    _write_status(job_id, status)
+
+    def progress(rows_parsed: int, rows_written: int):
+        status['rows_parsed'] = rows_parsed
+        status['rows_written'] = rows_written
+        _write_status(job_id, status)
+
+    user = model.User.get(status['user'])
+    lang = status.get('lang') or config.get('ckan.locale_default', 'en')
+    # errors are translated here the same way upload does for the
+    # uploader's request
+    with current_app.test_request_context(), force_locale(lang):
+        request.environ['CKAN_LANG'] = lang
+        try:
+            login_user(user)
+            g.user = user.name
+            lc = LocalCKAN(username=user.name)
+            dataset = lc.action.package_show(id=status['dataset_id'])
+            with open(_spool_path(job_id), 'rb') as f:
+                _process_upload_file(
+                    lc,
+                    dataset,
+                    f,
+                    get_geno(dataset['type']),
+                    status['dry_run'],
+                    progress=progress)
+            status['status'] = 'complete'
+        except BadExcelData as e:
+            status['status'] = 'error'
+            status['errors'] = [_(e.message)]
+        except RecombinantFieldError as e:
+            status['status'] = 'error'
+            status['errors'] = [str(e).replace("'", '')]
+            status['outdated'] = True
+        except HTTPException as e:
+            # e.g. abort(403) when not authorized to update a resource
+            status['status'] = 'error'
+            status['errors'] = [e.description or str(e)]
+        except Exception as e:
+            log.info('Unexpected error while uploading Recombinant file:')
+            log.info(e)
+            if asbool(config.get('debug', False)):
+                # on debug we want the real error
+                status['errors'] = [traceback.format_exc()]
+            else:
+                status['errors'] = [
+                    _("The server encountered a problem processing the "
+                      "file uploaded. Please try copying your data into the "
+                      "latest version of the template and uploading again. "
+                      "If this problem continues, send your Excel file to "
+                      "{support} so we may investigate.").format(
+                          support=h.support_email_address())]
+            status['status'] = 'error'
+        finally:
+            _write_status(job_id, status)
+            try:
+                os.unlink(_spool_path(job_id))
+            except FileNotFoundError:
+                pass
+
+
+def _upload_stream(upload_file: Any) -> Any:
+    """
+    file object for a werkzeug FileStorage, cgi FieldStorage or file
+    """
+    return getattr(upload_file, 'stream', None) or getattr(
+        upload_file, 'file', upload_file)
+
+
+def _spool_path(job_id: str) -> str:
+    return os.path.join(upload_job_dir(), job_id + '.xlsx')
+
+
+def _status_path(job_id: str) -> str:
+    return os.path.join(upload_job_dir(), job_id + '.json')
+
+
+def _write_status(job_id: str, status: Dict[str, Any]):
+    """
+    replace the status file for job_id atomically
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=upload_job_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, _status_path(job_id))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _remove_expired(job_dir: str):
+    expired = time.time() - UPLOAD_JOB_TTL
+    for entry in os.scandir(job_dir):
+        try:
+            if entry.stat().st_mtime < expired:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            continue  # removed by another process
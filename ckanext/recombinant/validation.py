@@ -0,0 +1,143 @@
+"""
+In-process checks of records against a resource definition (chromo).
+
+These catch the common problems the datastore triggers would reject
+(missing required values, unknown choice codes, values over max_chars,
+values that can't be stored in the column type and primary keys repeated
+within the same file) so that all of them can be reported at once,
+without sending any records to the database.
+"""
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from ckan.plugins.toolkit import _
+
+from ckanext.recombinant.tables import get_field_index
+from ckanext.recombinant.helpers import _read_choices_file
+
+
+INTEGER_TYPES = ('int', 'bigint', 'year', 'month')
+NUMERIC_TYPES = ('numeric', 'money')
+INTEGER_REGEX = re.compile(r'\s*[+-]?\d+\s*$')
+ISO_DATE_REGEX = re.compile(r'\s*(\d{4})-(\d{1,2})-(\d{1,2})\s*$')
+
+RecordErrors = Dict[str, List[str]]
+
+
+def record_validator(
+        chromo: Dict[str, Any]) -> Callable[[Dict[str, Any]], RecordErrors]:
+    """
+    Return a function that checks one record against chromo, returning
+    {datastore_id: [error, ...]} for fields with problems or {} for
+    a good record.
+
+    Only fields present in the record are checked. Primary keys of
+    records checked are kept to report duplicates, so use one validator
+    for each file (and organization) being loaded.
+    """
+    field_index = get_field_index(chromo)
+    checks = [
+        (f['datastore_id'], _field_checker(chromo, f, f['datastore_id'] in
+                                           field_index.primary_key_set))
+        for f in field_index.fields_by_id.values()
+        if not f.get('published_resource_computed_field')]
+    pk = field_index.primary_key
+    seen_keys: Set[Tuple[Any, ...]] = set()
+
+    def validate(record: Dict[str, Any]) -> RecordErrors:
+        errors: RecordErrors = {}
+        for datastore_id, check in checks:
+            if datastore_id not in record:
+                continue
+            field_errors = check(record[datastore_id])
+            if field_errors:
+                errors[datastore_id] = field_errors
+
+        if pk and not any(k in errors for k in pk):
+            key = tuple(record.get(k) for k in pk)
+            if key in seen_keys:
+                errors.setdefault(pk[0], []).append(
+                    _('Duplicate primary key in this file: {0}').format(
+                        ', '.join(str(v) for v in key)))
+            else:
+                seen_keys.add(key)
+        return errors
+
+    return validate
+
+
+def _field_checker(chromo: Dict[str, Any],
+                   field: Dict[str, Any],
+                   primary_key: bool) -> Callable[[Any], List[str]]:
+    """
+    Return a function that checks one value of field, with the
+    choices and the type checks for the column looked up once
+    """
+    dstore_tag = field['datastore_type']
+    required = primary_key or field.get('excel_required', False)
+    max_chars: Optional[int] = field.get('max_chars')
+    choices: Optional[Set[str]] = None
+    if 'choices' in field:
+        choices = set(field['choices'])
+    elif 'choices_file' in field and '_path' in chromo:
+        choices = set(_read_choices_file(chromo, field))
+
+    def check(value: Any) -> List[str]:
+        if dstore_tag == '_text' and isinstance(value, str):
+            # csv files store lists as comma-separated values
+            value = value.split(',') if value else []
+        if value is None or value == '' or value == []:
+            if required:
+                return [_('This field must not be empty')]
+            return []
+
+        errors = []
+        if dstore_tag in INTEGER_TYPES:
+            if not INTEGER_REGEX.match(str(value)):
+                errors.append(_(
+                    'Invalid input syntax for type integer: {}'
+                ).format(value))
+        elif dstore_tag in NUMERIC_TYPES:
+            if not _is_number(value):
+                errors.append(_('Invalid number: {0}').format(value))
+        elif dstore_tag == 'date':
+            if not _is_valid_iso_date(value):
+                errors.append(_('Invalid date: {0}').format(value))
+
+        if max_chars and isinstance(value, str) and len(value) > max_chars:
+            errors.append(_(
+                'This field is limited to {0} characters').format(max_chars))
+
+        if choices is not None:
+            for v in value if isinstance(value, list) else [value]:
+                if v not in choices:
+                    errors.append(_('Invalid choice: "{0}"').format(v))
+        return errors
+
+    return check
+
+
+def _is_number(value: Any) -> bool:
+    try:
+        Decimal(str(value).strip())
+    except InvalidOperation:
+        return False
+    return True
+
+
+def _is_valid_iso_date(value: Any) -> bool:
+    """
+    False for YYYY-MM-DD values that are not real dates. Other date
+    formats are left for the database to check.
+    """
+    match = ISO_DATE_REGEX.match(str(value))
+    if not match:
+        return True
+    try:
+        date(*(int(part) for part in match.groups()))
+    except ValueError:
+        return False
+    return True
@@ -1,10 +1,13 @@
 from flask import Blueprint, Response as FlaskResponse
 from flask_babel import force_locale
 import re
+from itertools import islice
 from uuid import UUID
 import simplejson as json
+import sqlalchemy as sa
 
-from typing import Union, Dict, Tuple, Any, List, Optional
+from typing import (
+    Union, Dict, Tuple, Any, List, Optional, Callable, Iterator)
 from ckan.types import Response
 
 from werkzeug.datastructures import FileStorage as FlaskFileStorage
@@ -22,6 +25,7 @@ from ckan.plugins.toolkit import (
     config,
     request,
     get_action,
+    check_access,
     render
 )
 
@@ -39,13 +43,24 @@ from ckanext.recombinant.errors import (
     BadExcelData,
     format_trigger_error
 )
-from ckanext.recombinant.read_excel import read_excel, get_records
+from ckanext.recombinant.read_excel import read_excel, iter_records
+from ckanext.recombinant.validation import record_validator
+from ckanext.recombinant.upload_jobs import (
+    async_upload_min_bytes,
+    upload_size,
+    start_upload_job,
+    upload_job_status
+)
 from ckanext.recombinant.write_excel import (
     excel_template,
     excel_data_dictionary,
     append_data
 )
-from ckanext.recombinant.tables import get_chromo, get_geno
+from ckanext.recombinant.template_cache import (
+    excel_template_bytes,
+    workbook_bytes
+)
+from ckanext.recombinant.tables import get_chromo, get_geno, get_field_index
 from ckanext.recombinant.helpers import (
     recombinant_primary_key_fields, recombinant_choice_fields)
 
@@ -54,6 +69,7 @@ from io import BytesIO
 from ckanext.datastore.backend import DatastoreBackend
 from ckanext.datastore.backend.postgres import (
     DatastorePostgresqlBackend,
+    identifier,
     _parse_constraint_error_from_psql_error
 )
 
@@ -61,6 +77,12 @@ from ckanapi import NotFound, LocalCKAN
 
 
 KEY_ERROR_MATCH = re.compile('"([^"]*)"')
+# keys per datastore_search when fetching records for templates
+FETCH_RECORDS_BATCH_SIZE = 500
+# records per datastore_upsert when loading uploaded files
+UPLOAD_CHUNK_SIZE = 1000
+# rows with errors listed when pre-validation of an upload fails
+UPLOAD_MAX_REPORTED_ERRORS = 100
 
 log = getLogger(__name__)
 recombinant = Blueprint('recombinant', __name__)
@@ -114,6 +136,18 @@ def upload(id: str) -> Union[Response, str]:
         if not request.files['xls_update']:
             raise BadExcelData('You must provide a valid file')
 
+        min_bytes = async_upload_min_bytes()
+        if min_bytes and upload_size(request.files['xls_update']) >= min_bytes:
+            job_id = start_upload_job(
+                dataset, request.files['xls_update'], g.user, dry_run,
+                resource_name=resource_name)
+            h.flash_notice(_(
+                "Your file is being processed. Progress is shown below."))
+            return h.redirect_to('recombinant.preview_table',
+                                 resource_name=resource_name,
+                                 owner_org=org['name'],
+                                 upload_job=job_id)
+
         _process_upload_file(
             lc,
             dataset,
@@ -149,6 +183,42 @@ def upload(id: str) -> Union[Response, str]:
                              owner_org=org['name'])
 
 
+@recombinant.route('/recombinant/upload-status/<job_id>', methods=['GET'])
+@nocache_store
+def upload_status(job_id: str) -> Union[Response, str]:
+    """
+    Progress of a background upload started by upload as JSON:
+    status (queued, running, complete or error), dry_run, rows_parsed,
+    rows_written, errors, outdated and outdated_html, the same
+    out of date table message as for uploads processed immediately
+    """
+    status = upload_job_status(job_id)
+    if status is None:
+        return abort(404, _('Upload not found'))
+    if status['user'] != g.user and not is_sysadmin(g.user):
+        return abort(403, _('User {0} not authorized to view this upload')
+                     .format(str(g.user)))
+    outdated_html = None
+    if status.get('outdated'):
+        outdated_html = render(
+            'recombinant/snippets/outdated_error.html',
+            extra_vars={'key_errors': status['errors'][0],
+                        'dataset_id': status['dataset_id'],
+                        'res_name': status.get('resource_name', ''),
+                        'owner_org': status.get('owner_org', '')})
+    response = FlaskResponse(json.dumps({
+        'status': status['status'],
+        'dry_run': status['dry_run'],
+        'rows_parsed': status['rows_parsed'],
+        'rows_written': status['rows_written'],
+        'errors': status['errors'],
+        'outdated': status.get('outdated', False),
+        'outdated_html': outdated_html,
+    }))
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
 @recombinant.route('/recombinant/delete/<id>/<resource_id>', methods=['GET', 'POST'])
 def delete_records(id: str, resource_id: str) -> Union[str, Response]:
     lc = LocalCKAN(username=g.user)
@@ -172,7 +242,7 @@ def delete_records(id: str, resource_id: str) -> Union[str, Response]:
                              owner_org=org['name'])
 
     dataset = lc.action.recombinant_show(
-        dataset_type=pkg['type'], owner_org=org['name'])
+        dataset_type=pkg['type'], owner_org=org['name'], row_count='none')
 
     # type_ignore_reason: [] default is allowed
     def delete_error(err: str, _records: List[str] = []) -> str:  # type: ignore
@@ -196,45 +266,45 @@ def delete_records(id: str, resource_id: str) -> Union[str, Response]:
                 owner_org=org['name'])
 
     pk_fields = recombinant_primary_key_fields(res['name'])
+    pk_ids = [f['datastore_id'] for f in pk_fields]
+
+    lines = form_text.split('\n')
+    keys = []
+    for r in lines:
+        r = r.rstrip('\r')
+        split_on = '\t' if '\t' in r else ','
+        fields = [f for f in r.split(split_on)]
+        keys.append(tuple(fields) if len(fields) == len(pk_fields) else None)
+
+    matched = _fetch_records(
+        lc, resource_id, pk_ids, [k for k in keys if k is not None])
 
     ok_records = []
-    ok_filters = []
-    records = iter(form_text.split('\n'))
-    for r in records:
+    ok_ids = []
+    for num, r in enumerate(lines):
         r = r.rstrip('\r')
 
         def record_fail(err: str) -> str:
             # move bad record to the top of the pile
             filters['bulk-delete'] = '\n'.join(
-                [r] + list(records) + ok_records)
+                [r] + lines[num + 1:] + ok_records)
             return delete_error(err, ok_records)
 
-        split_on = '\t' if '\t' in r else ','
-        fields = [f for f in r.split(split_on)]
-        if len(fields) != len(pk_fields):
+        key = keys[num]
+        if key is None:
             return record_fail(_('Wrong number of fields, expected {num}').format(
                 num=len(pk_fields)))
 
-        filters.clear()
-        for f, pkf in zip(fields, pk_fields):
-            filters[pkf['datastore_id']] = f
-        try:
-            result = lc.action.datastore_search(
-                resource_id=resource_id,
-                filters=filters,
-                limit=2)
-        except ValidationError:
-            return record_fail(_('Invalid fields'))
-        found = result['records']
+        found = matched.get(key)
         if not found:
             return record_fail(_('No matching records found "%s"') %
-                               '", "'.join(fields))
+                               '", "'.join(key))
         if len(found) > 1:
             return record_fail(_('Multiple matching records found'))
 
         if r not in ok_records:
             ok_records.append(r)
-            ok_filters.append(dict(filters))
+            ok_ids.append(found[0]['_id'])
 
     if 'cancel' in request.form:
         return h.redirect_to(
@@ -253,22 +323,23 @@ def delete_records(id: str, resource_id: str) -> Union[str, Response]:
                                       # from being completely empty
                                       + ([''] if '' in ok_records else []))})
     if request.method == 'POST':
-        for f in ok_filters:
-            try:
-                lc.action.datastore_delete(
-                    resource_id=resource_id,
-                    filters=f,
-                    )
-            except ValidationError as e:
-                if 'constraint_info' in e.error_dict:
-                    error_message = _render_recombinant_constraint_errors(
-                        lc, e, get_chromo(res['name']), 'delete')
-                    h.flash_error(error_message)
-                    # type_ignore_reason: incomplete typing
-                    return record_fail(error_message)  # type: ignore
-                raise
+        # one statement for all records, by _id because composite
+        # keys can't be matched with datastore filters
+        try:
+            lc.action.datastore_delete(
+                resource_id=resource_id,
+                filters={'_id': ok_ids},
+                )
+        except ValidationError as e:
+            if 'constraint_info' in e.error_dict:
+                error_message = _render_recombinant_constraint_errors(
+                    lc, e, get_chromo(res['name']), 'delete')
+                h.flash_error(error_message)
+                # type_ignore_reason: incomplete typing
+                return record_fail(error_message)  # type: ignore
+            raise
 
-        h.flash_success(_("{num} deleted.").format(num=len(ok_filters)))
+        h.flash_success(_("{num} deleted.").format(num=len(ok_ids)))
 
     return h.redirect_to(
         'recombinant.preview_table',
@@ -304,7 +375,7 @@ def delete_dataset(id: str, resource_id: str) -> Union[str, Response]:
                              owner_org=org['name'])
 
     dataset = lc.action.recombinant_show(
-        dataset_type=pkg['type'], owner_org=org['name'])
+        dataset_type=pkg['type'], owner_org=org['name'], row_count='none')
 
     for r in dataset.get('resources', []):
         _l = r['shortname']
@@ -400,7 +471,8 @@ def template(dataset_type: str, lang: str, owner_org: str) -> Union[Response, st
     try:
         dataset = lc.action.recombinant_show(
             dataset_type=dataset_type,
-            owner_org=owner_org)
+            owner_org=owner_org,
+            row_count='none')
         org = lc.action.organization_show(
             id=owner_org,
             include_datasets=False)
@@ -408,12 +480,14 @@ def template(dataset_type: str, lang: str, owner_org: str) -> Union[Response, st
         return abort(404, _('Not found'))
 
     try:
-        book = excel_template(dataset_type, org)
+        if request.method == 'POST':
+            book = excel_template(dataset_type, org)
+        else:
+            blob = excel_template_bytes(dataset_type, org)
     except RecombinantException as e:
         return abort(400, _('Unable to download template.\n%s') % e)
 
     if request.method == 'POST':
-        filters = {}
         resource_name = request.form.get('resource_name', '')
         for r in dataset['resources']:
             if r['name'] == resource_name:
@@ -422,22 +496,24 @@ def template(dataset_type: str, lang: str, owner_org: str) -> Union[Response, st
         else:
             return abort(404, _("Resource not found"))
 
-        pk_fields = recombinant_primary_key_fields(resource['name'])
-        primary_keys = request.form.getlist('bulk-template')
+        pk_ids = [
+            f['datastore_id']
+            for f in recombinant_primary_key_fields(resource['name'])]
+        primary_keys = [
+            tuple(keys.split(",")[:len(pk_ids)])
+            for keys in request.form.getlist('bulk-template')]
         chromo = get_chromo(resource['name'])
         record_data = []
 
-        for keys in primary_keys:
-            temp = keys.split(",")
-            for f, pkf in zip(temp, pk_fields):
-                filters[pkf['datastore_id']] = f
-            try:
-                result = lc.action.datastore_search(resource_id=resource['id'],
-                                                    filters=filters)
-            except NotAuthorized:
-                return abort(403, _('Unauthorized to read resource %s') %
-                             resource['id'])
-            record_data += result['records']
+        try:
+            matched = _fetch_records(
+                lc, resource['id'], pk_ids,
+                [k for k in primary_keys if len(k) == len(pk_ids)])
+            for keys in primary_keys:
+                record_data += matched.get(keys, [])
+        except NotAuthorized:
+            return abort(403, _('Unauthorized to read resource %s') %
+                         resource['id'])
 
         try:
             append_data(book, record_data, chromo)
@@ -461,52 +537,38 @@ def template(dataset_type: str, lang: str, owner_org: str) -> Union[Response, st
         if 'foreignkeys' in ds_info['meta']:
             resource_names = dict((r['id'], r['name']) for r in dataset['resources'])
             for fk in ds_info['meta']['foreignkeys']:
-                f_chromo = None
-                ref_record_data = []
                 if resource['id'] == fk['child_table']:
-                    if fk['parent_table'] not in resource_names:
-                        # do not include records from resources not in this dataset
-                        continue
-                    f_chromo = get_chromo(resource_names[fk['parent_table']])
-                    f_completed_filters = []
-                    for selected_record in record_data:
-                        # use the datastore_info column mapping as the
-                        # column names may be different between tables
-                        f_filters = dict(
-                            (fk_pc, selected_record[fk['child_columns'][fk_pi]])
-                            for fk_pi, fk_pc in enumerate(fk['parent_columns']))
-                        if f_filters in f_completed_filters:
-                            # prevent duplicate data retrieval
-                            continue
-                        f_completed_filters.append(f_filters)
-                        result = lc.action.datastore_search(
-                            resource_id=fk['parent_table'], filters=f_filters)
-                        ref_record_data += result['records']
+                    ref_table = fk['parent_table']
+                    # use the datastore_info column mapping as the
+                    # column names may be different between tables
+                    ref_columns = fk['parent_columns']
+                    columns = fk['child_columns']
                 elif resource['id'] == fk['parent_table']:
-                    if fk['child_table'] not in resource_names:
-                        # do not include records from resources not in this dataset
-                        continue
-                    f_chromo = get_chromo(resource_names[fk['child_table']])
-                    f_completed_filters = []
-                    for selected_record in record_data:
-                        # use the datastore_info column mapping as the
-                        # column names may be different between tables
-                        f_filters = dict(
-                            (fk_cc, selected_record[fk['parent_columns'][fk_ci]])
-                            for fk_ci, fk_cc in enumerate(fk['child_columns']))
-                        if f_filters in f_completed_filters:
-                            # prevent duplicate data retrieval
-                            continue
-                        f_completed_filters.append(f_filters)
-                        result = lc.action.datastore_search(
-                            resource_id=fk['child_table'], filters=f_filters)
-                        ref_record_data += result['records']
-                if ref_record_data and f_chromo is not None:
+                    ref_table = fk['child_table']
+                    ref_columns = fk['child_columns']
+                    columns = fk['parent_columns']
+                else:
+                    continue
+                if ref_table not in resource_names:
+                    # do not include records from resources not in this dataset
+                    continue
+                f_chromo = get_chromo(resource_names[ref_table])
+                # prevent duplicate data retrieval
+                ref_keys = list(dict(
+                    (tuple(str(selected_record[c]) for c in columns),
+                     tuple(selected_record[c] for c in columns))
+                    for selected_record in record_data).values())
+                matched = _fetch_records(lc, ref_table, ref_columns, ref_keys)
+                ref_record_data = [
+                    ref_record
+                    for keys in ref_keys
+                    for ref_record in matched.get(tuple(str(k) for k in keys), [])]
+                if ref_record_data:
                     append_data(book, ref_record_data, f_chromo)
 
-    blob = BytesIO()
-    book.save(blob)
-    response = FlaskResponse(blob.getvalue())
+        blob = workbook_bytes(book)
+
+    response = FlaskResponse(blob)
     content_type, disposition_type = _xlsx_response_headers()
     response.headers['Content-Type'] = content_type
     response.headers['Content-Disposition'] = (
@@ -518,6 +580,68 @@ def template(dataset_type: str, lang: str, owner_org: str) -> Union[Response, st
     return response
 
 
+def _fetch_records(lc: LocalCKAN,
+                   resource_id: str,
+                   columns: List[str],
+                   keys: List[Tuple[Any, ...]]) -> Dict[
+                       Tuple[str, ...], List[Dict[str, Any]]]:
+    """
+    Find the records in resource_id with column values matching keys.
+
+    Each FETCH_RECORDS_BATCH_SIZE keys are matched with a single query
+    joining the table to the key values, comparing the text form of the
+    columns. The matching records are then read by _id with
+    datastore_search.
+
+    returns {key: records} for the keys found, with key values as text
+    """
+    check_access('datastore_search', {'user': lc.username},
+                 {'resource_id': resource_id})
+    matched: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    keys = list(dict(
+        (tuple(str(k) for k in key), key) for key in keys))
+    if not keys:
+        return matched
+
+    key_columns = ['k%d' % n for n in range(len(columns))]
+    match_sql = sa.text(
+        'SELECT k.n, t._id FROM {table} t '
+        'JOIN unnest({arrays}) WITH ORDINALITY AS k({key_columns}, n) '
+        'ON {match} ORDER BY t._id'.format(
+            table=identifier(resource_id),
+            arrays=', '.join(
+                'CAST(:{0} AS text[])'.format(k) for k in key_columns),
+            key_columns=', '.join(key_columns),
+            match=' AND '.join(
+                't.{0}::text = k.{1}'.format(identifier(c), k)
+                for c, k in zip(columns, key_columns))))
+
+    # type_ignore_reason: incomplete typing
+    backend: DatastorePostgresqlBackend = DatastoreBackend.\
+        get_active_backend()  # type: ignore
+    id_keys: List[Tuple[int, Tuple[str, ...]]] = []
+    with backend._get_read_engine().connect() as connection:
+        for i in range(0, len(keys), FETCH_RECORDS_BATCH_SIZE):
+            batch = keys[i:i + FETCH_RECORDS_BATCH_SIZE]
+            id_keys.extend(
+                (_id, batch[n - 1])
+                for n, _id in connection.execute(match_sql, {
+                    k: [key[n] for key in batch]
+                    for n, k in enumerate(key_columns)}))
+
+    for i in range(0, len(id_keys), FETCH_RECORDS_BATCH_SIZE):
+        batch_ids = id_keys[i:i + FETCH_RECORDS_BATCH_SIZE]
+        records = dict((r['_id'], r) for r in lc.action.datastore_search(
+            resource_id=resource_id,
+            filters={'_id': [_id for _id, _key in batch_ids]},
+            limit=len(batch_ids),
+            include_total=False)['records'])
+        for _id, key in batch_ids:
+            if _id in records:
+                matched.setdefault(key, []).append(records[_id])
+    return matched
+
+
 def _data_dictionary(dataset_type: str,
                      published_resource: bool = False,
                      org_name: Optional[str] = None) -> Response:
@@ -760,7 +884,8 @@ def preview_table(resource_name: str,
         try:
             # check if the dataset exists
             dataset = lc.action.recombinant_show(
-                dataset_type=chromo['dataset_type'], owner_org=owner_org)
+                dataset_type=chromo['dataset_type'], owner_org=owner_org,
+                row_count='none')
             # check that the resource has errors
             for _r in dataset['resources']:
                 if _r['name'] == resource_name and ('error' in _r or
@@ -878,7 +1003,8 @@ def _process_upload_file(lc: LocalCKAN,
                          dataset: Dict[str, Any],
                          upload_file: Union[str, FlaskFileStorage, FieldStorage],
                          geno: Dict[str, Any],
-                         dry_run: bool):
+                         dry_run: bool,
+                         progress: Optional[Callable[[int, int], None]] = None):
     """
     Use lc.action.datastore_upsert to load data from upload_file
 
@@ -886,6 +1012,18 @@ def _process_upload_file(lc: LocalCKAN,
 
     NOTE (2024-09-20): All sheets in an XLSX file need to pass validation
                        to be successfully committed to the database.
+
+    Unless recombinant.prevalidate_uploads is false every row in the file
+    is first checked with record_validator and the errors for all bad
+    rows are raised together before anything is written. The file is
+    then read a second time to load it, rather than keeping all of its
+    rows in memory.
+
+    Rows are upserted UPLOAD_CHUNK_SIZE records at a time on a single
+    datastore connection and committed together at the end.
+
+    progress(rows_parsed, rows_written) is called after each chunk when
+    passed, e.g. by upload_jobs.process_upload_job
     """
     owner_org = dataset['organization']['name']
 
@@ -900,157 +1038,120 @@ def _process_upload_file(lc: LocalCKAN,
         brs = get_geno(bt).get('resources', [])
         bad_sheet_names += [br['resource_name'] for br in brs]
 
-    # type_ignore_reason: incomplete typing
-    upload_data = read_excel(upload_file, expected_sheet_names.keys(),  # type: ignore
-                             bad_sheet_names)
     total_records = 0
+    written_records = 0
+    prevalidate = asbool(config.get('recombinant.prevalidate_uploads', True))
+    if prevalidate:
+        invalid_rows: List[str] = []
+        for sheet_name, chromo, record_iter in _upload_sheets(
+                upload_file, owner_org, expected_sheet_names,
+                bad_sheet_names):
+            validate = record_validator(chromo)
+            for row_number, record in record_iter:
+                total_records += 1
+                record_errors = validate(record)
+                if record_errors:
+                    invalid_rows.append(
+                        _('Sheet {0} Row {1}:').format(sheet_name, row_number)
+                        + ' '
+                        + _record_errors_text(sheet_name, record_errors))
+                if progress and not total_records % UPLOAD_CHUNK_SIZE:
+                    progress(total_records, written_records)
+        if invalid_rows:
+            messages = invalid_rows[:UPLOAD_MAX_REPORTED_ERRORS]
+            if len(invalid_rows) > UPLOAD_MAX_REPORTED_ERRORS:
+                messages.append(_('{0} more rows with errors').format(
+                    len(invalid_rows) - UPLOAD_MAX_REPORTED_ERRORS))
+            raise BadExcelData('\n'.join(messages))
+        if not total_records:
+            raise BadExcelData(_("The template uploaded is empty"))
+
     # type_ignore_reason: incomplete typing
     backend: DatastorePostgresqlBackend = DatastoreBackend.\
         get_active_backend()  # type: ignore
     ds_write_connection = backend._get_write_engine().connect()
     ds_write_transaction = ds_write_connection.begin()
     try:
-        while True:
-            try:
-                sheet_name, org_name, column_names, rows = next(upload_data)
-            except StopIteration:
-                break
-            except BadExcelData as e:
-                raise e
-            except Exception as e:
-                log.info('Unexpected error while uploading Recombinant file:')
-                log.info(e)
-                # unfortunately this can fail in all sorts of ways
-                if asbool(config.get('debug', False)):
-                    # on debug we want the real error
-                    raise
-                raise BadExcelData(
-                    _("The server encountered a problem processing the file "
-                      "uploaded. Please try copying your data into the latest "
-                      "version of the template and uploading again. If this "
-                      "problem continues, send your Excel file to "
-                      "{support} so we may investigate.").format(
-                          support=h.support_email_address()))
-
-            if sheet_name not in expected_sheet_names:
-                raise BadExcelData(_('Invalid file for this data type. ' +
-                                     'Sheet must be labeled "{0}", ' +
-                                     'but you supplied a sheet labeled "{1}"').format(
-                                        '"/"'.join(sorted(expected_sheet_names)),
-                                        sheet_name))
-
-            if not h.check_access('datastore_upsert',
-                                  {'resource_id': expected_sheet_names[sheet_name]}):
-                return abort(403, _('User {0} not authorized to update resource {1}'
-                                    .format(str(g.user),
-                                            expected_sheet_names[sheet_name])))
-
-            if org_name != owner_org:
-                raise BadExcelData(_(
-                    'Invalid sheet for this organization. ' +
-                    'Sheet must be labeled for {0}, ' +
-                    'but you supplied a sheet for {1}').format(
-                        owner_org, org_name))
-
-            # custom styles or other errors cause columns to be read
-            # that actually have no data. strip them here to avoid error below
-            while column_names and column_names[-1] is None:
-                column_names.pop()
-
-            chromo = get_chromo(sheet_name)
-            expected_columns = [f['datastore_id'] for f in chromo['fields']
-                                if f.get('import_template_include', True) and
-                                not f.get('published_resource_computed_field')]
-            if column_names != expected_columns:
-                raise BadExcelData(
-                    _("This template is out of date. "
-                      "Please try copying your data into the latest "
-                      "version of the template and uploading again. If this "
-                      "problem continues, send your Excel file to "
-                      "{support} so we may investigate.").format(
-                          support=h.support_email_address()))
-
+        for sheet_name, chromo, record_iter in _upload_sheets(
+                upload_file, owner_org, expected_sheet_names,
+                bad_sheet_names):
             pk = chromo.get('datastore_primary_key', [])
-            choice_fields = {
-                f['datastore_id']:
-                    'full' if f.get('excel_full_text_choices') else True
-                for f in chromo['fields']
-                if ('choices' in f or 'choices_file' in f)}
-
-            records = get_records(
-                rows,
-                [f for f in chromo['fields'] if f.get(
-                    'import_template_include', True) and not f.get(
-                        'published_resource_computed_field')],
-                pk,
-                choice_fields)
             method = 'upsert' if pk else 'insert'
-            total_records += len(records)
-            if not records:
-                continue
-            try:
-                lc.call_action('datastore_upsert', data_dict=dict(
-                        method=method,
-                        resource_id=expected_sheet_names[sheet_name],
-                        records=[r[1] for r in records],
-                        dry_run=dry_run),
-                    context={'connection': ds_write_connection}
-                )
-            except ValidationError as e:
-                if 'constraint_info' in e.error_dict:
-                    # type_ignore_reason: incomplete typing
-                    pgerror = e.error_dict['errors'][  # type: ignore
-                        'foreign_constraint'][0]
-                elif 'info' in e.error_dict:
-                    # because, where else would you put the error text?
-                    # XXX improve this in datastore, please
-                    # type_ignore_reason: incomplete typing
-                    pgerror = e.error_dict['info']['orig'][0].decode(  # type: ignore
-                        'utf-8')
-                elif 'fields' in e.error_dict:
-                    # type_ignore_reason: incomplete typing
-                    pgerror = e.error_dict['fields'][0]  # type: ignore
-                    key = re.search(KEY_ERROR_MATCH, str(pgerror))
-                    if key:
-                        key = key.group(1)
-                    else:
-                        key = _('unknown')
-                    raise RecombinantFieldError(key)
-                else:
-                    # type_ignore_reason: incomplete typing
-                    pgerror = e.error_dict['records'][0]  # type: ignore
-                if isinstance(pgerror, dict):
-                    pgerror = '; '.join(
-                        (h.recombinant_language_text(
-                            h.recombinant_get_field(sheet_name, k)['label']) if
-                            h.recombinant_get_field(sheet_name, k) else k) + _(':')
-                        + ' ' + ', '.join(format_trigger_error(v))
-                        for k, v in pgerror.items())
-                else:
-                    # remove some postgres-isms that won't help the user
-                    # when we render this as an error in the form
-                    pgerror = re.sub(r'\nLINE \d+:', '', pgerror)
-                    pgerror = re.sub(r'\n *\^\n$', '', pgerror)
-                if 'records_row' in e.error_dict:
+            while True:
+                # upsert in chunks to limit memory use and statement size,
+                # all chunks are committed or rolled back together below
+                records = list(islice(record_iter, UPLOAD_CHUNK_SIZE))
+                if not records:
+                    break
+                if not prevalidate:
+                    total_records += len(records)
+                try:
+                    lc.call_action('datastore_upsert', data_dict=dict(
+                            method=method,
+                            resource_id=expected_sheet_names[sheet_name],
+                            records=[r[1] for r in records],
+                            dry_run=dry_run),
+                        context={'connection': ds_write_connection}
+                    )
+                except ValidationError as e:
                     if 'constraint_info' in e.error_dict:
-                        pgerror = _render_recombinant_constraint_errors(
-                            lc, e, chromo, 'upsert')
-                    elif 'invalid input syntax for type integer' in pgerror:
-                        if ':' in pgerror:
-                            pgerror = _('Invalid input syntax for type integer: {}')\
-                                .format(pgerror.split(':')[1].strip())
+                        # type_ignore_reason: incomplete typing
+                        pgerror = e.error_dict['errors'][  # type: ignore
+                            'foreign_constraint'][0]
+                    elif 'info' in e.error_dict:
+                        # because, where else would you put the error text?
+                        # XXX improve this in datastore, please
+                        # type_ignore_reason: incomplete typing
+                        pgerror = e.error_dict[  # type: ignore
+                            'info']['orig'][0].decode('utf-8')
+                    elif 'fields' in e.error_dict:
+                        # type_ignore_reason: incomplete typing
+                        pgerror = e.error_dict['fields'][0]  # type: ignore
+                        key = re.search(KEY_ERROR_MATCH, str(pgerror))
+                        if key:
+                            key = key.group(1)
                         else:
-                            pgerror = _('Invalid input syntax for type integer')
+                            key = _('unknown')
+                        raise RecombinantFieldError(key)
+                    else:
+                        # type_ignore_reason: incomplete typing
+                        pgerror = e.error_dict['records'][0]  # type: ignore
+                    if isinstance(pgerror, dict):
+                        pgerror = '; '.join(
+                            (h.recombinant_language_text(
+                                h.recombinant_get_field(sheet_name, k)['label']) if
+                                h.recombinant_get_field(sheet_name, k) else k) + _(':')
+                            + ' ' + ', '.join(format_trigger_error(v))
+                            for k, v in pgerror.items())
+                    else:
+                        # remove some postgres-isms that won't help the user
+                        # when we render this as an error in the form
+                        pgerror = re.sub(r'\nLINE \d+:', '', pgerror)
+                        pgerror = re.sub(r'\n *\^\n$', '', pgerror)
+                    if 'records_row' in e.error_dict:
+                        if 'constraint_info' in e.error_dict:
+                            pgerror = _render_recombinant_constraint_errors(
+                                lc, e, chromo, 'upsert')
+                        elif 'invalid input syntax for type integer' in pgerror:
+                            if ':' in pgerror:
+                                pgerror = _(
+                                    'Invalid input syntax for type integer: {}'
+                                ).format(pgerror.split(':')[1].strip())
+                            else:
+                                pgerror = _('Invalid input syntax for type integer')
+                        raise BadExcelData(
+                            _('Sheet {0} Row {1}:').format(
+                                sheet_name,
+                                # type_ignore_reason: incomplete typing
+                                records[e.error_dict['records_row']][0])  # type: ignore
+                            + ' '
+                            + pgerror)
                     raise BadExcelData(
-                        _('Sheet {0} Row {1}:').format(
-                            sheet_name,
-                            # type_ignore_reason: incomplete typing
-                            records[e.error_dict['records_row']][0])  # type: ignore
-                        + ' '
-                        + pgerror)
-                raise BadExcelData(
-                    _("Error while importing data: {0}").format(
-                        pgerror))
+                        _("Error while importing data: {0}").format(
+                            pgerror))
+                written_records += len(records)
+                if progress:
+                    progress(total_records, written_records)
         if not total_records:
             raise BadExcelData(_("The template uploaded is empty"))
         if dry_run:
@@ -1064,6 +1165,101 @@ def _process_upload_file(lc: LocalCKAN,
         ds_write_connection.close()
 
 
+def _upload_sheets(upload_file: Union[str, FlaskFileStorage, FieldStorage],
+                   owner_org: str,
+                   expected_sheet_names: Dict[str, str],
+                   bad_sheet_names: List[str]) -> Iterator[
+                       Tuple[str, Dict[str, Any], Iterator[Any]]]:
+    """
+    Read the sheets in upload_file, checking that each one is expected,
+    may be updated by the user, belongs to owner_org and matches the
+    current template.
+
+    Produces (sheet_name, chromo, records) for each sheet where records
+    are (row_number, record) pairs from iter_records
+    """
+    # type_ignore_reason: incomplete typing
+    upload_data = read_excel(upload_file, expected_sheet_names.keys(),  # type: ignore
+                             bad_sheet_names)
+    while True:
+        try:
+            sheet_name, org_name, column_names, rows = next(upload_data)
+        except StopIteration:
+            return
+        except BadExcelData as e:
+            raise e
+        except Exception as e:
+            log.info('Unexpected error while uploading Recombinant file:')
+            log.info(e)
+            # unfortunately this can fail in all sorts of ways
+            if asbool(config.get('debug', False)):
+                # on debug we want the real error
+                raise
+            raise BadExcelData(
+                _("The server encountered a problem processing the file "
+                  "uploaded. Please try copying your data into the latest "
+                  "version of the template and uploading again. If this "
+                  "problem continues, send your Excel file to "
+                  "{support} so we may investigate.").format(
+                      support=h.support_email_address()))
+
+        if sheet_name not in expected_sheet_names:
+            raise BadExcelData(_('Invalid file for this data type. ' +
+                                 'Sheet must be labeled "{0}", ' +
+                                 'but you supplied a sheet labeled "{1}"').format(
+                                    '"/"'.join(sorted(expected_sheet_names)),
+                                    sheet_name))
+
+        if not h.check_access('datastore_upsert',
+                              {'resource_id': expected_sheet_names[sheet_name]}):
+            abort(403, _('User {0} not authorized to update resource {1}'
+                         .format(str(g.user),
+                                 expected_sheet_names[sheet_name])))
+
+        if org_name != owner_org:
+            raise BadExcelData(_(
+                'Invalid sheet for this organization. ' +
+                'Sheet must be labeled for {0}, ' +
+                'but you supplied a sheet for {1}').format(
+                    owner_org, org_name))
+
+        # custom styles or other errors cause columns to be read
+        # that actually have no data. strip them here to avoid error below
+        while column_names and column_names[-1] is None:
+            column_names.pop()
+
+        chromo = get_chromo(sheet_name)
+        field_index = get_field_index(chromo)
+        if column_names != list(field_index.template_column_ids):
+            raise BadExcelData(
+                _("This template is out of date. "
+                  "Please try copying your data into the latest "
+                  "version of the template and uploading again. If this "
+                  "problem continues, send your Excel file to "
+                  "{support} so we may investigate.").format(
+                      support=h.support_email_address()))
+
+        yield sheet_name, chromo, iter_records(
+            rows,
+            list(field_index.template_fields),
+            chromo.get('datastore_primary_key', []),
+            dict(field_index.choice_modes))
+
+
+def _record_errors_text(sheet_name: str, errors: Dict[str, List[str]]) -> str:
+    """
+    Format {datastore_id: [error, ...]} from record_validator using the
+    field labels
+    """
+    parts = []
+    for datastore_id, field_errors in errors.items():
+        field = h.recombinant_get_field(sheet_name, datastore_id)
+        label = h.recombinant_language_text(
+            field['label']) if field else datastore_id
+        parts.append(label + _(':') + ' ' + ', '.join(field_errors))
+    return '; '.join(parts)
+
+
 def _render_recombinant_constraint_errors(lc: LocalCKAN,
                                           exception: Exception,
                                           chromo: Dict[str, Any],
@@ -4,9 +4,11 @@ Excel v3 template and data-dictionary generation code
 """
 import textwrap
 import string
+from copy import copy
 from openpyxl import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell import Cell
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.cell import Cell, WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.formatting.rule import FormulaRule
 from openpyxl.worksheet.datavalidation import DataValidation
@@ -18,15 +20,15 @@ from openpyxl.styles import (
     Font
 )
 
-from typing import Any, Dict, List, Tuple, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Optional, Union
 
-from ckanext.recombinant.tables import get_geno
+from ckanext.recombinant.tables import get_geno, get_field_index
 from ckanext.recombinant.errors import RecombinantException, RecombinantFieldError
 from ckanext.recombinant.datatypes import datastore_type
 from ckanext.recombinant.helpers import (
     recombinant_choice_fields, recombinant_language_text)
 
-from ckan.plugins.toolkit import _, h, config, request
+from ckan.plugins.toolkit import _, h, asbool, config, request
 from flask_babel import force_locale
 
 from datetime import datetime
@@ -46,6 +48,8 @@ EXAMPLE_MERGE = 'A5:B5'
 FREEZE_PANES = 'C5'
 DATA_FIRST_ROW, DEFAULT_DATA_HEIGHT = 6, 24
 DEFAULT_DATA_NUM_ROWS = 2000
+# compact templates check data entry columns down to the last excel row
+EXCEL_LAST_ROW = 1048576
 RSTATUS_COL, RSTATUS_COL_NUM = 'A', 1
 RSTATUS_WIDTH = 1
 RPAD_COL, RPAD_COL_NUM = 'B', 2
@@ -115,10 +119,20 @@ TYPE_HERE_STYLE = {
 
 
 def excel_template(dataset_type: str,
-                   org: Dict[str, Any]) -> Workbook:
+                   org: Dict[str, Any],
+                   write_only: bool = False,
+                   compact: Optional[bool] = None) -> Workbook:
     """
     return an openpyxl.Workbook object containing the sheet and header fields
     for passed dataset_type and org. Supports version 3 templates.
+
+    write_only - stream the sheets row by row into a write-only workbook
+        to use less memory and time. The workbook returned can only be saved.
+    compact - style the data entry columns instead of each data entry cell,
+        use the default row height for data entry rows and check the data
+        entry columns with conditional formatting instead of the e/r
+        calculation sheets. None to use the recombinant.compact_templates
+        setting.
     """
     geno = get_geno(dataset_type)
     version = geno.get('template_version', DEFAULT_TEMPLATE_VERSION)
@@ -126,6 +140,12 @@ def excel_template(dataset_type: str,
     if version < DEFAULT_TEMPLATE_VERSION:
         raise RecombinantException(_('Unsupported template version: %s') % version)
 
+    if compact is None:
+        compact = compact_templates()
+
+    if write_only:
+        return _excel_template_write_only(geno, org, compact)
+
     book = Workbook()
     # type_ignore_reason: incomplete typing
     sheet: Worksheet = book.active  # type: ignore
@@ -138,7 +158,7 @@ def excel_template(dataset_type: str,
         if version == 3:
             _append_resource_ref_header(geno, refs, rnum)
             choice_ranges.append(_populate_excel_sheet(
-                book, sheet, geno, chromo, org, refs, rnum))
+                book, sheet, geno, chromo, org, refs, rnum, compact=compact))
             sheet.protection.enabled = SHEET_PROTECTION
             sheet.protection.formatRows = False
             sheet.protection.formatColumns = False
@@ -150,7 +170,7 @@ def excel_template(dataset_type: str,
     sheet.title = 'reference'
     sheet.protection.enabled = SHEET_PROTECTION
 
-    if version == 2:
+    if version == 2 or compact:
         return book
 
     for i, (chromo, cranges) in enumerate(
@@ -170,6 +190,137 @@ def excel_template(dataset_type: str,
     return book
 
 
+def compact_templates() -> bool:
+    """
+    True when templates are generated in compact mode by default
+    """
+    return asbool(config.get('recombinant.compact_templates', False))
+
+
+def _excel_template_write_only(geno: Dict[str, Any],
+                               org: Dict[str, Any],
+                               compact: bool = False) -> Workbook:
+    """
+    Version 3 template as a write-only workbook. The header rows and
+    reference sheet are built in scratch worksheets that are then copied,
+    data entry rows and calculation sheets are generated one row at a time.
+    """
+    book = Workbook(write_only=True)
+    refs = []
+    choice_ranges = []
+
+    _build_styles(book, geno)
+    for rnum, chromo in enumerate(geno['resources'], 1):
+        _append_resource_ref_header(geno, refs, rnum)
+        scratch = Worksheet(book)
+        choice_ranges.append(_populate_excel_sheet(
+            book, scratch, geno, chromo, org, refs, rnum, data_rows=False,
+            compact=compact))
+        scratch.protection.enabled = SHEET_PROTECTION
+        scratch.protection.formatRows = False
+        scratch.protection.formatColumns = False
+        _stream_sheet(
+            book.create_sheet(scratch.title),
+            scratch,
+            () if compact else _excel_data_rows(book, chromo, rnum))
+
+    scratch = Worksheet(book)
+    _populate_reference_sheet(scratch, geno, refs)
+    scratch.protection.enabled = SHEET_PROTECTION
+    _stream_sheet(book.create_sheet('reference'), scratch)
+
+    if compact:
+        return book
+
+    for i, (chromo, cranges) in enumerate(
+            zip(geno['resources'], choice_ranges), 1):
+        for title, rows in (
+                ('e{i}', _status_sheet_rows(
+                    chromo, _e_sheet_formulas(chromo, cranges))),
+                ('r{i}', _status_sheet_rows(
+                    chromo, _r_sheet_formulas(chromo), has_data=True))):
+            sheet = book.create_sheet(title.format(i=i))
+            sheet.protection.enabled = SHEET_PROTECTION
+            sheet.sheet_state = 'hidden'
+            _stream_sheet(sheet, None, (
+                (row, values, None) for row, values in rows))
+    return book
+
+
+def _excel_data_rows(book: Workbook,
+                     chromo: Dict[str, Any],
+                     resource_num: int) -> Iterator[
+                         Tuple[int, Dict[int, Any], Optional[float]]]:
+    """
+    Generate (row, {col_num: value or cell}, height) for the data entry
+    rows of a resource sheet, matching _populate_excel_sheet(data_rows=True)
+    """
+    data_num_rows = chromo.get('excel_data_num_rows', DEFAULT_DATA_NUM_ROWS)
+    height = chromo.get('excel_data_height', DEFAULT_DATA_HEIGHT)
+    scratch = Worksheet(book)
+    col_styles = []
+    for col_num, _field in template_cols_fields(chromo):
+        c = scratch.cell(row=1, column=col_num)
+        c.style = _data_style_name(resource_num, col_num)
+        col_styles.append((col_num, c._style))
+
+    for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
+        values = {RSTATUS_COL_NUM: _row_status_link_formula(resource_num, i)}
+        for col_num, style in col_styles:
+            c = WriteOnlyCell(scratch)
+            c._style = copy(style)
+            values[col_num] = c
+        yield i, values, height
+
+
+def _stream_sheet(sheet: WriteOnlyWorksheet,
+                  scratch: Optional[Worksheet],
+                  rows: Iterable[Tuple[
+                      int, Dict[int, Any], Optional[float]]] = ()):
+    """
+    Write the cells and sheet settings from scratch worksheet to a
+    write-only sheet, with the generated (row, {col_num: value}, height)
+    rows added to the scratch rows.
+    """
+    cells: Dict[int, Dict[int, Any]] = {}
+    if scratch is not None:
+        for attr in ('column_dimensions', 'row_dimensions', 'merged_cells',
+                     'data_validations', 'conditional_formatting',
+                     'protection', 'views', 'sheet_format'):
+            setattr(sheet, attr, getattr(scratch, attr))
+        for (row, col_num), c in scratch._cells.items():
+            if c._value is None and not c.has_style and not c.hyperlink:
+                continue
+            wc = WriteOnlyCell(sheet, c._value)
+            wc.data_type = c.data_type
+            wc._style = copy(c._style)
+            if c.hyperlink:
+                wc.hyperlink = copy(c.hyperlink)
+            cells.setdefault(row, {})[col_num] = wc
+
+    last_row = max(cells, default=0)
+    row_num = 1
+    for row, values, height in rows:
+        while row_num < row:
+            _append_row(sheet, cells.pop(row_num, {}))
+            row_num += 1
+        values.update(cells.pop(row_num, {}))
+        if height is not None:
+            sheet.row_dimensions[row_num].height = height
+        _append_row(sheet, values)
+        if height is not None:
+            # written, no need to keep
+            del sheet.row_dimensions[row_num]
+        row_num += 1
+    while row_num <= last_row:
+        _append_row(sheet, cells.pop(row_num, {}))
+        row_num += 1
+
+
+def _append_row(sheet: WriteOnlyWorksheet, values: Dict[int, Any]):
+    sheet.append([values.get(c) for c in range(1, max(values, default=0) + 1)])
+
+
 def append_data(book: Workbook,
                 record_data: List[Dict[str, Any]],
                 chromo: Dict[str, Any]):
@@ -186,7 +337,13 @@ def append_data(book: Workbook,
                 raise RecombinantFieldError(field['datastore_id'])
             item = datastore_type_format(
                 record[field['datastore_id']], field['datastore_type'])
-            sheet.cell(row=current_row, column=col_num).value = item
+            c = sheet.cell(row=current_row, column=col_num)
+            c.value = item
+            if not c.has_style:
+                # compact templates style columns instead of cells
+                col = sheet.column_dimensions[get_column_letter(col_num)]
+                if col.has_style:
+                    c._style = copy(col._style)
         current_row += 1
 
     return book
@@ -334,7 +491,9 @@ def _populate_excel_sheet(book: Workbook,
                           chromo: Dict[str, Any],
                           org: Dict[str, Any],
                           refs: List[Tuple[Optional[str], List[Any]]],
-                          resource_num: int) -> Dict[str, Any]:
+                          resource_num: int,
+                          data_rows: bool = True,
+                          compact: bool = False) -> Dict[str, Any]:
     """
     Format openpyxl sheet for the resource definition chromo and org.
     (Version 3)
@@ -342,6 +501,12 @@ def _populate_excel_sheet(book: Workbook,
     refs - list of rows to add to reference sheet, modified
         in place from this function
     resource_num - 1-based index of resource
+    data_rows - False to skip styling and formulas for the data entry rows,
+        these are written by _excel_data_rows for write-only workbooks
+    compact - style data entry columns instead of cells, use the
+        data entry row height as the default row height and check the
+        data entry columns with conditional formatting down to the last
+        row, for templates without e/r calculation sheets
 
     returns cranges dict of {datastore_id: reference_key_range}
     """
@@ -363,9 +528,13 @@ def _populate_excel_sheet(book: Workbook,
     example_style = dict(
         DEFAULT_EXAMPLE_STYLE, **geno.get('excel_example_style', {}))
 
-    # create rows so we can set all heights
-    for i in range(1, DATA_FIRST_ROW + data_num_rows):
-        sheet.cell(row=i, column=1).value = None
+    if data_rows and not compact:
+        # create rows so we can set all heights
+        for i in range(1, DATA_FIRST_ROW + data_num_rows):
+            sheet.cell(row=i, column=1).value = None
+
+    data_last_row = EXCEL_LAST_ROW if compact else (
+        DATA_FIRST_ROW + data_num_rows - 1)
 
     sheet.merge_cells(EXAMPLE_MERGE)
     fill_cell(sheet, EXAMPLE_ROW, 1, _('e.g.'), 'reco_example')
@@ -374,6 +543,9 @@ def _populate_excel_sheet(book: Workbook,
         sheet,
         DATA_FIRST_ROW,
         RPAD_COL_NUM,
+        '=IF({has_data},"","▶")'.format(
+            has_data=_has_data_formula(chromo, DATA_FIRST_ROW))
+        if compact else
         '=IF(r{rnum}!{col}{row},"","▶")'.format(
             rnum=resource_num,
             col=RPAD_COL,
@@ -445,11 +617,13 @@ def _populate_excel_sheet(book: Workbook,
 
         col_letter = get_column_letter(col_num)
 
-        # jump to first error/required cell in column
+        # jump to first error/required cell in column, compact templates
+        # have no calculation sheets to find it
         fill_cell(
             sheet,
             CSTATUS_ROW,
             col_num,
+            None if compact else
             '=IF(e{rnum}!{col}{row}>0,HYPERLINK("#{col}"&e{rnum}!{col}{row},"")'
             ',IF(r{rnum}!{col}{row}>0,HYPERLINK("#{col}"&r{rnum}!{col}{row},""),""))'
             .format(rnum=resource_num, col=col_letter, row=CSTATUS_ROW),
@@ -464,18 +638,23 @@ def _populate_excel_sheet(book: Workbook,
         validation_range = '{col}{row1}:{col}{rowN}'.format(
             col=col_letter,
             row1=DATA_FIRST_ROW,
-            rowN=DATA_FIRST_ROW + data_num_rows - 1)
+            rowN=data_last_row)
 
         xl_format = datastore_type[field['datastore_type']].xl_format
         alignment = Alignment(wrap_text=True)
         col_style = NamedStyle(
-            name='reco_{0}{1}'.format(resource_num, col_letter),
+            name=_data_style_name(resource_num, col_num),
             number_format=xl_format,
             alignment=alignment,
             protection=Protection(locked=False))
         book.add_named_style(col_style)
-        for (c,) in sheet[validation_range]:
-            c.style = col_style.name
+        if compact:
+            style_cell = Cell(sheet)
+            style_cell.style = col_style.name
+            col._style = copy(style_cell._style)
+        elif data_rows:
+            for (c,) in sheet[validation_range]:
+                c.style = col_style.name
         ex_cell = sheet.cell(row=EXAMPLE_ROW, column=col_num)
         ex_cell.number_format = xl_format
         ex_cell.alignment = alignment
@@ -553,30 +732,37 @@ def _populate_excel_sheet(book: Workbook,
                 colZ=REF_VALUE_COL,
                 rowN=len(refs) + REF_FIRST_ROW - 2))
 
-    _add_conditional_formatting(
-        sheet,
-        col_letter,
-        resource_num,
-        error_style,
-        required_style,
-        data_num_rows)
+    if compact:
+        _add_compact_conditional_formatting(
+            sheet,
+            chromo,
+            cranges,
+            error_style,
+            required_style)
+    else:
+        _add_conditional_formatting(
+            sheet,
+            col_letter,
+            resource_num,
+            error_style,
+            required_style,
+            data_num_rows)
 
     sheet.row_dimensions[HEADER_ROW].height = HEADER_HEIGHT
     sheet.row_dimensions[CODE_ROW].hidden = True
     sheet.row_dimensions[CSTATUS_ROW].height = CSTATUS_HEIGHT
     sheet.row_dimensions[EXAMPLE_ROW].height = chromo.get(
         'excel_example_height', DEFAULT_EXAMPLE_HEIGHT)
-    for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
-        sheet.row_dimensions[i].height = chromo.get(
+    if compact:
+        sheet.sheet_format.defaultRowHeight = chromo.get(
             'excel_data_height', DEFAULT_DATA_HEIGHT)
-
-        # jump to first error/required cell in row
-        sheet.cell(row=i, column=RSTATUS_COL_NUM).value = (
-            '=IF(e{rnum}!{col}{row}>0,'
-            'HYPERLINK("#"&ADDRESS({row},e{rnum}!{col}{row}),""),'
-            'IF(r{rnum}!{col}{row}>0,'
-            'HYPERLINK("#"&ADDRESS({row},r{rnum}!{col}{row}),""),""))'
-            .format(rnum=resource_num, col=RSTATUS_COL, row=i))
+        sheet.sheet_format.customHeight = True
+    elif data_rows:
+        for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
+            sheet.row_dimensions[i].height = chromo.get(
+                'excel_data_height', DEFAULT_DATA_HEIGHT)
+            sheet.cell(row=i, column=RSTATUS_COL_NUM).value = (
+                _row_status_link_formula(resource_num, i))
 
     sheet.column_dimensions[RSTATUS_COL].width = RSTATUS_WIDTH
     sheet.column_dimensions[RPAD_COL].width = RPAD_WIDTH
@@ -600,6 +786,22 @@ def _populate_excel_sheet(book: Workbook,
     return cranges
 
 
+def _data_style_name(resource_num: int, col_num: int) -> str:
+    return 'reco_{0}{1}'.format(resource_num, get_column_letter(col_num))
+
+
+def _row_status_link_formula(resource_num: int, row: int) -> str:
+    """
+    jump to first error/required cell in row
+    """
+    return (
+        '=IF(e{rnum}!{col}{row}>0,'
+        'HYPERLINK("#"&ADDRESS({row},e{rnum}!{col}{row}),""),'
+        'IF(r{rnum}!{col}{row}>0,'
+        'HYPERLINK("#"&ADDRESS({row},r{rnum}!{col}{row}),""),""))'
+        .format(rnum=resource_num, col=RSTATUS_COL, row=row))
+
+
 def _append_resource_ref_header(geno: Dict[str, Any],
                                 refs: List[Tuple[Optional[str], List[Any]]],
                                 rnum: int):
@@ -827,9 +1029,16 @@ def _populate_excel_e_sheet(sheet: Worksheet,
     Other cells are 1 for error, 0 or blank for no error or no value
     in the corresponding cell on the data entry sheet.
     """
-    col = None
-    data_num_rows = chromo.get('excel_data_num_rows', DEFAULT_DATA_NUM_ROWS)
+    _populate_status_sheet(sheet, chromo, _e_sheet_formulas(chromo, cranges))
+
 
+def _e_sheet_formulas(chromo: Dict[str, Any],
+                      cranges: Dict[str, Any]) -> List[Tuple[int, str]]:
+    """
+    return [(col_num, formula)] for the "error" calculation worksheet
+    where formula contains {num} to be replaced with the row number
+    """
+    formulas = []
     for col_num, field in template_cols_fields(chromo):
         pk_field = field['datastore_id'] in chromo['datastore_primary_key']
 
@@ -889,7 +1098,7 @@ def _populate_excel_e_sheet(sheet: Worksheet,
         if pk_field:
             # repeated primary (composite) keys are errors
             pk_fmla = 'SUMPRODUCT(' + ','.join(
-                "--(TRIM('{sheet}'!{col}{top}:{col}{{num}})"
+                "--(TRIM('{sheet}'!{col}${top}:{col}{{num}})"
                 "=TRIM('{sheet}'!{col}{{num}}))".format(
                     sheet=chromo['resource_name'],
                     col=get_column_letter(cn),
@@ -914,38 +1123,18 @@ def _populate_excel_e_sheet(sheet: Worksheet,
                 for cn, f in template_cols_fields(chromo)
                 if f['datastore_id'] in fmla_keys}
 
-        col = get_column_letter(col_num)
         cell = "'{sheet}'!{col}{{num}}".format(
             sheet=chromo['resource_name'],
-            col=col)
+            col=get_column_letter(col_num))
         fmla = '=NOT({cell}="")*(' + fmla + ')'
-        for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
-            try:
-                sheet.cell(row=i, column=col_num).value = fmla.format(
-                    cell=cell,
-                    num='{num}',
-                    **fmla_values).format(num=i)
-            except KeyError:
-                assert 0, (fmla, fmla_values)
-
-        sheet.cell(row=CSTATUS_ROW, column=col_num).value = (
-            '=IFERROR(MATCH(TRUE,INDEX({col}{row1}:{col}{rowN}<>0,),)+{row0},0)'
-            .format(
-                col=col,
-                row1=DATA_FIRST_ROW,
-                row0=DATA_FIRST_ROW - 1,
-                rowN=DATA_FIRST_ROW + data_num_rows - 1))
-
-    if col is None:
-        return  # no errors to report on!
-
-    for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
-        sheet.cell(row=i, column=RSTATUS_COL_NUM).value = (
-            '=IFERROR(MATCH(TRUE,INDEX({colA}{row}:{colZ}{row}<>0,),)+{col0},0)'.format(
-                colA=DATA_FIRST_COL,
-                col0=DATA_FIRST_COL_NUM - 1,
-                colZ=col,
-                row=i))
+        try:
+            formulas.append((col_num, fmla.format(
+                cell=cell,
+                num='{num}',
+                **fmla_values)))
+        except KeyError:
+            assert 0, (fmla, fmla_values)
+    return formulas
 
 
 def _populate_excel_r_sheet(sheet: Worksheet,
@@ -962,9 +1151,20 @@ def _populate_excel_r_sheet(sheet: Worksheet,
     no value or not required fields in the corresponding cell on the
     data entry sheet
     """
-    col = None
-    data_num_rows = chromo.get('excel_data_num_rows', DEFAULT_DATA_NUM_ROWS)
+    _populate_status_sheet(
+        sheet, chromo, _r_sheet_formulas(chromo), has_data=True)
+
+
+def _r_sheet_formulas(chromo: Dict[str, Any],
+                      has_data: Optional[str] = None) -> List[Tuple[int, str]]:
+    """
+    return [(col_num, formula)] for the "required" calculation worksheet
+    where formula contains {num} to be replaced with the row number
 
+    has_data - formula TRUE when data is entered on the row, default: the
+        "B" column of the calculation worksheet
+    """
+    formulas = []
     for col_num, field in template_cols_fields(chromo):
         fmla = field.get('excel_required_formula')
         pk_field = field['datastore_id'] in chromo['datastore_primary_key']
@@ -993,39 +1193,72 @@ def _populate_excel_r_sheet(sheet: Worksheet,
                 for cn, f in template_cols_fields(chromo)
                 if f['datastore_id'] in fmla_keys}
 
-        for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
-            sheet.cell(row=i, column=col_num).value = fmla.format(
-                cell=cell,
-                has_data='{col}{{num}}'.format(col=RPAD_COL),
-                **fmla_values).format(num=i)
+        formulas.append((col_num, fmla.format(
+            cell=cell,
+            has_data=has_data or '{col}{{num}}'.format(col=RPAD_COL),
+            **fmla_values)))
+    return formulas
+
+
+def _populate_status_sheet(sheet: Worksheet,
+                           chromo: Dict[str, Any],
+                           formulas: List[Tuple[int, str]],
+                           has_data: bool = False):
+    """
+    Fill an "error" or "required" calculation worksheet with
+    _status_sheet_rows
+    """
+    for row, values in _status_sheet_rows(chromo, formulas, has_data):
+        for col_num, value in values.items():
+            sheet.cell(row=row, column=col_num).value = value
+
+
+def _status_sheet_rows(chromo: Dict[str, Any],
+                       formulas: List[Tuple[int, str]],
+                       has_data: bool = False) -> Iterator[
+                           Tuple[int, Dict[int, str]]]:
+    """
+    Generate (row, {col_num: formula}) for an "error" or "required"
+    calculation worksheet from formulas returned by _e_sheet_formulas
+    or _r_sheet_formulas
+
+    has_data - include the column that is TRUE when data is entered on
+        the corresponding row of the data entry sheet
+    """
+    if not formulas:
+        return
+    data_num_rows = chromo.get('excel_data_num_rows', DEFAULT_DATA_NUM_ROWS)
+    colZ = get_column_letter(formulas[-1][0])
 
-        sheet.cell(row=CSTATUS_ROW, column=col_num).value = (
+    yield CSTATUS_ROW, {
+        col_num:
             '=IFERROR(MATCH(TRUE,INDEX({col}{row1}:{col}{rowN}<>0,),)+{row0},0)'
             .format(
-                col=col,
+                col=get_column_letter(col_num),
                 row1=DATA_FIRST_ROW,
                 row0=DATA_FIRST_ROW - 1,
-                rowN=DATA_FIRST_ROW + data_num_rows - 1))
-
-    if col is None:
-        return  # no required columns
+                rowN=DATA_FIRST_ROW + data_num_rows - 1)
+        for col_num, _fmla in formulas}
 
     for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
-        sheet.cell(row=i, column=RPAD_COL_NUM).value = (
-            "=SUMPRODUCT(LEN('{sheet}'!{colA}{row}:{colZ}{row}))>0".format(
-                sheet=chromo['resource_name'],
-                colA=DATA_FIRST_COL,
-                colZ=col,
-                row=i))
-
-    for i in range(DATA_FIRST_ROW, DATA_FIRST_ROW + data_num_rows):
-        sheet.cell(row=i, column=RSTATUS_COL_NUM).value = (
-            '=IFERROR(MATCH(TRUE,INDEX({colA}{row}:{colZ}{row}<>0,),)+{col0},0)'
-            .format(
-                colA=DATA_FIRST_COL,
-                col0=DATA_FIRST_COL_NUM - 1,
-                colZ=col,
-                row=i))
+        values = {
+            RSTATUS_COL_NUM:
+                '=IFERROR(MATCH(TRUE,INDEX({colA}{row}:{colZ}{row}<>0,),)+{col0},0)'
+                .format(
+                    colA=DATA_FIRST_COL,
+                    col0=DATA_FIRST_COL_NUM - 1,
+                    colZ=colZ,
+                    row=i)}
+        if has_data:
+            values[RPAD_COL_NUM] = (
+                "=SUMPRODUCT(LEN('{sheet}'!{colA}{row}:{colZ}{row}))>0".format(
+                    sheet=chromo['resource_name'],
+                    colA=DATA_FIRST_COL,
+                    colZ=colZ,
+                    row=i))
+        for col_num, fmla in formulas:
+            values[col_num] = fmla.format(num=i)
+        yield i, values
 
 
 def fill_cell(sheet: Worksheet,
@@ -1099,12 +1332,22 @@ def org_title_lang_hack(title: str):
     return title.split(' | ')[0]
 
 
+def _has_data_formula(chromo: Dict[str, Any], row: Union[int, str]) -> str:
+    """
+    TRUE when any data is entered on row of the data entry sheet
+    """
+    return "(SUMPRODUCT(LEN('{sheet}'!${colA}{row}:${colZ}{row}))>0)".format(
+        sheet=chromo['resource_name'],
+        colA=DATA_FIRST_COL,
+        colZ=get_column_letter(
+            DATA_FIRST_COL_NUM + len(get_field_index(chromo).template_fields) - 1),
+        row=row)
+
+
 def template_cols_fields(chromo: Dict[str, Any]):
     ''' (col_num, field) ... for fields in template'''
     return enumerate(
-        (f for f in chromo['fields'] if f.get(
-            'import_template_include', True) and not f.get(
-                'published_resource_computed_field')), DATA_FIRST_COL_NUM)
+        get_field_index(chromo).template_fields, DATA_FIRST_COL_NUM)
 
 
 def _add_conditional_formatting(sheet: Worksheet,
@@ -1168,3 +1411,40 @@ def _add_conditional_formatting(sheet: Worksheet,
                 stopIfTrue=True,
                 fill=required_fill,
                 font=required_font))
+
+
+def _add_compact_conditional_formatting(sheet: Worksheet,
+                                        chromo: Dict[str, Any],
+                                        cranges: Dict[str, Any],
+                                        error_style: Dict[str, Any],
+                                        required_style: Dict[str, Any]):
+    '''
+    Error and required cell hilighting for compact templates, one rule
+    per data entry column using the e/r sheet formulas for the first data
+    entry row. Excel adjusts the relative references for each cell.
+    '''
+    error_fill = PatternFill(
+        bgColor=error_style['PatternFill']['fgColor'],
+        **error_style['PatternFill'])
+    error_font = Font(**error_style['Font'])
+    required_fill = PatternFill(
+        bgColor=required_style['PatternFill']['fgColor'],
+        **required_style['PatternFill'])
+    required_font = Font(**required_style['Font'])
+
+    # error rules are added first so they take priority
+    for formulas, fill, font in (
+            (_e_sheet_formulas(chromo, cranges), error_fill, error_font),
+            (_r_sheet_formulas(chromo, _has_data_formula(chromo, '{num}')),
+             required_fill, required_font)):
+        for col_num, fmla in formulas:
+            sheet.conditional_formatting.add(
+                '{col}{row1}:{col}{rowN}'.format(
+                    col=get_column_letter(col_num),
+                    row1=DATA_FIRST_ROW,
+                    rowN=EXCEL_LAST_ROW),
+                FormulaRule(
+                    [fmla.format(num=DATA_FIRST_ROW)[1:]],
+                    stopIfTrue=True,
+                    fill=fill,
+                    font=font))